@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+import corpus
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summary(times):
+    return 'median %7.1f ms  mean %7.1f ms  min %7.1f ms' % (statistics.median(times) * 1000, statistics.mean(times) * 1000, min(times) * 1000)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Per request latency of the conversion daemon against cold CLI invocations.')
+    arg_parser.add_argument('-l', '--language', choices=corpus.languages, default='ja', help='tag parser (default: ja)')
+    arg_parser.add_argument('--events', type=int, default=50, help='events per file (default: 50)')
+    arg_parser.add_argument('--requests', type=int, default=10, help='conversions per mode (default: 10)')
+    args = arg_parser.parse_args()
+
+    sys.path.insert(0, repo_dir)
+    from rubysubs import daemon
+
+    env = dict(os.environ, PYTHONPATH=repo_dir)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    with tempfile.TemporaryDirectory(prefix='rubysubs-bench-') as tmp_dir:
+        in_path = corpus.write_corpus(tmp_dir, [args.language], args.events)[args.language]
+        out_path = os.path.join(tmp_dir, 'out.ass')
+        socket_path = os.path.join(tmp_dir, 'rubysubs.sock')
+
+        cold = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-m', 'rubysubs', in_path, out_path, args.language], env=env, check=True, stderr=subprocess.DEVNULL)
+            cold.append(time.perf_counter() - start)
+
+        server = subprocess.Popen([sys.executable, '-m', 'rubysubs', 'daemon', socket_path], env=env, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(socket_path):
+                if server.poll() is not None:
+                    raise RuntimeError('Daemon exited')
+                time.sleep(0.05)
+
+            # New connection per request like a separate client process would use
+            warm = []
+            for i in range(args.requests + 1):
+                start = time.perf_counter()
+                with daemon.DaemonClient(socket_path) as client:
+                    client.convert_file(in_path, out_path, args.language)
+                elapsed = time.perf_counter() - start
+                if i > 0:
+                    warm.append(elapsed)
+                else:
+                    first = elapsed
+
+            with open(in_path, 'rb') as f:
+                subs_data = f.read()
+            data = []
+            with daemon.DaemonClient(socket_path) as client:
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    client.convert_data(subs_data, args.language)
+                    data.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print('%s, %d events, %d requests' % (args.language, args.events, args.requests))
+    print('cold CLI:           %s' % summary(cold))
+    print('daemon first:       %7.1f ms' % (first * 1000))
+    print('daemon path:        %s' % summary(warm))
+    print('daemon data:        %s' % summary(data))
+    print('speedup (median):   %.1fx' % (statistics.median(cold) / statistics.median(warm)))
+
+
+if __name__ == '__main__':
+    main()
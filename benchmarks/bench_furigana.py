@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Alternating kanji and kana groups with a reading made of the kana only. Every kanji group can take
+# any number of reading characters, which makes backtracking try exponentially many splits.
+def worst_case(group_pairs):
+    expression = '漢あ' * group_pairs
+    reading = 'あ' * (group_pairs * 3)
+    return expression, reading
+
+
+# Returns list of (group pairs, seconds), stops after the first size taking longer than max_seconds
+def run(max_pairs, max_seconds):
+    from rubysubs import ja_util
+
+    # Time the distribution itself, not the memo of distribute_furigana
+    distribute = getattr(ja_util, '_distribute_furigana', ja_util.distribute_furigana)
+
+    results = []
+    for group_pairs in range(1, max_pairs + 1):
+        expression, reading = worst_case(group_pairs)
+        start = time.perf_counter()
+        distribute(expression, reading)
+        elapsed = time.perf_counter() - start
+        results.append((group_pairs, elapsed))
+        if elapsed > max_seconds:
+            break
+    return results
+
+
+def run_in(checkout, args):
+    cmd = [sys.executable, os.path.abspath(__file__), '--json', '--max-pairs', str(args.max_pairs), '--max-seconds', str(args.max_seconds)]
+    env = dict(os.environ, PYTHONPATH=checkout)
+    out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE).stdout
+    return [tuple(r) for r in json.loads(out)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Worst case furigana distribution time by number of kanji/kana group pairs.')
+    arg_parser.add_argument('--max-pairs', type=int, default=40, help='largest number of group pairs (default: 40)')
+    arg_parser.add_argument('--max-seconds', type=float, default=2, help='stop after a size takes longer than this (default: 2)')
+    arg_parser.add_argument('--baseline', metavar='CHECKOUT', help='also run with the rubysubs checkout at this path and compare')
+    arg_parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = arg_parser.parse_args()
+
+    if args.json:
+        if os.environ.get('PYTHONPATH') is None:
+            sys.path.insert(0, repo_dir)
+        print(json.dumps(run(args.max_pairs, args.max_seconds)))
+        return
+
+    current = dict(run_in(repo_dir, args))
+    baseline = dict(run_in(os.path.abspath(args.baseline), args)) if args.baseline else {}
+
+    if baseline:
+        print('%-6s %12s %12s' % ('pairs', 'baseline/ms', 'current/ms'))
+    else:
+        print('%-6s %12s' % ('pairs', 'current/ms'))
+
+    for group_pairs in sorted(set(current) | set(baseline)):
+        cols = []
+        if baseline:
+            cols.append('%12.3f' % (baseline[group_pairs] * 1000) if group_pairs in baseline else '%12s' % '-')
+        cols.append('%12.3f' % (current[group_pairs] * 1000) if group_pairs in current else '%12s' % '-')
+        print('%-6d %s' % (group_pairs, ' '.join(cols)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules a plain "import rubysubs" must not load
+heavy_modules = ['PyQt5', 'pysubs2', 'cchardet', 'multiprocessing', 'rubysubs.tag_parse_migaku_ja', 'rubysubs.tag_parse_migaku_zh',
+                 'rubysubs.tag_parse_migaku_eu', 'rubysubs.tag_parse_migaku_ko', 'rubysubs.batch', 'rubysubs.daemon']
+
+commands = {
+    'python':           ['-c', 'pass'],
+    'import rubysubs':  ['-c', 'import rubysubs'],
+    'cli usage':        ['-m', 'rubysubs'],
+}
+
+
+def env_for(checkout):
+    return dict(os.environ, PYTHONPATH=checkout)
+
+
+# Not the checkout itself, python -c puts the working directory first on sys.path
+neutral_dir = os.path.dirname(repo_dir)
+
+
+# Returns the median wall time of running the command in seconds
+def time_command(checkout, args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, env=env_for(checkout), cwd=neutral_dir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+# Returns (cumulative import time of rubysubs in seconds, list of heavy modules loaded) using -X importtime
+def import_profile(checkout):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import rubysubs'], env=env_for(checkout), cwd=neutral_dir,
+                         stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True).stderr.decode()
+
+    cumulative = 0
+    loaded = set()
+    for line in out.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        name = name.strip()
+        if name == 'rubysubs':
+            cumulative = int(cumulative_us) / 1000000
+        for heavy in heavy_modules:
+            if name == heavy or name.startswith(heavy + '.'):
+                loaded.add(heavy)
+
+    return cumulative, sorted(loaded)
+
+
+def report(checkout, runs):
+    ret = {name: time_command(checkout, args, runs) for name, args in commands.items()}
+    ret['importtime'], ret['heavy'] = import_profile(checkout)
+    return ret
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Import and CLI startup time, like python -X importtime.')
+    arg_parser.add_argument('--runs', type=int, default=10, help='runs per command, the median is reported (default: 10)')
+    arg_parser.add_argument('--baseline', metavar='CHECKOUT', help='also measure the rubysubs checkout at this path')
+    arg_parser.add_argument('--check', action='store_true', help='exit with 1 if importing rubysubs loads heavy modules or takes longer than --max-ms')
+    arg_parser.add_argument('--max-ms', type=float, default=100, help='import time limit for --check (default: 100)')
+    args = arg_parser.parse_args()
+
+    results = [('current', report(repo_dir, args.runs))]
+    if args.baseline:
+        results.insert(0, ('baseline', report(os.path.abspath(args.baseline), args.runs)))
+
+    for label, r in results:
+        print('%s:' % label)
+        for name in commands:
+            extra = '' if name == 'python' else '  (+%.1f ms over python)' % ((r[name] - r['python']) * 1000)
+            print('  %-16s %7.1f ms%s' % (name, r[name] * 1000, extra))
+        print('  %-16s %7.1f ms' % ('-X importtime', r['importtime'] * 1000))
+        print('  %-16s %s' % ('heavy modules', ', '.join(r['heavy']) or '-'))
+
+    if args.check:
+        current = results[-1][1]
+        failed = False
+        if current['heavy']:
+            print('FAIL: import rubysubs loads %s' % ', '.join(current['heavy']))
+            failed = True
+        if current['importtime'] * 1000 > args.max_ms:
+            print('FAIL: import rubysubs takes %.1f ms, limit %.1f ms' % (current['importtime'] * 1000, args.max_ms))
+            failed = True
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
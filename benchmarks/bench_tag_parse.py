@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+
+from corpus import languages, sample_line
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tag_parser_for(language):
+    from rubysubs import tag_parse_ruby, tag_parse_migaku_ja, tag_parse_migaku_zh, tag_parse_migaku_eu, tag_parse_migaku_ko
+    return {
+        'ruby':     tag_parse_ruby.parser_from_string_args([]),
+        'ja':       tag_parse_migaku_ja.parser_from_string_args([]),
+        'zh':       tag_parse_migaku_zh.parser_from_string_args([]),
+        'zh_hk':    tag_parse_migaku_zh.parser_from_string_args_HK([]),
+        'ko':       tag_parse_migaku_ko.parser_from_string_args([]),
+        'eu':       tag_parse_migaku_eu.parser_from_string_args([]),
+    }[language]
+
+
+# Returns events per second for each language, best of repeat runs
+def run(event_count, repeat, seed):
+    results = {}
+    for language in languages:
+        rng = random.Random(seed)
+        events = ['\n'.join(sample_line(language, rng) for _ in range(rng.randint(1, 2))) for _ in range(event_count)]
+        tag_parser = tag_parser_for(language)
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for text in events:
+                tag_parser(text)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results[language] = event_count / best
+    return results
+
+
+def run_in(checkout, args):
+    cmd = [sys.executable, os.path.abspath(__file__), '--json', '--events', str(args.events), '--repeat', str(args.repeat), '--seed', str(args.seed)]
+    env = dict(os.environ, PYTHONPATH=checkout)
+    out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Tag parser throughput per language.')
+    arg_parser.add_argument('--events', type=int, default=5000, help='events per language (default: 5000)')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='runs per language, the best is reported (default: 5)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--baseline', metavar='CHECKOUT', help='also run with the rubysubs checkout at this path and compare')
+    arg_parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = arg_parser.parse_args()
+
+    if args.json:
+        if os.environ.get('PYTHONPATH') is None:
+            sys.path.insert(0, repo_dir)
+        print(json.dumps(run(args.events, args.repeat, args.seed)))
+        return
+
+    current = run_in(repo_dir, args)
+
+    if args.baseline is None:
+        print('%-8s %12s' % ('parser', 'events/s'))
+        for language in languages:
+            print('%-8s %12.0f' % (language, current[language]))
+        return
+
+    baseline = run_in(os.path.abspath(args.baseline), args)
+    print('%-8s %12s %12s %8s' % ('parser', 'baseline/s', 'current/s', 'speedup'))
+    for language in languages:
+        print('%-8s %12.0f %12.0f %7.2fx' % (language, baseline[language], current[language], current[language] / baseline[language]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import sys
+import json
+import argparse
+
+
+stage_order = ['read', 'decode', 'detect', 'load', 'setup', 'tag_parse', 'layout', 'save', 'total']
+
+
+# Known stages in conversion order, unknown ones after them
+def stage_key(stage):
+    if stage in stage_order:
+        return (stage_order.index(stage), '')
+    return (len(stage_order), stage)
+
+
+# Returns list of (language, stage, baseline seconds, current seconds, is_regression)
+def compare(baseline, current, threshold=0.1, min_delta=0.005):
+    ret = []
+    for language, current_times in sorted(current['results'].items()):
+        baseline_times = baseline['results'].get(language)
+        if baseline_times is None:
+            continue
+        for stage in sorted(current_times, key=stage_key):
+            current_time = current_times[stage]
+            baseline_time = baseline_times.get(stage)
+            if baseline_time is None:
+                continue
+            # Small absolute differences are noise, even if they are large relative to a fast stage
+            is_regression = current_time > baseline_time * (1 + threshold) and current_time - baseline_time > min_delta
+            ret.append((language, stage, baseline_time, current_time, is_regression))
+    return ret
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Compare benchmark results against a baseline, exits with 1 on regressions.')
+    arg_parser.add_argument('baseline', metavar='BASELINE_JSON')
+    arg_parser.add_argument('current', metavar='CURRENT_JSON')
+    arg_parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as regression (default: 0.1)')
+    arg_parser.add_argument('--min-delta', type=float, default=0.005, help='ignore slowdowns below this many seconds (default: 0.005)')
+    args = arg_parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline.get('settings') != current.get('settings'):
+        print('Warning: results were generated with different settings', file=sys.stderr)
+    if baseline.get('environment') != current.get('environment'):
+        print('Warning: results were generated in different environments', file=sys.stderr)
+
+    rows = compare(baseline, current, args.threshold, args.min_delta)
+
+    print('%-8s %-10s %10s %10s %8s' % ('parser', 'stage', 'baseline', 'current', 'change'))
+    for language, stage, baseline_time, current_time, is_regression in rows:
+        change = (current_time / baseline_time - 1) * 100 if baseline_time else 0
+        print('%-8s %-10s %9.3fs %9.3fs %+7.1f%%%s' % (language, stage, baseline_time, current_time, change, '  REGRESSION' if is_regression else ''))
+
+    regressions = sum(1 for row in rows if row[4])
+    print('%d regressions.' % regressions)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
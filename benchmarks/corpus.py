@@ -0,0 +1,111 @@
+import os
+import random
+import argparse
+
+import pysubs2
+
+
+languages = ['ruby', 'ja', 'zh', 'zh_hk', 'ko', 'eu']
+
+
+# Word templates for each tag parser, %(s)s is the learning status and %(t)s the 1T info
+word_templates = {
+    'ruby': [
+        '日本[にほん]', '語[ご]を', '話[はな]す', '今日[きょう]は', '天気[てんき]が', '良[よ]い', 'です', 'ね',
+    ],
+    'ja': [
+        '日本語[にほんご;h;%(s)s;%(t)s]', '勉強[べんきょう,勉強;n,a;%(s)s;%(t)s]します', '行[い;a;%(s)s;%(t)s]きました',
+        '私[わたし;h;%(s)s;%(t)s]', '学校[がっこう;o;%(s)s;%(t)s]に', '友達[ともだち;h;%(s)s;%(t)s]と',
+        'テレビ[;h;%(s)s;%(t)s]', '見[み,見る;h;%(s)s;%(t)s]ました', 'を', 'は', 'が', '、',
+    ],
+    'zh': [
+        '我[wo3;%(s)s;%(t)s]', '喜欢[xi3 huan5;%(s)s;%(t)s]', '中文[zhong1 wen2;%(s)s;%(t)s]。', '你好[ni3 hao3;%(s)s;%(t)s]！',
+        '今天[jin1 tian1;%(s)s;%(t)s]', '天气[tian1 qi4;%(s)s;%(t)s]', '很[hen3;%(s)s;%(t)s]', '好[hao3;%(s)s;%(t)s]，',
+    ],
+    'zh_hk': [
+        '我[ngo5;%(s)s;%(t)s]', '鍾意[zung1 ji3;%(s)s;%(t)s]', '廣東話[gwong2 dung1 waa2;%(s)s;%(t)s]。',
+        '今日[gam1 jat6;%(s)s;%(t)s]', '天氣[tin1 hei3;%(s)s;%(t)s]', '好[hou2;%(s)s;%(t)s]，',
+    ],
+    'ko': [
+        '저는[%(s)s;%(t)s]', '학교에[%(s)s;%(t)s]', '갑니다[%(s)s;%(t)s].', '안녕하세요[%(s)s;%(t)s]!',
+        '오늘[%(s)s;%(t)s]', '날씨가[%(s)s;%(t)s]', '좋네요[%(s)s;%(t)s].',
+    ],
+    'eu': [
+        'Das[n;%(s)s;%(t)s]', 'Haus[n;%(s)s;%(t)s]', 'ist[n;%(s)s;%(t)s]', 'groß[m;%(s)s;%(t)s].', 'casa[f;%(s)s;%(t)s]',
+        'The[n;%(s)s;%(t)s]', 'weather[n;%(s)s;%(t)s]', 'is[n;%(s)s;%(t)s]', 'nice[n;%(s)s;%(t)s],', 'today[n;%(s)s;%(t)s]!',
+    ],
+}
+
+
+def sample_line(language, rng):
+    words = []
+    for _ in range(rng.randint(4, 10)):
+        values = {
+            's': rng.choice('0122'),
+            't': rng.choice(['0', '0', '1', '1,%d' % rng.randint(0, 70000)]),
+        }
+        words.append(rng.choice(word_templates[language]) % values)
+    sep = '' if language in ('zh', 'zh_hk') else ' '
+    return sep.join(words)
+
+
+# Returns a SSAFile with event_count tagged events for the tag parser language
+# About a third of the events have two lines and every tenth event overlaps the previous one
+def generate_subs(language, event_count, seed=0, font_name='Arial', font_size=60):
+    rng = random.Random('%s-%d' % (language, seed))
+
+    subs = pysubs2.SSAFile()
+    subs.info['PlayResX'] = '1920'
+    subs.info['PlayResY'] = '1080'
+
+    style = subs.styles['Default']
+    style.fontname = font_name
+    style.fontsize = font_size
+    style.marginv = 40
+
+    start = 0
+    for i in range(event_count):
+        line_count = 2 if rng.random() < 0.33 else 1
+        text = '\\N'.join(sample_line(language, rng) for _ in range(line_count))
+        duration = rng.randint(1000, 4000)
+        subs.events.append(pysubs2.SSAEvent(start=start, end=start + duration, text=text))
+        if rng.random() < 0.1:
+            start += duration // 2
+        else:
+            start += duration + rng.randint(0, 500)
+
+    return subs
+
+
+def corpus_path(corpus_dir, language, event_count, seed):
+    return os.path.join(corpus_dir, '%s_%d_%d.ass' % (language, event_count, seed))
+
+
+# Writes one file per language, returns dict of language -> path
+def write_corpus(corpus_dir, languages=languages, event_count=1000, seed=0, font_name='Arial'):
+    os.makedirs(corpus_dir, exist_ok=True)
+    ret = {}
+    for language in languages:
+        path = corpus_path(corpus_dir, language, event_count, seed)
+        generate_subs(language, event_count, seed, font_name).save(path, encoding='utf-8')
+        ret[language] = path
+    return ret
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Generate tagged subtitle files for benchmarking.')
+    arg_parser.add_argument('output_dir', metavar='DIR')
+    arg_parser.add_argument('-l', '--language', action='append', choices=languages, default=None,
+                            help='tag parser to generate events for, can be repeated (default: all)')
+    arg_parser.add_argument('--events', type=int, default=1000, help='events per file (default: 1000)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--font-name', default='Arial', help='font of the Default style (default: Arial)')
+    args = arg_parser.parse_args()
+
+    paths = write_corpus(args.output_dir, args.language or languages, args.events, args.seed, args.font_name)
+    for path in paths.values():
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+import corpus
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+stages = ['read', 'decode', 'load', 'setup', 'tag_parse', 'layout', 'save']
+
+result_format_version = 1
+
+
+# Times the conversion stages of one file, returns dict of stage -> seconds
+def time_stages(in_path, out_path, tag_parser, measure_backend):
+    from rubysubs import rubysubs
+
+    times = {}
+
+    t = time.perf_counter()
+    with open(in_path, 'rb') as f:
+        subs_data = f.read()
+    times['read'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    subs_text, _ = rubysubs.decode_sub_data(subs_data)
+    times['decode'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    subs = rubysubs.load_subs(subs_text)
+    times['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    parsers = rubysubs.style_parsers(rubysubs.setup_event_styles(subs), tag_parser, measure_backend)
+    parser = parsers['Default']
+    events = subs.events.copy()
+    events.sort()
+    times['setup'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    parsed_events = [parser.parse_tags(e.text) for e in events]
+    times['tag_parse'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    subs.events = rubysubs.layout_events(parser, events, parsed_events, rubysubs.event_parsers_for(parsers, events))
+    times['layout'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    subs.save(out_path, header_notice='Generated by rubysubs')
+    times['save'] = time.perf_counter() - t
+
+    return times
+
+
+def measure_backend_from_args(args):
+    import rubysubs
+
+    if args.font_file is None and args.font_dir is None:
+        # Qt needs an application instance but no display
+        global qapp
+        qapp = rubysubs.create_qt_application(sys.argv[:1])
+        return rubysubs.QtMeasureBackend(), 'qt'
+
+    return rubysubs.SfntMeasureBackend(args.font_file, args.font_dir, args.font_dpi), 'sfnt'
+
+
+def run(args, corpus_dir, out_dir):
+    from rubysubs import tag_parsers
+
+    measure_backend, backend_name = measure_backend_from_args(args)
+    paths = corpus.write_corpus(corpus_dir, args.language or corpus.languages, args.events, args.seed, args.font_name)
+
+    results = {}
+    for language, in_path in paths.items():
+        tag_parser = tag_parsers.tag_parser_from_string_args(language)
+        out_path = os.path.join(out_dir, os.path.basename(in_path))
+
+        # Best time of each stage over all repeats
+        best = None
+        for _ in range(args.repeat):
+            times = time_stages(in_path, out_path, tag_parser, measure_backend)
+            if best is None:
+                best = times
+            else:
+                best = {stage: min(best[stage], times[stage]) for stage in stages}
+
+        best['total'] = sum(best[stage] for stage in stages)
+        results[language] = best
+
+        print('%-8s %s' % (language, ' '.join('%s=%.3fs' % (stage, best[stage]) for stage in stages + ['total'])), file=sys.stderr)
+
+    return {
+        'format': result_format_version,
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'backend': backend_name,
+        },
+        'settings': {
+            'events': args.events,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'font_name': args.font_name,
+        },
+        'results': results,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Time the conversion stages for generated subtitles of each tag parser.')
+    arg_parser.add_argument('-o', '--output', metavar='PATH', default=None, help='write JSON results to this file (default: stdout)')
+    arg_parser.add_argument('-l', '--language', action='append', choices=corpus.languages, default=None,
+                            help='tag parser to benchmark, can be repeated (default: all)')
+    arg_parser.add_argument('--events', type=int, default=1000, help='events per file (default: 1000)')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='runs per file, the best time of each stage is reported (default: 3)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--corpus-dir', metavar='DIR', default=None, help='keep generated files in this directory')
+    arg_parser.add_argument('--font-name', default='Arial', help='font of the Default style (default: Arial)')
+    arg_parser.add_argument('--font-file', metavar='PATH', default=None, help='measure with this TTF/OTF file instead of Qt')
+    arg_parser.add_argument('--font-dir', metavar='DIR', action='append', default=None, help='measure with fonts from this directory instead of Qt')
+    arg_parser.add_argument('--font-dpi', metavar='DPI', type=float, default=100)
+    args = arg_parser.parse_args()
+
+    # Benchmark this checkout, not an installed rubysubs
+    sys.path.insert(0, repo_dir)
+
+    with tempfile.TemporaryDirectory(prefix='rubysubs-bench-') as tmp_dir:
+        corpus_dir = args.corpus_dir or os.path.join(tmp_dir, 'corpus')
+        out_dir = os.path.join(tmp_dir, 'out')
+        os.makedirs(out_dir)
+        report = run(args, corpus_dir, out_dir)
+
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(data)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,46 @@
-from .rubysubs import RubySubParser, convert_sub_file
+from .version import __version__
+from .rubysubs import RubySubParser, ConversionStats, CollisionScheduler, ParserCache, schedule_events, convert_sub_file, convert_sub_data, output_format_for_path, create_qt_application, MeasureBackend, QtMeasureBackend, SfntMeasureBackend, default_measure_backend, FontSetup, FontRegistry, default_font_registry
 from . import tags
 from . import tag_parse_ruby
-from . import tag_parse_migaku_ja
-from . import tag_parse_migaku_zh
-from . import tag_parse_migaku_eu
-from . import tag_parse_migaku_ko
+from . import tag_parsers
+
+import importlib
+
+
+# Submodules and names imported on first access to keep startup fast
+_lazy_modules = [
+    'tag_parse_migaku_ja',
+    'tag_parse_migaku_zh',
+    'tag_parse_migaku_eu',
+    'tag_parse_migaku_ko',
+    'ja_util',
+    'batch',
+    'daemon',
+    'sfnt',
+    'advance_cache',
+    'result_cache',
+    'aio',
+    'parallel',
+    'stream',
+]
+
+_lazy_names = {
+    'convert_sub_files':        'batch',
+    'AsyncConverter':           'aio',
+    'convert_sub_file_async':   'aio',
+    'convert_sub_data_async':   'aio',
+    'LayoutPool':               'parallel',
+    'convert_sub_stream':       'stream',
+}
+
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        return importlib.import_module('.' + name, __name__)
+    if name in _lazy_names:
+        return getattr(importlib.import_module('.' + _lazy_names[name], __name__), name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_modules) | set(_lazy_names))
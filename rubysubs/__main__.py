@@ -1,44 +1,381 @@
 import rubysubs
-from PyQt5.QtGui import QGuiApplication
+from rubysubs import tag_parsers
 
+import sys
+import json
+import time
+import argparse
 
-def main():
-    import sys
-    
-    if len(sys.argv) < 3:
-        print('Usage: %s <source subtitle> <output subtitle> [<tag parser> [arg0] [arg1] ...]' % sys.argv[0])
+
+def add_measure_arguments(arg_parser):
+    arg_parser.add_argument('--font-file', metavar='PATH', default=None,
+                            help='measure text with this TTF/OTF file instead of Qt')
+    arg_parser.add_argument('--font-dir', metavar='DIR', action='append', default=None,
+                            help='measure text with TTF/OTF files looked up by family name in this directory instead of Qt, can be repeated')
+    arg_parser.add_argument('--font-dpi', metavar='DPI', type=float, default=100,
+                            help='resolution used with --font-file/--font-dir (default: 100)')
+    arg_parser.add_argument('--advance-cache', metavar='DIR', default=None,
+                            help='keep measured CJK character advances in this directory across runs')
+
+
+def add_layout_arguments(arg_parser):
+    arg_parser.add_argument('--compact', action='store_true',
+                            help='merge text without ruby on a line into fewer events')
+    arg_parser.add_argument('--merge-drawings', choices=['line', 'event', 'frame'], default=None,
+                            help='draw underlines and highlights of the same color as one event per line, per event or per events shown at the same time')
+
+
+def layout_options_from_args(args):
+    layout_options = {}
+    if args.compact:
+        layout_options['compact'] = True
+    if args.merge_drawings is not None:
+        layout_options['merge_drawings'] = args.merge_drawings
+    return layout_options or None
+
+
+# Prints how many events compact output and merged drawings saved
+def report_layout(stats):
+    events_out = stats.counters.get('events_out', 0)
+    events_merged = stats.counters.get('events_merged', 0)
+    print('Merged output: %d events instead of %d' % (events_out, events_out + events_merged), file=sys.stderr)
+
+
+def add_result_cache_arguments(arg_parser):
+    arg_parser.add_argument('--result-cache', metavar='DIR', default=None,
+                            help='reuse converted files from this directory if input and options are unchanged')
+    arg_parser.add_argument('--result-cache-size', metavar='MB', type=float, default=1024,
+                            help='evict least recently used results above this size (default: 1024)')
+
+
+def result_cache_from_args(args):
+    if args.result_cache is None:
+        return None
+    from rubysubs import result_cache
+    return result_cache.ResultCache(args.result_cache, max_bytes=round(args.result_cache_size * 1024 * 1024))
+
+
+def measure_backend_from_args(args):
+    if args.font_file is None and args.font_dir is None:
+        backend = rubysubs.default_measure_backend()
+    else:
+        backend = rubysubs.SfntMeasureBackend(args.font_file, args.font_dir, args.font_dpi)
+
+    if getattr(args, 'advance_cache', None) is not None:
+        from rubysubs import advance_cache
+        backend = advance_cache.CachedMeasureBackend(backend, args.advance_cache)
+
+    return backend
+
+
+def add_advance_cache_command_arguments(arg_parser):
+    arg_parser.add_argument('action', choices=['list', 'check', 'rebuild', 'clear'])
+    arg_parser.add_argument('cache_dir', metavar='DIR')
+    add_measure_arguments(arg_parser)
+
+
+def main_advance_cache(args):
+    from rubysubs import advance_cache
+
+    if args.action == 'clear':
+        advance_cache.clear_cache(args.cache_dir)
+        sys.exit(0)
+
+    if args.action == 'list':
+        for path, header in advance_cache.cache_entries(args.cache_dir):
+            if header is None:
+                print('%s: invalid' % path)
+            else:
+                print('%s: %s %s %dpt%s%s' % (path, header['backend'], header['font_name'], header['point_size'], ' bold' if header['bold'] else '', ' italic' if header['italic'] else ''))
+        sys.exit(0)
+
+    # Checking requires measuring the currently installed fonts
+    backend = measure_backend_from_args(args)
+    if backend.requires_qt:
+        qapp = rubysubs.create_qt_application(sys.argv)
+
+    if args.action == 'check':
+        stale = 0
+        for path, header, is_valid in advance_cache.check_cache(args.cache_dir, backend):
+            if not is_valid:
+                stale += 1
+                print('%s: stale' % path)
+        print('%d stale tables.' % stale)
+        sys.exit(1 if stale else 0)
+
+    rebuilt = advance_cache.rebuild_cache(args.cache_dir, backend)
+    print('Rebuilt %d tables.' % rebuilt)
+    sys.exit(0)
+
+
+def add_result_cache_command_arguments(arg_parser):
+    arg_parser.add_argument('action', choices=['list', 'prune', 'clear'])
+    arg_parser.add_argument('cache_dir', metavar='DIR')
+    arg_parser.add_argument('--max-size', metavar='MB', type=float, default=None, help='prune: evict least recently used results above this size')
+    arg_parser.add_argument('--max-entries', metavar='N', type=int, default=None, help='prune: keep at most this many results')
+    arg_parser.add_argument('--max-age', metavar='DAYS', type=float, default=None, help='prune: evict results not used for this many days')
+
+
+def main_result_cache(args):
+    from rubysubs import result_cache
+
+    cache = result_cache.ResultCache(args.cache_dir)
+
+    if args.action == 'list':
+        entries = cache.entries()
+        for key, size, mtime in entries:
+            print('%s %10d %s' % (key, size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))))
+        print('%d results, %.1f MB.' % (len(entries), sum(size for _, size, _ in entries) / (1024 * 1024)))
+        sys.exit(0)
+
+    if args.action == 'clear':
+        evicted = cache.clear()
+    else:
+        max_bytes = round(args.max_size * 1024 * 1024) if args.max_size is not None else None
+        max_age = args.max_age * 24 * 60 * 60 if args.max_age is not None else None
+        evicted = cache.prune(max_bytes, args.max_entries, max_age)
+
+    print('Removed %d results.' % len(evicted))
+    sys.exit(0)
+
+
+def add_daemon_command_arguments(arg_parser):
+    arg_parser.add_argument('socket_path', metavar='SOCKET')
+    arg_parser.add_argument('--max-connections', metavar='N', type=int, default=16,
+                            help='connections handled at once, further ones are refused (default: 16)')
+    arg_parser.add_argument('--max-queue', metavar='N', type=int, default=64,
+                            help='requests waiting for conversion, further ones are refused (default: 64)')
+    add_measure_arguments(arg_parser)
+
+
+def main_daemon(args):
+    from rubysubs import daemon
+
+    measure_backend = measure_backend_from_args(args)
+
+    if measure_backend.requires_qt:
+        qapp = rubysubs.create_qt_application(sys.argv)
+
+    server = daemon.ConversionDaemon(args.socket_path, measure_backend, args.max_connections, args.max_queue)
+    try:
+        server.listen()
+    except OSError as e:
+        print('Could not listen on %s: %s' % (args.socket_path, e), file=sys.stderr)
         sys.exit(1)
+    print('Listening on %s' % args.socket_path, file=sys.stderr)
 
-    in_path = sys.argv[1]
-    out_path = sys.argv[2]
+    # Stop after the current conversion and remove the socket
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
 
-    if len(sys.argv) >= 4:
-        tag_parser_requested = sys.argv[3].lower().replace('-', '_')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
 
-        tag_parser_builders = {
-            'ruby':     rubysubs.tag_parse_ruby.parser_from_string_args,
-            'ja':       rubysubs.tag_parse_migaku_ja.parser_from_string_args,
-            'zh':       rubysubs.tag_parse_migaku_zh.parser_from_string_args,
-            'zh_hk':    rubysubs.tag_parse_migaku_zh.parser_from_string_args_HK,
-            'eu':       rubysubs.tag_parse_migaku_eu.parser_from_string_args,
-            'ko':       rubysubs.tag_parse_migaku_ko.parser_from_string_args,
-        }
+    sys.exit(0)
 
-        if not tag_parser_requested in tag_parser_builders:
-            print('Invalid tag parser.')
-            sys.exit(1)
 
-        tag_parser = tag_parser_builders[tag_parser_requested](sys.argv[4:])
+def add_tag_parser_arguments(arg_parser):
+    arg_parser.add_argument('tag_parser', nargs='?', default='ruby', help='tag parser (default: ruby)')
+    arg_parser.add_argument('tag_parser_args', nargs='*', metavar='arg', help='tag parser arguments, options may follow them')
+
+
+def add_client_command_arguments(arg_parser):
+    arg_parser.add_argument('--stats', action='store_true', help='print stage times and counters as JSON')
+    add_layout_arguments(arg_parser)
+    arg_parser.add_argument('socket_path', metavar='SOCKET')
+    arg_parser.add_argument('source', help='source subtitle')
+    arg_parser.add_argument('output', help='output subtitle')
+    add_tag_parser_arguments(arg_parser)
+
+
+def main_client(args):
+    from rubysubs import daemon
+
+    try:
+        with daemon.DaemonClient(args.socket_path) as client:
+            response = client.convert_file(args.source, args.output, args.tag_parser, args.tag_parser_args, args.stats, layout_options_from_args(args))
+    except (OSError, daemon.DaemonError) as e:
+        print('Conversion failed: %s' % e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.stats:
+        print(json.dumps(response['stats'], indent=2))
+
+    sys.exit(0)
+
+
+def add_batch_command_arguments(arg_parser):
+    arg_parser.add_argument('-o', '--output', required=True, metavar='TEMPLATE',
+                            help='output path template, fields: {path} {dir} {name} {stem} {ext}')
+    arg_parser.add_argument('-p', '--tag-parser', default='ruby', metavar='"PARSER [ARG0] [ARG1] ..."',
+                            help='tag parser name followed by its arguments (default: ruby)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None,
+                            help='number of worker processes (default: number of CPUs)')
+    add_measure_arguments(arg_parser)
+    add_result_cache_arguments(arg_parser)
+    add_layout_arguments(arg_parser)
+    arg_parser.add_argument('inputs', nargs='+', metavar='INPUT',
+                            help='subtitle file, directory or glob pattern')
+
+
+def main_batch(args):
+    from rubysubs import batch
+
+    tag_parser_parts = args.tag_parser.split()
+    if not tag_parser_parts or not tag_parsers.is_valid_name(tag_parser_parts[0]):
+        print('Invalid tag parser.')
+        sys.exit(1)
+
+    def report(in_path, out_path, error):
+        if error is None:
+            print('%s -> %s' % (in_path, out_path))
+        else:
+            print('%s: FAILED (%s)' % (in_path, error), file=sys.stderr)
+
+    results = batch.convert_sub_files(args.inputs, args.output, tag_parser_parts[0], tag_parser_parts[1:], args.jobs, report,
+                                      measure_backend_from_args(args), result_cache_from_args(args), layout_options_from_args(args))
+
+    if not results:
+        print('No input files found.')
+        sys.exit(1)
+
+    failed = sum(1 for _, _, error in results if error is not None)
+    print('Converted %d of %d files.' % (len(results) - failed, len(results)))
+
+    sys.exit(1 if failed else 0)
+
+
+def convert_file_from_args(args, tag_parser, measure_backend):
+    layout_pool = None
+    if args.layout_workers is not None and args.layout_workers > 1:
+        from rubysubs import parallel
+        layout_pool = parallel.LayoutPool(args.layout_workers, measure_backend)
+
+    try:
+        stats = rubysubs.convert_sub_file(args.source, args.output, tag_parser, measure_backend, result_cache=result_cache_from_args(args),
+                                          layout_options=layout_options_from_args(args), layout_pool=layout_pool)
+    finally:
+        if layout_pool is not None:
+            layout_pool.close()
+
+    return stats
+
+
+# Streams from stdin and/or to stdout, without result cache and layout workers
+def convert_stream_from_args(args, tag_parser, measure_backend):
+    from rubysubs import stream
+
+    output_format = 'ass' if args.output == '-' else rubysubs.output_format_for_path(args.output)
+    in_fp = sys.stdin.buffer if args.source == '-' else open(args.source, 'rb')
+    out_fp = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+
+    try:
+        return stream.convert_sub_stream(in_fp, out_fp, tag_parser, measure_backend, output_format=output_format,
+                                         layout_options=layout_options_from_args(args))
+    finally:
+        if in_fp is not sys.stdin.buffer:
+            in_fp.close()
+        if out_fp is not sys.stdout.buffer:
+            out_fp.close()
+
+
+def add_convert_command_arguments(arg_parser):
+    add_measure_arguments(arg_parser)
+    add_result_cache_arguments(arg_parser)
+    add_layout_arguments(arg_parser)
+    arg_parser.add_argument('--layout-workers', metavar='N', type=int, default=None,
+                            help='lay out events in N worker processes, for large files')
+    arg_parser.add_argument('--stats', action='store_true', help='print stage times and counters as JSON')
+    arg_parser.add_argument('source', help='source subtitle, - for stdin')
+    arg_parser.add_argument('output', help='output subtitle, - for stdout')
+    add_tag_parser_arguments(arg_parser)
+
+
+def main_convert(args):
+    if not tag_parsers.is_valid_name(args.tag_parser):
+        print('Invalid tag parser.')
+        sys.exit(1)
+
+    tag_parser = tag_parsers.tag_parser_from_string_args(args.tag_parser, args.tag_parser_args)
+    measure_backend = measure_backend_from_args(args)
+
+    if measure_backend.requires_qt:
+        # Required for QFontMetrics
+        qapp = rubysubs.create_qt_application(sys.argv)
+
+    if args.source == '-' or args.output == '-':
+        from rubysubs import stream
+        try:
+            stats = convert_stream_from_args(args, tag_parser, measure_backend)
+        except stream.UnsortedEventsError as e:
+            print('Conversion failed: %s' % e, file=sys.stderr)
+            sys.exit(1)
     else:
-        tag_parser = rubysubs.tag_parse_ruby.parse
+        stats = convert_file_from_args(args, tag_parser, measure_backend)
 
-    # Required for QFontMetrics
-    qapp = QGuiApplication(sys.argv)
+    if layout_options_from_args(args) and 'events_out' in stats.counters:
+        report_layout(stats)
 
-    rubysubs.convert_sub_file(in_path, out_path, tag_parser)
+    if args.stats:
+        # Keep stdout for the converted subtitle
+        print(json.dumps(stats.to_dict(), indent=2), file=sys.stderr if args.output == '-' else sys.stdout)
 
     sys.exit(0)
 
 
+# (name, description, add_arguments, main)
+commands = [
+    ('convert',       'Add ruby text to a subtitle file.',
+                      add_convert_command_arguments, main_convert),
+    ('batch',         'Convert many subtitle files in parallel.',
+                      add_batch_command_arguments, main_batch),
+    ('advance-cache', 'Check, rebuild or clear a character advance cache.',
+                      add_advance_cache_command_arguments, main_advance_cache),
+    ('result-cache',  'List, prune or clear a result cache.',
+                      add_result_cache_command_arguments, main_result_cache),
+    ('daemon',        'Convert subtitles sent over a Unix domain socket, keeping Qt and parsers loaded.',
+                      add_daemon_command_arguments, main_daemon),
+    ('client',        'Convert a subtitle file with a running rubysubs daemon.',
+                      add_client_command_arguments, main_client),
+]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog='rubysubs',
+        usage='%(prog)s [convert] [options] <source subtitle> <output subtitle> [<tag parser> [arg0] [arg1] ...]\n'
+              '       %(prog)s batch -o <output template> [options] <input> [<input> ...]\n'
+              '       %(prog)s advance-cache {list,check,rebuild,clear} <cache dir> [options]\n'
+              '       %(prog)s result-cache {list,prune,clear} <cache dir> [options]\n'
+              '       %(prog)s daemon <socket> [options]\n'
+              '       %(prog)s client <socket> <source subtitle> <output subtitle> [<tag parser> [arg0] [arg1] ...]',
+        description='Add ruby text to subtitles. Without a command the arguments are converted, '
+                    'files named like a command are converted with "convert".',
+    )
+    subparsers = arg_parser.add_subparsers(metavar='<command>')
+    for name, description, add_arguments, main_command in commands:
+        command_parser = subparsers.add_parser(name, prog='rubysubs ' + name, help=description, description=description)
+        add_arguments(command_parser)
+        command_parser.set_defaults(main_command=main_command)
+
+    argv = sys.argv[1:]
+    if not argv:
+        arg_parser.print_usage()
+        sys.exit(1)
+
+    if argv[0] in ('-h', '--help'):
+        arg_parser.print_help()
+        sys.exit(0)
+
+    if argv[0] not in subparsers.choices:
+        argv = ['convert'] + argv
+
+    # Options may follow positional arguments, like the tag parser arguments
+    args = subparsers.choices[argv[0]].parse_intermixed_args(argv[1:])
+    args.main_command(args)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
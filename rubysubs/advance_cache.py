@@ -0,0 +1,483 @@
+from .rubysubs import MeasureBackend, FixedAdvanceTable, fixed_advance_ranges
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Persistent per font advance tables, one memory-mapped file per (backend, font name, point size, bold, italic).
+#
+# Tables hold 26.6 fixed point advances of single characters from U+2E80 to U+2FFFF (CJK, kana,
+# hangul and fullwidth forms). Text is only measured as the sum of cached advances where a
+# rubysubs.FixedAdvanceTable probed on the cached advances allows it, that is for characters of
+# checked uniform-advance ranges and never for combining or other non-spacing characters. Other text
+# is measured by the wrapped backend so kerning and shaping are kept where they matter.
+# Widths of such text are kept in a widths file next to the table, one text per line.
+# New advances and widths are collected in memory and merged into the files by flush(). Readers keep
+# mapping the previous file until they reload, so the files can be shared by parallel workers.
+#
+# The file header also keeps the font height and the probed fixed advance ranges. The wrapped
+# backend's metrics are only created on a miss, so a run finding everything in the tables measures
+# no glyphs. Their fingerprint is compared with the one of the table then, and a table written for
+# another font file is dropped. A changed font file is only noticed on a miss, check_cache and
+# rebuild_cache compare all tables.
+
+table_start = 0x2E80
+table_end = 0x30000
+table_size = table_end - table_start
+
+file_magic = b'RSAC'
+file_version = 2
+header_format = '<4sI1s3x20sII16si%di' % len(fixed_advance_ranges)
+header_size = 256
+family_size = header_size - struct.calcsize(header_format)
+
+file_extension = '.adv'
+
+widths_magic = 'RSAW'
+widths_extension = '.wid'
+
+
+# Bold and italic are stored as style flags, bit 0 is bold and bit 1 italic
+def style_flags(bold, italic):
+    return int(bool(bold)) | int(bool(italic)) << 1
+
+
+def table_path(cache_dir, backend_name, font_name, point_size, bold, italic=False):
+    key = '%s|%s|%d|%d' % (backend_name, font_name, point_size, style_flags(bold, italic))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + file_extension)
+
+
+def widths_path(path):
+    return path[:-len(file_extension)] + widths_extension
+
+
+# Returns dict of text to width from the widths file of a table, empty if it was written for another font file.
+# Any font file is accepted if fingerprint is None.
+def read_widths(path, fingerprint):
+    ret = {}
+    try:
+        with open(widths_path(path), encoding='utf-8', newline='\n') as f:
+            magic, _, file_fingerprint = f.readline().rstrip('\n').partition(' ')
+            if magic != widths_magic or (fingerprint is not None and file_fingerprint != fingerprint.hex()):
+                return ret
+            for line in f:
+                width, sep, text = line[:-1].partition('\t')
+                if sep and line.endswith('\n'):
+                    ret[text] = int(width)
+    except (OSError, ValueError):
+        return {}
+    return ret
+
+
+def _write_widths(path, fingerprint, widths):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix=widths_extension, dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            f.write('%s %s\n' % (widths_magic, fingerprint.hex()))
+            for text, width in widths.items():
+                f.write('%d\t%s\n' % (width, text))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, widths_path(path))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_header(path):
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(header_size)
+    except OSError:
+        return None
+
+    if len(header) != header_size:
+        return None
+
+    magic, version, byteorder, fingerprint, point_size, flags, backend_name, height, *range_advances = struct.unpack_from(header_format, header)
+    if magic != file_magic or version != file_version:
+        return None
+
+    family = header[struct.calcsize(header_format):].rstrip(b'\0').decode('utf-8', errors='replace')
+
+    return {
+        'backend':          backend_name.rstrip(b'\0').decode('ascii', errors='replace'),
+        'byteorder':        byteorder,
+        'fingerprint':      fingerprint,
+        'font_name':        family,
+        'point_size':       point_size,
+        'bold':             bool(flags & 1),
+        'italic':           bool(flags & 2),
+        'height':           height if height >= 0 else None,
+        'range_advances':   range_advances if min(range_advances) >= 0 else None,
+    }
+
+
+# height and range_advances are None if not known yet
+def _write_table(path, backend_name, fingerprint, font_name, point_size, bold, italic, height, range_advances, data):
+    if height is None:
+        height = -1
+    if range_advances is None:
+        range_advances = [-1] * len(fixed_advance_ranges)
+
+    family = font_name.encode('utf-8')[:family_size]
+    header = struct.pack(header_format, file_magic, file_version, sys.byteorder[0].encode(), fingerprint, point_size, style_flags(bold, italic), backend_name.encode('ascii'),
+                         height, *range_advances)
+    header += family.ljust(family_size, b'\0')
+
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix=file_extension, dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def _locked(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AdvanceTable():
+
+    def __init__(self, path, backend_name, font_name, point_size, bold, italic=False):
+        self.path = path
+        self.backend_name = backend_name
+        self.font_name = font_name
+        self.point_size = point_size
+        self.bold = bold
+        self.italic = italic
+
+        # Fingerprint of the loaded file until checked against the measured font
+        self.fingerprint = None
+        self.checked = False
+
+        # Font height and FixedAdvanceTable.range_advances(), None if not known yet
+        self.height = None
+        self.range_advances = None
+        self.header_changed = False
+
+        self.values = None
+        self.pending = {}
+        self.widths = {}
+        self.pending_widths = {}
+        self.fixed_advances = None      # Set by CachedFontMetrics
+        self._mmap = None
+
+        self.load()
+
+    def close(self):
+        if self.values is not None:
+            self.values.release()
+            self.values = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    # Maps the table file read-only. Once checked, files for a different font file or resolution are ignored.
+    def load(self):
+        self.close()
+
+        header = read_header(self.path)
+        if header is None or header['byteorder'] != sys.byteorder[0].encode():
+            return
+        if self.checked and header['fingerprint'] != self.fingerprint:
+            return
+
+        try:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+
+        if len(mm) != header_size + table_size * 4:
+            mm.close()
+            return
+
+        self._mmap = mm
+        self.values = memoryview(mm)[header_size:].cast('i')
+
+        self.fingerprint = header['fingerprint']
+        if self.height is None:
+            self.height = header['height']
+        if self.range_advances is None:
+            self.range_advances = header['range_advances']
+        self.widths = read_widths(self.path, self.fingerprint)
+
+    # Called with the fingerprint of the measured font before it measures anything for this table.
+    # Values of a table written for another font file are dropped.
+    def check(self, fingerprint):
+        if self.checked:
+            return
+        self.checked = True
+
+        if self.fingerprint is not None and self.fingerprint != fingerprint:
+            self.close()
+            self.widths = {}
+            self.height = None
+            self.range_advances = None
+            self.fixed_advances = None
+        self.fingerprint = fingerprint
+
+    def get(self, index):
+        if self.values is not None:
+            value = self.values[index]
+            if value >= 0:
+                return value
+        return self.pending.get(index)
+
+    def get_width(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.pending_widths.get(text)
+        return width
+
+    def set_height(self, height):
+        self.height = height
+        self.header_changed = True
+
+    def set_range_advances(self, range_advances):
+        self.range_advances = range_advances
+        self.header_changed = True
+
+    def flush(self):
+        if not self.pending and not self.pending_widths and not self.header_changed:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with _locked(self.path):
+            # Merge with advances other processes wrote since this table was loaded
+            self.load()
+            if self.values is not None:
+                data = bytearray(self.values.tobytes())
+            else:
+                data = bytearray(b'\xff' * (table_size * 4))
+
+            values = memoryview(data).cast('i')
+            for index, value in self.pending.items():
+                values[index] = value
+            values.release()
+
+            if self.pending_widths:
+                widths = dict(self.widths)
+                widths.update(self.pending_widths)
+                _write_widths(self.path, self.fingerprint, widths)
+
+            self.close()
+            _write_table(self.path, self.backend_name, self.fingerprint, self.font_name, self.point_size, self.bold, self.italic, self.height, self.range_advances, data)
+
+        self.pending.clear()
+        self.pending_widths.clear()
+        self.header_changed = False
+        self.load()
+
+
+class CachedFontMetrics():
+
+    def __init__(self, backend, font_args, table):
+        self.backend = backend
+        self.font_args = font_args
+        self.table = table
+        self._metrics = None
+
+    # Metrics of the wrapped backend, created on the first miss
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            metrics = self.backend.font_metrics(*self.font_args)
+            self.table.check(metrics.fingerprint())
+            self._metrics = metrics
+        return self._metrics
+
+    def height(self):
+        table = self.table
+        if table.height is None:
+            table.set_height(self.metrics.height())
+        return table.height
+
+    def fingerprint(self):
+        return self.metrics.fingerprint()
+
+    # Probed once per table, measures with the wrapped metrics meanwhile
+    def fixed_advance_table(self):
+        table = self.table
+        if table.fixed_advances is None:
+            if table.range_advances is None:
+                fixed_advances = FixedAdvanceTable(self)
+                table.set_range_advances(fixed_advances.range_advances())
+            else:
+                fixed_advances = FixedAdvanceTable(self, table.range_advances)
+            table.fixed_advances = fixed_advances
+        return table.fixed_advances
+
+    def char_advance_64(self, c):
+        index = ord(c) - table_start
+        if not 0 <= index < table_size:
+            return self.metrics.char_advance_64(c)
+        table = self.table
+        advance = table.get(index)
+        if advance is None:
+            advance = self.metrics.char_advance_64(c)
+            table.pending[index] = advance
+        return advance
+
+    def horizontalAdvance(self, text):
+        fixed_advances = self.table.fixed_advances
+        if fixed_advances is None and self.table.range_advances is not None:
+            fixed_advances = self.fixed_advance_table()
+        if fixed_advances is not None:
+            width = fixed_advances.width(text)
+            if width is not None:
+                return width
+
+        table = self.table
+        width = table.get_width(text)
+        if width is None:
+            width = self.metrics.horizontalAdvance(text)
+            # Lines of the widths file end at a newline
+            if '\n' not in text and '\r' not in text:
+                table.pending_widths[text] = width
+        return width
+
+
+def backend_cache_name(backend):
+    return type(backend).__name__[:16]
+
+
+# Wraps another backend and caches its advances in cache_dir
+class CachedMeasureBackend(MeasureBackend):
+
+    def __init__(self, backend, cache_dir):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.requires_qt = backend.requires_qt
+        self._tables = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tables'] = {}
+        return state
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        key = (font_name, point_size, bool(bold), bool(italic))
+        table = self._tables.get(key)
+        if table is None:
+            backend_name = backend_cache_name(self.backend)
+            path = table_path(self.cache_dir, backend_name, *key)
+            table = AdvanceTable(path, backend_name, *key)
+            self._tables[key] = table
+
+        return CachedFontMetrics(self.backend, key, table)
+
+    # Cached advances are the same as measured ones, so results do not depend on the cache
+    def cache_key(self):
+        return self.backend.cache_key()
+
+    def flush(self):
+        for table in self._tables.values():
+            table.flush()
+        self.backend.flush()
+
+
+# Returns list of (path, header) for all tables in cache_dir
+def cache_entries(cache_dir):
+    ret = []
+    if not os.path.isdir(cache_dir):
+        return ret
+    for name in sorted(os.listdir(cache_dir)):
+        if name.endswith(file_extension) and not name.startswith('.tmp-'):
+            path = os.path.join(cache_dir, name)
+            ret.append((path, read_header(path)))
+    return ret
+
+
+# Returns list of (path, header, is_valid) comparing tables against the fonts backend currently resolves
+# Tables written by other backend types are skipped
+def check_cache(cache_dir, backend):
+    ret = []
+    backend_name = backend_cache_name(backend)
+    for path, header in cache_entries(cache_dir):
+        if header is None:
+            ret.append((path, header, False))
+            continue
+        if header['backend'] != backend_name:
+            continue
+        metrics = backend.font_metrics(header['font_name'], header['point_size'], header['bold'], header['italic'])
+        ret.append((path, header, metrics.fingerprint() == header['fingerprint']))
+    return ret
+
+
+# Re-measures all known characters and widths of stale tables with the current fonts, returns number of rebuilt tables
+# Fixed advance ranges of rebuilt tables are probed again by the next conversion
+def rebuild_cache(cache_dir, backend):
+    rebuilt = 0
+
+    for path, header, is_valid in check_cache(cache_dir, backend):
+        if is_valid:
+            continue
+
+        if header is None:
+            os.unlink(path)
+            if os.path.exists(widths_path(path)):
+                os.unlink(widths_path(path))
+            rebuilt += 1
+            continue
+
+        metrics = backend.font_metrics(header['font_name'], header['point_size'], header['bold'], header['italic'])
+
+        with open(path, 'rb') as f:
+            f.seek(header_size)
+            old_data = f.read()
+
+        data = bytearray(b'\xff' * (table_size * 4))
+        if header['byteorder'] == sys.byteorder[0].encode() and len(old_data) == len(data):
+            old_values = memoryview(old_data).cast('i')
+            values = memoryview(data).cast('i')
+            for index in range(table_size):
+                if old_values[index] >= 0:
+                    values[index] = metrics.char_advance_64(chr(table_start + index))
+            values.release()
+            old_values.release()
+
+        widths = {text: metrics.horizontalAdvance(text) for text in read_widths(path, None)}
+
+        with _locked(path):
+            _write_widths(path, metrics.fingerprint(), widths)
+            _write_table(path, header['backend'], metrics.fingerprint(), header['font_name'], header['point_size'], header['bold'], header['italic'], metrics.height(), None, data)
+
+        rebuilt += 1
+
+    return rebuilt
+
+
+def clear_cache(cache_dir):
+    for path, _ in cache_entries(cache_dir):
+        os.unlink(path)
+        if os.path.exists(widths_path(path)):
+            os.unlink(widths_path(path))
+        if os.path.exists(path + '.lock'):
+            os.unlink(path + '.lock')
@@ -0,0 +1,162 @@
+from . import tag_parse_ruby
+from .rubysubs import ConversionStats, FontRegistry, ParserCache, default_measure_backend, decode_sub_data, load_subs, convert_subs, output_format_for_path
+
+import os
+import weakref
+import asyncio
+import threading
+import concurrent.futures
+
+
+# asyncio interface for converting subtitles without blocking the event loop.
+#
+# Files are read and written in the loop's default executor. Decoding, tag parsing, layout and
+# saving run in a thread pool of the converter, one executor job per stage. Cancelling a conversion
+# stops it at the next stage, the running stage finishes in its thread first.
+#
+# At most max_concurrency conversions run at once. Qt measure backends default to 1 and always use a
+# single executor thread, so all QFontMetrics calls happen on one thread. Converters keep their font
+# setups in their own FontRegistry instead of the process-wide default_font_registry, so fonts created
+# by that thread are never shared with conversions in other threads. A QGuiApplication has to exist
+# for Qt backends. Each event loop using a converter gets its own semaphore.
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Writes like SSAFile.save, returns the file size
+def _write_file(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return os.path.getsize(path)
+
+
+class AsyncConverter():
+
+    def __init__(self, measure_backend=None, max_concurrency=None, parser_cache_size=16):
+        if measure_backend is None:
+            measure_backend = default_measure_backend()
+        if max_concurrency is None:
+            max_concurrency = 1 if measure_backend.requires_qt else (os.cpu_count() or 1)
+
+        self.measure_backend = measure_backend
+        self.max_concurrency = max_concurrency
+        self.parser_cache_size = parser_cache_size
+        self.font_registry = FontRegistry()
+
+        # Importing pysubs2 for the first time from several threads at once fails on its circular imports
+        import pysubs2
+
+        # Qt font metrics must not be used from several threads
+        workers = 1 if measure_backend.requires_qt else max_concurrency
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='rubysubs')
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._semaphores_lock = threading.Lock()
+        self._local = threading.local()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # Created on first use in each running loop, semaphores are bound to their loop
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    # Parsers are not thread safe, each executor thread keeps its own cache
+    def _parser_cache(self):
+        parser_cache = getattr(self._local, 'parser_cache', None)
+        if parser_cache is None:
+            parser_cache = ParserCache(self.parser_cache_size, self.font_registry)
+            self._local.parser_cache = parser_cache
+        return parser_cache
+
+    def _load(self, subs_data, stats):
+        with stats.stage('decode'):
+            subs_text, subs_encoding = decode_sub_data(subs_data)
+        stats.info['encoding'] = subs_encoding
+        with stats.stage('load'):
+            return load_subs(subs_text)
+
+    def _convert(self, subs, tag_parser, stats, layout_options):
+        convert_subs(subs, tag_parser, self.measure_backend, stats, self._parser_cache(), layout_options)
+
+    def _save(self, subs, output_format, stats):
+        with stats.stage('save'):
+            out_text = subs.to_string(output_format, header_notice='Generated by rubysubs')
+        with stats.stage('flush'):
+            self.measure_backend.flush()
+        return out_text
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _convert_data(self, subs_data, tag_parser, stats, output_format, layout_options):
+        async with self._get_semaphore():
+            subs = await self._run(self._load, subs_data, stats)
+            await self._run(self._convert, subs, tag_parser, stats, layout_options)
+            out_text = await self._run(self._save, subs, output_format, stats)
+
+        stats.count('input_bytes', len(subs_data))
+        return out_text
+
+    # Converts subtitle file data (bytes or str), returns the converted file as str
+    async def convert_data(self, subs_data, tag_parser=tag_parse_ruby.parse, stats=None, output_format='ass', layout_options=None):
+        if stats is None:
+            stats = ConversionStats()
+        if isinstance(subs_data, str):
+            subs_data = subs_data.encode('utf-8')
+
+        out_text = await self._convert_data(subs_data, tag_parser, stats, output_format, layout_options)
+        stats.count('output_bytes', len(out_text.encode('utf-8')))
+        return out_text
+
+    # Converts a file, returns a ConversionStats
+    async def convert_file(self, in_path, out_path, tag_parser=tag_parse_ruby.parse, stats=None, layout_options=None):
+        if stats is None:
+            stats = ConversionStats()
+        loop = asyncio.get_running_loop()
+
+        with stats.stage('read'):
+            subs_data = await loop.run_in_executor(None, _read_file, in_path)
+
+        out_text = await self._convert_data(subs_data, tag_parser, stats, output_format_for_path(out_path), layout_options)
+
+        with stats.stage('write'):
+            out_size = await loop.run_in_executor(None, _write_file, out_path, out_text)
+
+        stats.count('output_bytes', out_size)
+        return stats
+
+
+_default_converter = None
+_default_converter_lock = threading.Lock()
+
+def _get_default_converter():
+    global _default_converter
+    with _default_converter_lock:
+        if _default_converter is None:
+            _default_converter = AsyncConverter()
+        return _default_converter
+
+
+# Same as convert_sub_file and convert_sub_data using a shared AsyncConverter with the default measure backend
+async def convert_sub_file_async(in_path, out_path, tag_parser=tag_parse_ruby.parse, stats=None, layout_options=None):
+    return await _get_default_converter().convert_file(in_path, out_path, tag_parser, stats, layout_options)
+
+
+async def convert_sub_data_async(subs_data, tag_parser=tag_parse_ruby.parse, stats=None, output_format='ass', layout_options=None):
+    return await _get_default_converter().convert_data(subs_data, tag_parser, stats, output_format, layout_options)
@@ -0,0 +1,26 @@
+import re
+
+
+# An override block runs from '{' to the next '}' or the end of the text. Stray '}' are dropped as well.
+override_pattern = re.compile(r'\{[^}]*\}?|\}')
+
+
+# Splits text into a list of (text, is_override) spans in one pass
+def split_ass_tags(text):
+    spans = []
+    last = 0
+    for m in override_pattern.finditer(text):
+        if m.start() > last:
+            spans.append((text[last:m.start()], False))
+        spans.append((m.group(), True))
+        last = m.end()
+    if last < len(text):
+        spans.append((text[last:], False))
+    return spans
+
+
+# Removes all curly brace tags
+def strip_ass_tags(text):
+    if '{' not in text and '}' not in text:
+        return text
+    return override_pattern.sub('', text)
@@ -0,0 +1,137 @@
+from . import tag_parsers
+from .rubysubs import convert_sub_file, create_qt_application
+
+import os
+import glob
+import multiprocessing
+
+
+subtitle_extensions = ('.ass', '.ssa', '.srt')
+
+
+# Expands input paths, directories and glob patterns into a sorted list of subtitle files
+def expand_inputs(inputs):
+    ret = []
+    seen = set()
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            paths = []
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(subtitle_extensions):
+                        paths.append(os.path.join(root, name))
+        elif os.path.exists(pattern):
+            paths = [pattern]
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True))
+
+        for path in paths:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                ret.append(path)
+
+    return ret
+
+
+# Fills an output template for an input path
+# Available fields: {path} (input path without extension), {dir}, {name}, {stem}, {ext}
+def output_path_for(in_path, out_template):
+    directory, name = os.path.split(in_path)
+    stem, ext = os.path.splitext(name)
+    return out_template.format(
+        path=os.path.join(directory, stem),
+        dir=directory if directory else '.',
+        name=name,
+        stem=stem,
+        ext=ext,
+    )
+
+
+# Per worker process state, QGuiApplication is created once and reused for every file
+_worker_qapp = None
+_worker_tag_parsers = tag_parsers.TagParserCache()
+_worker_measure_backend = None
+_worker_result_cache = None
+_worker_layout_options = None
+
+def _init_worker(measure_backend=None, result_cache=None, layout_options=None):
+    global _worker_qapp, _worker_measure_backend, _worker_result_cache, _worker_layout_options
+    _worker_measure_backend = measure_backend
+    _worker_result_cache = result_cache
+    _worker_layout_options = layout_options
+    if measure_backend is not None and not measure_backend.requires_qt:
+        return
+    _worker_qapp = create_qt_application()
+
+
+def _convert_job(job):
+    in_path, out_path, tag_parser_name, tag_parser_args = job
+
+    try:
+        tag_parser = _worker_tag_parsers.get(tag_parser_name, tag_parser_args)
+
+        out_dir = os.path.dirname(out_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        convert_sub_file(in_path, out_path, tag_parser, _worker_measure_backend, result_cache=_worker_result_cache, layout_options=_worker_layout_options)
+    except Exception as e:
+        return (in_path, out_path, '%s: %s' % (type(e).__name__, e))
+
+    return (in_path, out_path, None)
+
+
+# Converts many subtitle files using a pool of worker processes
+# Returns list of (in_path, out_path, error) with error being None on success
+def convert_sub_files(inputs, out_template, tag_parser_name='ruby', tag_parser_args=(), workers=None, callback=None, measure_backend=None, result_cache=None, layout_options=None):
+
+    if not tag_parsers.is_valid_name(tag_parser_name):
+        raise ValueError('Invalid tag parser: %s' % tag_parser_name)
+
+    in_paths = expand_inputs(inputs)
+
+    jobs = []
+    out_paths = set()
+    for in_path in in_paths:
+        out_path = output_path_for(in_path, out_template)
+        out_key = os.path.abspath(out_path)
+        if out_key in out_paths:
+            raise ValueError('Output template maps multiple inputs to %s' % out_path)
+        if out_key == os.path.abspath(in_path):
+            raise ValueError('Output template maps %s onto itself' % in_path)
+        out_paths.add(out_key)
+        jobs.append((in_path, out_path, tag_parser_name, list(tag_parser_args)))
+
+    if not jobs:
+        return []
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+
+    results = []
+
+    def handle_result(result):
+        results.append(result)
+        if callback is not None:
+            callback(*result)
+
+    if workers == 1:
+        _init_worker(measure_backend, result_cache, layout_options)
+        for job in jobs:
+            handle_result(_convert_job(job))
+    else:
+        # Spawn fresh processes, a forked Qt application state is not safe to reuse
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(measure_backend, result_cache, layout_options)) as pool:
+            for result in pool.imap_unordered(_convert_job, jobs):
+                handle_result(result)
+
+    # Report in input order regardless of completion order
+    order = {in_path: i for i, in_path in enumerate(in_paths)}
+    results.sort(key=lambda r: order[r[0]])
+
+    return results
@@ -0,0 +1,277 @@
+from . import tag_parsers
+from .rubysubs import ConversionStats, ParserCache, default_measure_backend, check_layout_options, convert_sub_file, convert_sub_data
+
+import os
+import json
+import queue
+import base64
+import socket
+import struct
+import threading
+
+
+# Conversion daemon on a Unix domain socket.
+#
+# Messages in both directions are a 4 byte big-endian length followed by that many bytes of UTF-8 JSON.
+# Each connection sends requests and receives one response per request, in order.
+#
+# Requests:
+#   {"command": "ping"}
+#   {"command": "convert", "tag_parser": "ja", "tag_parser_args": ["kana"],
+#    "input_path": "in.ass" or "input_data": "<base64>",
+#    "output_path": "out.ass" (optional, without it the result is returned as "output_data"),
+#    "layout_options": {"compact": true, "merge_drawings": "frame"} (optional, only these two options),
+#    "stats": true (optional)}
+#
+# Responses:
+#   {"ok": true, ...} or {"ok": false, "error": "<message>"}
+#
+# Conversions run one at a time on the thread calling serve_forever, which owns the QGuiApplication.
+# Connections are handled by one thread each, at most max_connections at once. At most max_queue
+# requests wait for conversion, further requests are answered with an error right away.
+
+header_format = '>I'
+header_size = struct.calcsize(header_format)
+
+max_message_size = 256 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# Returns the next message or None if the connection was closed
+def recv_message(sock):
+    header = _recv_exact(sock, header_size)
+    if header is None:
+        return None
+    size, = struct.unpack(header_format, header)
+    if size > max_message_size:
+        raise ProtocolError('Message too large: %d bytes' % size)
+    data = _recv_exact(sock, size)
+    if data is None:
+        raise ProtocolError('Connection closed in the middle of a message')
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError('Invalid message: %s' % e)
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(struct.pack(header_format, len(data)) + data)
+
+
+class ConversionDaemon():
+
+    def __init__(self, socket_path, measure_backend=None, max_connections=16, max_queue=64, parser_cache_size=16):
+        if measure_backend is None:
+            measure_backend = default_measure_backend()
+
+        self.socket_path = socket_path
+        self.measure_backend = measure_backend
+        self.max_connections = max_connections
+
+        self.jobs = queue.Queue(max_queue)
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.parser_cache = ParserCache(parser_cache_size)
+        self.tag_parsers = tag_parsers.TagParserCache()
+        self.listener = None
+        self.running = False
+
+    def convert(self, request):
+        tag_parser = self.tag_parsers.get(request.get('tag_parser', 'ruby'), request.get('tag_parser_args', []))
+        stats = ConversionStats()
+        response = {'ok': True}
+
+        output_path = request.get('output_path')
+        layout_options = request.get('layout_options')
+        check_layout_options(layout_options)
+
+        if 'input_path' in request:
+            if output_path is None:
+                raise ValueError('input_path requires output_path')
+            convert_sub_file(request['input_path'], output_path, tag_parser, self.measure_backend, stats, parser_cache=self.parser_cache, layout_options=layout_options)
+        elif 'input_data' in request:
+            subs_data = base64.b64decode(request['input_data'])
+            out_text = convert_sub_data(subs_data, tag_parser, self.measure_backend, stats, self.parser_cache, layout_options=layout_options)
+            if output_path is None:
+                response['output_data'] = base64.b64encode(out_text.encode('utf-8')).decode('ascii')
+            else:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(out_text)
+        else:
+            raise ValueError('Request has neither input_path nor input_data')
+
+        response['encoding'] = stats.info.get('encoding')
+        if request.get('stats'):
+            response['stats'] = stats.to_dict()
+        return response
+
+    def handle_request(self, request):
+        command = request.get('command', 'convert')
+        if command == 'ping':
+            return {'ok': True}
+        if command == 'convert':
+            return self.convert(request)
+        raise ValueError('Unknown command: %s' % command)
+
+    def _handle_connection(self, conn):
+        try:
+            with conn:
+                while self.running:
+                    try:
+                        request = recv_message(conn)
+                    except ProtocolError as e:
+                        send_message(conn, {'ok': False, 'error': str(e)})
+                        return
+                    if request is None:
+                        return
+
+                    job = (request, queue.Queue(1))
+                    try:
+                        self.jobs.put_nowait(job)
+                    except queue.Full:
+                        send_message(conn, {'ok': False, 'error': 'Busy, too many queued requests'})
+                        continue
+
+                    send_message(conn, job[1].get())
+        except OSError:
+            pass
+        finally:
+            self.connection_slots.release()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            if not self.connection_slots.acquire(blocking=False):
+                try:
+                    send_message(conn, {'ok': False, 'error': 'Busy, too many connections'})
+                except OSError:
+                    pass
+                conn.close()
+                continue
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            # Only remove stale sockets, not ones of a running daemon
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise OSError('Daemon already running on %s' % self.socket_path)
+            except ConnectionRefusedError:
+                os.unlink(self.socket_path)
+            finally:
+                probe.close()
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(self.max_connections)
+        self.running = True
+
+    # Converts queued requests until shutdown is called from another thread or the process is interrupted
+    def serve_forever(self):
+        if self.listener is None:
+            self.listen()
+
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+        try:
+            while self.running:
+                try:
+                    request, reply = self.jobs.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    response = self.handle_request(request)
+                except Exception as e:
+                    response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+                reply.put(response)
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self.running = False
+
+    def close(self):
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+class DaemonError(Exception):
+    pass
+
+
+# Client keeping one connection to a daemon
+class DaemonClient():
+
+    def __init__(self, socket_path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Returns the response, raises DaemonError if the request failed
+    def request(self, message):
+        send_message(self.sock, message)
+        response = recv_message(self.sock)
+        if response is None:
+            raise DaemonError('Connection closed by daemon')
+        if not response.get('ok'):
+            raise DaemonError(response.get('error', 'Unknown error'))
+        return response
+
+    def ping(self):
+        self.request({'command': 'ping'})
+
+    # Converts a file the daemon can read and write
+    def convert_file(self, in_path, out_path, tag_parser='ruby', tag_parser_args=(), stats=False, layout_options=None):
+        return self.request({
+            'command':          'convert',
+            'input_path':       os.path.abspath(in_path),
+            'output_path':      os.path.abspath(out_path),
+            'tag_parser':       tag_parser,
+            'tag_parser_args':  list(tag_parser_args),
+            'layout_options':   layout_options,
+            'stats':            stats,
+        })
+
+    # Converts subtitle file data, returns the converted file as bytes
+    def convert_data(self, subs_data, tag_parser='ruby', tag_parser_args=(), layout_options=None):
+        response = self.request({
+            'command':          'convert',
+            'input_data':       base64.b64encode(subs_data).decode('ascii'),
+            'tag_parser':       tag_parser,
+            'tag_parser_args':  list(tag_parser_args),
+            'layout_options':   layout_options,
+        })
+        return base64.b64decode(response['output_data'])
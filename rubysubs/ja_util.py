@@ -1,3 +1,6 @@
+import functools
+
+
 hiragana = 'ぁあぃいぅうぇえぉおかがきぎくぐけげこごさざしじすずせぜそぞただちぢっつづてでとどなにぬ' \
            'ねのはばぱひびぴふぶぷへべぺほぼぽまみむめもゃやゅゆょよらりるれろゎわゐゑをんゔゕゖゝゞ'
 katakana = 'ァアィイゥウェエォオカガキギクグケゲコゴサザシジスズセゼソゾタダチヂッツヅテデトドナニヌ' \
@@ -25,45 +28,61 @@ def is_kana(text):
     return all(c in kana for c in text)
 
 
+# Distributes reading over groups of (is_kana, text, hiragana text)
+# Returns list of (text, furigana) or None if there is no or more than one distribution.
+#
+# Each state (reading position, group index) has at most one distribution of the rest of the reading
+# over the remaining groups, so states are solved once. Solutions are stored as (segment, next state)
+# links and only joined into a list for the first state.
 def _distribute_furigana_groups(reading, reading_h, groups):
-    if len(groups) < 1:
-        return []
-
-    is_kana, text, text_h = groups[0]
-    text_len = len(text)
+    group_count = len(groups)
+    reading_len = len(reading)
+    memo = {}
 
-    if is_kana:
-        if reading_h.startswith(text_h):
-            segs = _distribute_furigana_groups(reading[text_len:], reading_h[text_len:], groups[1:])
+    def solve(pos, gi):
+        if gi == group_count:
+            return ()
 
-            if segs is not None:
-                furigana = '' if reading.startswith(text) else reading[:text_len]
-                segs.insert(0, (text, furigana))
-                return segs
-
-        return None
+        key = (pos, gi)
+        if key in memo:
+            return memo[key]
 
-    else:
+        is_kana, text, text_h = groups[gi]
+        text_len = len(text)
         result = None
 
-        for i in range(len(reading), text_len-1, -1):
-            segs = _distribute_furigana_groups(reading[i:], reading_h[i:], groups[1:])
+        if is_kana:
+            if reading_h.startswith(text_h, pos) and solve(pos + text_len, gi + 1) is not None:
+                furigana = '' if reading.startswith(text, pos) else reading[pos:pos+text_len]
+                result = ((text, furigana), (pos + text_len, gi + 1))
 
-            if segs is not None:
-                if result is not None:
-                    return None     # Ambiguous
+        else:
+            for end in range(reading_len, pos + text_len - 1, -1):
+                if solve(end, gi + 1) is not None:
+                    if result is not None:
+                        result = None     # Ambiguous
+                        break
+                    result = ((text, reading[pos:end]), (end, gi + 1))
+
+                # The last group takes all of the remaining reading
+                if gi == group_count - 1:
+                    break
+
+        memo[key] = result
+        return result
 
-                furigana = reading[:i]
-                segs.insert(0, (text, furigana))
-                result = segs
+    if solve(0, 0) is None:
+        return None
 
-            if len(groups) == 1:
-                break
+    segs = []
+    state = (0, 0)
+    while state[1] < group_count:
+        seg, state = memo[state]
+        segs.append(seg)
+    return segs
 
-        return result
 
-
-def distribute_furigana(expression, reading):
+def _distribute_furigana(expression, reading):
 
     if not reading or reading == expression:
         return [(expression, '')]
@@ -92,6 +111,19 @@ def distribute_furigana(expression, reading):
     return [(expression, reading)]
 
 
+# The same words repeat throughout subtitle files
+distribute_furigana_cache_size = 4096
+
+@functools.lru_cache(maxsize=distribute_furigana_cache_size)
+def _distribute_furigana_cached(expression, reading):
+    return tuple(_distribute_furigana(expression, reading))
+
+
+# Returns list of (text, furigana) segments of expression
+def distribute_furigana(expression, reading):
+    return list(_distribute_furigana_cached(expression, reading))
+
+
 def distribute_furigana_html(expression, reading):
     r = []
     for txt, ruby in distribute_furigana(expression, reading):
@@ -0,0 +1,97 @@
+from . import tag_parsers
+from .rubysubs import ConversionStats, ParserCache, create_qt_application, default_measure_backend, style_parsers, collision_groups, layout_subs_events
+
+import os
+import multiprocessing
+
+
+# Lays out the events of a single file in worker processes.
+#
+# Events sorted by start time split into collision groups, runs of events not overlapping in time
+# with any event outside of the run. The position of an event only depends on earlier events of its
+# group, so groups are laid out independently and the results are merged back in the original order.
+# Output is the same as laying out in one process.
+#
+# Workers build their parsers from the style setup of the file and the spec of the tag parser, see
+# tag_tables.CompiledParser. Tag parsers without one are laid out in the calling process.
+
+
+# Per worker process state, like batch workers
+_worker_qapp = None
+_worker_tag_parsers = tag_parsers.TagParserCache()
+_worker_measure_backend = None
+_worker_parser_cache = None
+
+def _init_worker(measure_backend=None, parser_cache_size=16):
+    global _worker_qapp, _worker_measure_backend, _worker_parser_cache
+    if measure_backend is None or measure_backend.requires_qt:
+        _worker_qapp = create_qt_application()
+    if measure_backend is None:
+        measure_backend = default_measure_backend()
+    _worker_measure_backend = measure_backend
+    _worker_parser_cache = ParserCache(parser_cache_size)
+
+
+def _layout_job(job):
+    event_styles, tag_parser_spec, layout_options, events = job
+
+    tag_parser = _worker_tag_parsers.get(*tag_parser_spec)
+
+    parsers = style_parsers(event_styles, tag_parser, _worker_measure_backend, _worker_parser_cache, layout_options)
+    return layout_subs_events(parsers, events, ConversionStats())
+
+
+class LayoutPool():
+
+    # Collision groups are combined into about chunks_per_worker jobs per worker of at least
+    # min_chunk_events events each. More jobs balance better, fewer send less data.
+    def __init__(self, workers=None, measure_backend=None, chunks_per_worker=4, min_chunk_events=50):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self.workers = max(1, workers)
+        self.chunks_per_worker = chunks_per_worker
+        self.min_chunk_events = min_chunk_events
+
+        # Spawned like the workers of batch.convert_sub_files, see there
+        ctx = multiprocessing.get_context('spawn')
+        self.pool = ctx.Pool(self.workers, initializer=_init_worker, initargs=(measure_backend,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def supports(self, tag_parser):
+        return getattr(tag_parser, 'spec', None) is not None
+
+    # Combines consecutive collision groups into chunks, returns list of (first index, end index)
+    def chunks(self, events):
+        chunk_size = max(self.min_chunk_events, len(events) // (self.workers * self.chunks_per_worker))
+
+        ret = []
+        for first, end in collision_groups(events):
+            if ret and ret[-1][1] - ret[-1][0] < chunk_size:
+                ret[-1] = (ret[-1][0], end)
+            else:
+                ret.append((first, end))
+        return ret
+
+    # Same as rubysubs.layout_subs_events for the parsers of event_styles
+    # Returns the parts of each event and a dict of counters summed over all workers
+    def layout_event_parts(self, event_styles, tag_parser, events, layout_options=None):
+        jobs = [(event_styles, tag_parser.spec, layout_options, events[first:end]) for first, end in self.chunks(events)]
+
+        event_parts = []
+        counters = {}
+        for parts, chunk_counters in self.pool.imap(_layout_job, jobs):
+            event_parts.extend(parts)
+            for name, n in chunk_counters.items():
+                counters[name] = counters.get(name, 0) + n
+
+        return event_parts, counters
@@ -0,0 +1,170 @@
+from .version import __version__
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+
+# Content-addressed cache of converted subtitle files.
+#
+# Entries are keyed by a hash of the input bytes, the tag parser and its resolved arguments, the
+# measure backend settings, the layout options, the output format, the rubysubs version and
+# output_version. Style and font settings are part of the input file. Updating an installed font
+# without changing the backend settings is not detected, clear the cache in that case. Entries are
+# plain files, their modification time is bumped on every hit and the least recently used entries
+# are evicted first.
+#
+# The cache directory is scanned once by the first store, later stores add to the recorded size and
+# entry count. Only once these exceed a limit the directory is scanned again and entries are evicted
+# down to 90% of the limits, so a full cache is not scanned on every store. Entries stored by other
+# processes meanwhile are only counted by the next scan.
+
+file_extension = '.ass'
+
+# Bumped whenever the converted output of the same input and settings changes
+output_version = 5
+
+
+# Returns 90% of a limit, None for no limit
+def reduced_limit(limit):
+    if limit is None:
+        return None
+    return limit - limit // 10
+
+
+class ResultCache():
+
+    # max_bytes and max_entries limit the cache size after each store, None for no limit
+    def __init__(self, cache_dir, max_bytes=None, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        # Size and entry count of the last scan plus the entries stored since, None before the first scan
+        self.recorded_bytes = None
+        self.recorded_entries = None
+
+    def key(self, subs_data, tag_parser_key, measure_backend_key, layout_key='', output_format='ass'):
+        h = hashlib.sha256()
+        parts = [__version__, str(output_version), output_format, tag_parser_key, measure_backend_key]
+        if layout_key:
+            parts.append(layout_key)
+        for part in parts:
+            h.update(part.encode('utf-8'))
+            h.update(b'\0')
+        h.update(subs_data)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + file_extension)
+
+    # Copies the cached result to out_path, returns False if there is none
+    def fetch(self, key, out_path):
+        path = self.entry_path(key)
+        try:
+            shutil.copyfile(path, out_path)
+            os.utime(path)
+        except OSError:
+            # Missing or evicted by another process meanwhile
+            return False
+        return True
+
+    # Stores the result written to out_path
+    def store(self, key, out_path):
+        path = self.entry_path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = None
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix=file_extension, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f, open(out_path, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f)
+                size = f.tell()
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        if self.max_bytes is None and self.max_entries is None:
+            return
+
+        if self.recorded_bytes is None:
+            self.scan()
+        elif replaced_size is None:
+            self.recorded_bytes += size
+            self.recorded_entries += 1
+        else:
+            self.recorded_bytes += size - replaced_size
+
+        too_big = self.max_bytes is not None and self.recorded_bytes > self.max_bytes
+        too_many = self.max_entries is not None and self.recorded_entries > self.max_entries
+        if too_big or too_many:
+            self.prune(reduced_limit(self.max_bytes), reduced_limit(self.max_entries))
+
+    # Returns list of (key, size, last use time) sorted from least to most recently used
+    def entries(self):
+        ret = []
+        if not os.path.isdir(self.cache_dir):
+            return ret
+        for sub_dir in os.listdir(self.cache_dir):
+            sub_path = os.path.join(self.cache_dir, sub_dir)
+            if len(sub_dir) != 2 or not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                if not name.endswith(file_extension) or name.startswith('.tmp-'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(sub_path, name))
+                except OSError:
+                    continue
+                ret.append((name[:-len(file_extension)], st.st_size, st.st_mtime))
+        ret.sort(key=lambda e: e[2])
+        return ret
+
+    def total_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    # Records the current size and entry count
+    def scan(self):
+        entries = self.entries()
+        self.recorded_bytes = sum(size for _, size, _ in entries)
+        self.recorded_entries = len(entries)
+
+    # Evicts least recently used entries until the limits are met and entries older than
+    # max_age seconds, returns list of evicted keys
+    def prune(self, max_bytes=None, max_entries=None, max_age=None):
+        entries = self.entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        total_entries = len(entries)
+        now = time.time()
+
+        evicted = []
+        for key, size, mtime in entries:
+            too_big = max_bytes is not None and total_bytes > max_bytes
+            too_many = max_entries is not None and total_entries > max_entries
+            too_old = max_age is not None and now - mtime > max_age
+            if not (too_big or too_many or too_old):
+                continue
+            try:
+                os.unlink(self.entry_path(key))
+            except OSError:
+                pass
+            total_bytes -= size
+            total_entries -= 1
+            evicted.append(key)
+
+        self.recorded_bytes = total_bytes
+        self.recorded_entries = total_entries
+
+        return evicted
+
+    def clear(self):
+        return self.prune(max_entries=0)
@@ -1,110 +1,661 @@
 from . import tags
 from . import tag_parse_ruby
+from .ass_tags import strip_ass_tags
 
+import os
+import re
+import sys
 import math
+import time
+import heapq
+import bisect
 import codecs
-import cchardet as chardet
-import pysubs2
-from PyQt5.QtGui import QFont, QFontMetrics
-
-
-# Removes all curly brace tags
-def strip_ass_tags(text):
-    ret = ''
-    in_curly = False
-    for c in text:
-        if c == '{':
-            in_curly = True
-        elif c == '}':
-            in_curly = False
-        elif not in_curly:
-            ret += c
-    return ret
+import threading
+import contextlib
+import unicodedata
+from collections import OrderedDict
 
+# cchardet, pysubs2 and PyQt5 are imported when needed to keep startup fast
 
-class RubySubParser():
 
-    def __init__(self, frame_width, frame_height, bottom_margin, font_name, font_size, ruby_font_size, bold, tag_parser=tag_parse_ruby.parse):
+# Returns the QGuiApplication, creating it if required.
+# Without a display Qt's offscreen platform is used, unless QT_QPA_PLATFORM selects one.
+def create_qt_application(argv=None):
+    if sys.platform.startswith(('linux', 'freebsd', 'openbsd', 'netbsd')):
+        if not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
 
-        self.tag_parser = tag_parser
+    from PyQt5.QtGui import QGuiApplication
+    qapp = QGuiApplication.instance()
+    if qapp is None:
+        qapp = QGuiApplication(argv if argv is not None else ['rubysubs'])
+    return qapp
+
+
+# Text measurement backends create font metrics objects for a font name, point size, boldness and italic.
+# Font metrics objects provide height() and horizontalAdvance(text) in pixels like QFontMetrics,
+# char_advance_64(c) with the advance of a single character in 26.6 fixed point and fingerprint()
+# identifying the font file and resolution. They can provide fixed_advance_table() returning their
+# own FixedAdvanceTable, for example one probed in an earlier run.
+class MeasureBackend():
+
+    # True if a QGuiApplication is required to use the backend
+    requires_qt = False
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        raise NotImplementedError()
+
+    # Called after a file is converted, backends keeping persistent state save it here
+    def flush(self):
+        pass
+
+    # String identifying the backend and its settings, part of result cache keys
+    def cache_key(self):
+        return type(self).__name__
+
+
+class QtFontMetrics():
+
+    def __init__(self, font):
+        from PyQt5.QtGui import QFontMetrics, QFontMetricsF
+        self.font = font
+        self.metrics = QFontMetrics(font)
+        self.metrics_f = QFontMetricsF(font)
+        self.height = self.metrics.height
+        self.horizontalAdvance = self.metrics.horizontalAdvance
+
+    def char_advance_64(self, c):
+        return round(self.metrics_f.horizontalAdvance(c) * 64)
+
+    def fingerprint(self):
+        import hashlib
+        from PyQt5.QtGui import QRawFont
+        raw_font = QRawFont.fromFont(self.font)
+        h = hashlib.sha1()
+        h.update(raw_font.familyName().encode('utf-8'))
+        h.update(bytes(raw_font.fontTable('head')))
+        h.update(b'%d %d' % (self.height(), self.char_advance_64('\u6c34')))
+        return h.digest()
+
+
+# Measures with QFontMetrics, requires a QGuiApplication instance
+class QtMeasureBackend(MeasureBackend):
+
+    requires_qt = True
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        from PyQt5.QtGui import QFont
+        font = QFont(font_name, point_size)
+        font.setBold(bold)
+        font.setItalic(italic)
+        return QtFontMetrics(font)
+
+
+# Measures by reading advance widths (cmap, hmtx and kern/GPOS kerning) directly from TTF/OTF files.
+# Fonts are looked up by family name in font_dirs (system font directories by default), font_path
+# is used if the lookup fails. Widths match Qt with FreeType to within 1-2 px at subtitle sizes.
+# Ligatures, complex shaping and fallback fonts for missing glyphs are not applied.
+# The default dpi matches Qt's offscreen platform, desktop platforms usually use 96.
+class SfntMeasureBackend(MeasureBackend):
+
+    def __init__(self, font_path=None, font_dirs=None, dpi=100):
+        self.font_path = font_path
+        self.font_dirs = font_dirs
+        self.dpi = dpi
+        self._font_index = None
+        self._fonts = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_font_index'] = None
+        state['_fonts'] = {}
+        return state
+
+    def font_file(self, font_name, bold, italic=False):
+        from . import sfnt
+
+        if self.font_dirs is not None or self.font_path is None:
+            if self._font_index is None:
+                font_dirs = self.font_dirs if self.font_dirs is not None else sfnt.default_font_dirs()
+                self._font_index = sfnt.build_font_index(font_dirs)
+            found = sfnt.find_font(self._font_index, font_name, bold, italic)
+            if found is not None:
+                return found
+
+        if self.font_path is not None:
+            return (self.font_path, 0)
+
+        raise ValueError('No font file found for font family %s' % font_name)
+
+    def cache_key(self):
+        font_path = os.path.abspath(self.font_path) if self.font_path is not None else None
+        font_dirs = [os.path.abspath(d) for d in self.font_dirs] if self.font_dirs is not None else None
+        return '%s %r %r %r' % (type(self).__name__, font_path, font_dirs, self.dpi)
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        from . import sfnt
+
+        key = self.font_file(font_name, bold, italic)
+        font = self._fonts.get(key)
+        if font is None:
+            font = sfnt.SfntFont(*key)
+            self._fonts[key] = font
+
+        pixel_size = round(point_size * self.dpi / 72)
+        return sfnt.SfntFontMetrics(font, pixel_size)
+
+
+# Codepoint ranges that CJK fonts usually set with one full-width advance
+fixed_advance_ranges = [
+    (0x3000, 0x303F),   # CJK symbols and punctuation
+    (0x3040, 0x309F),   # Hiragana
+    (0x30A0, 0x30FF),   # Katakana
+    (0x3400, 0x4DBF),   # CJK unified ideographs extension A
+    (0x4E00, 0x9FFF),   # CJK unified ideographs
+    (0xAC00, 0xD7A3),   # Hangul syllables
+    (0xFF01, 0xFF60),   # Fullwidth forms
+]
+
+fixed_advance_probe_count = 64
+
+non_spacing_categories = ('Mn', 'Me', 'Cf')
+
+
+# Combining marks, variation selectors and zero width characters attach to their neighbours when
+# shaped, so their advance alone is not what they add to the width of text
+def is_non_spacing_char(c):
+    return unicodedata.combining(c) != 0 or unicodedata.category(c) in non_spacing_categories
+
+
+# Measures text made only of characters with a uniform advance without shaping.
+# Ranges are probed on construction: sampled characters must share one advance and strings of them
+# must measure exactly as the sum of their advances. Every other character of a range is checked
+# once on first use, so characters taken from fallback fonts are measured normally. Non-spacing
+# characters like the combining kana voicing marks U+3099/U+309A are never summed.
+class FixedAdvanceTable():
+
+    # range_advances optionally holds the range_advances() of an earlier probe of the same font,
+    # the ranges are not probed again then
+    def __init__(self, metrics, range_advances=None):
+        self.metrics = metrics
+        self.ranges = []        # (start, end, advance_64)
+        self.advances = {}      # character -> advance_64, -1 if it has to be measured normally
+
+        if range_advances is not None:
+            for (start, end), advance in zip(fixed_advance_ranges, range_advances):
+                if advance > 0:
+                    self.ranges.append((start, end, advance))
+            return
+
+        probe_texts = []
+
+        for start, end in fixed_advance_ranges:
+            step = max(1, (end - start + 1) // fixed_advance_probe_count)
+            samples = [c for c in map(chr, range(start, end + 1, step)) if not is_non_spacing_char(c)]
+            advance = metrics.char_advance_64(samples[0])
+            if advance <= 0 or any(metrics.char_advance_64(c) != advance for c in samples):
+                continue
+
+            text = ''.join(samples)
+            if not self._measures_exactly(text, advance) or not self._measures_exactly(text[::-1], advance):
+                continue
+
+            self.ranges.append((start, end, advance))
+            probe_texts.append(text)
+
+        # Mixed strings of all ranges have to measure exactly too
+        if self.ranges and not self._measures_exactly(''.join(probe_texts)):
+            self.ranges = []
+
+    # Advance of each of fixed_advance_ranges in 26.6 fixed point, 0 for ranges measured normally
+    def range_advances(self):
+        advances = {start: advance for start, _, advance in self.ranges}
+        return [advances.get(start, 0) for start, _ in fixed_advance_ranges]
+
+    def _measures_exactly(self, text, advance=None):
+        if advance is None:
+            total = sum(self.metrics.char_advance_64(c) for c in text)
+        else:
+            total = len(text) * advance
+        return self.metrics.horizontalAdvance(text) == (total + 32) >> 6
+
+    def _char_advance(self, c):
+        cp = ord(c)
+        advance = -1
+        for start, end, range_advance in self.ranges:
+            if start <= cp <= end:
+                if not is_non_spacing_char(c) and self.metrics.char_advance_64(c) == range_advance:
+                    advance = range_advance
+                break
+        self.advances[c] = advance
+        return advance
+
+    # Returns the width or None if the text has to be measured normally
+    def width(self, text):
+        advances = self.advances
+        total = 0
+        for c in text:
+            advance = advances.get(c)
+            if advance is None:
+                advance = self._char_advance(c)
+            if advance < 0:
+                return None
+            total += advance
+        return (total + 32) >> 6
+
+
+# Returns the FixedAdvanceTable of font metrics, see MeasureBackend
+def fixed_advance_table(metrics):
+    if hasattr(metrics, 'fixed_advance_table'):
+        return metrics.fixed_advance_table()
+    return FixedAdvanceTable(metrics)
+
+
+# Font sizes and metrics of the main and the ruby font of a style, shared by all parsers using it
+class FontSetup():
+
+    def __init__(self, measure_backend, font_name, font_size, ruby_font_size, bold, fixed_advances=True, italic=False):
 
         # ASS font size is actually the line height, not the cap height like regularly
         probe_size = 1000
-        probe_font = QFont(font_name, probe_size)
-        probe_font.setBold(bold)
-        probe_font_metrics = QFontMetrics(probe_font)
+        probe_font_metrics = measure_backend.font_metrics(font_name, probe_size, bold, italic)
         ass_font_factor = probe_size / probe_font_metrics.height()
 
-        self.normal_line_height = round(font_size)
         self.font_size = math.ceil(font_size * ass_font_factor)
-        
+
         if ruby_font_size is None:
             self.ruby_font_size = round(font_size / 2)
         else:
             self.ruby_font_size = round(ruby_font_size * ass_font_factor)
 
-        font = QFont(font_name, self.font_size)
-
-        font.setBold(bold)
-        self.font_metrics = QFontMetrics(font)
+        self.font_metrics = measure_backend.font_metrics(font_name, self.font_size, bold, italic)
         self.font_height = self.font_metrics.height()
 
-        ruby_font = QFont(font_name, self.ruby_font_size)
-        ruby_font.setBold(bold)
-        self.ruby_font_metrics = QFontMetrics(ruby_font)
+        self.ruby_font_metrics = measure_backend.font_metrics(font_name, self.ruby_font_size, bold, italic)
         self.ruby_font_height = self.ruby_font_metrics.height()
 
+        # Fast path for full-width CJK text, needs per character advances from the backend
+        self.fixed_advances = None
+        self.ruby_fixed_advances = None
+        if fixed_advances and hasattr(self.font_metrics, 'char_advance_64'):
+            self.fixed_advances = fixed_advance_table(self.font_metrics)
+            self.ruby_fixed_advances = fixed_advance_table(self.ruby_font_metrics)
+
+
+# Process-wide registry of FontSetups keyed by measure backend, font name, font size, ruby font size,
+# boldness and italic. Files sharing a style skip font probing and reuse the warm fixed advance tables.
+# Least recently used setups are evicted above max_size, a max_size of 0 disables sharing.
+# Registries can be used from several threads, setups are created while holding the lock.
+class FontRegistry():
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.setups = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.setups)
+
+    def get(self, measure_backend, font_name, font_size, ruby_font_size, bold, fixed_advances=True, italic=False):
+        key = (measure_backend, font_name, font_size, ruby_font_size, bold, fixed_advances, italic)
+        with self.lock:
+            setup = self.setups.get(key)
+            if setup is not None:
+                self.setups.move_to_end(key)
+                self.hits += 1
+                return setup
+
+            self.misses += 1
+            setup = FontSetup(measure_backend, font_name, font_size, ruby_font_size, bold, fixed_advances, italic)
+            if self.max_size > 0:
+                self.setups[key] = setup
+                if len(self.setups) > self.max_size:
+                    self.setups.popitem(last=False)
+            return setup
+
+    # Removes the setups of a measure backend and/or font name, all if neither is given
+    # Returns the number of removed setups
+    def evict(self, measure_backend=None, font_name=None):
+        with self.lock:
+            keys = [key for key in self.setups
+                    if (measure_backend is None or key[0] is measure_backend) and (font_name is None or key[1] == font_name)]
+            for key in keys:
+                del self.setups[key]
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.setups.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+default_font_registry = FontRegistry()
+
+
+_default_measure_backend = None
+
+# Returns the QtMeasureBackend used if no measure backend is given, one per process so the
+# font registry and parser caches can share setups between files
+def default_measure_backend():
+    global _default_measure_backend
+    if _default_measure_backend is None:
+        _default_measure_backend = QtMeasureBackend()
+    return _default_measure_backend
+
+
+_numpy = False
+
+# Returns the numpy module or None if it is not installed, imported on first use
+def _import_numpy():
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+# Output style names of the text, ruby, underline and highlight parts of the Default style
+default_style_names = ('Default', 'Ruby', 'Underline', 'Highlight')
+
+
+class RubySubParser():
+
+    # alignment is the numpad alignment of the source style, bottom_margin its vertical margin
+    # style_names are the output style names of the text, ruby, underline and highlight parts
+    # font_registry defaults to the process-wide default_font_registry
+    # italic measures with the italic face of the font
+    def __init__(self, frame_width, frame_height, bottom_margin, font_name, font_size, ruby_font_size, bold, tag_parser=tag_parse_ruby.parse, width_cache_size=4096, measure_backend=None, fixed_advances=True, font_registry=None,
+                 alignment=2, margin_l=0, margin_r=0, style_names=default_style_names, compact=False, merge_drawings=None, italic=False):
+
+        self.tag_parser = tag_parser
+
+        if measure_backend is None:
+            measure_backend = default_measure_backend()
+        self.measure_backend = measure_backend
+
+        if font_registry is None:
+            font_registry = default_font_registry
+
+        # LRU cache of (is_ruby, text) -> width, disabled with a size of 0
+        self.width_cache = OrderedDict()
+        self.width_cache_size = width_cache_size
+        self.width_cache_hits = 0
+        self.width_cache_misses = 0
+        self.fixed_advance_hits = 0
+
+        # Compact output merges adjacent text parts of a line into one event where no ruby needs them apart
+        self.compact = compact
+        self.merged_events = 0
+
+        # Underline and highlight rectangles of the same color merged into one drawing per 'line' or 'event'
+        # 'frame' merges per event here, merge_frame_drawings merges events shown at the same time
+        if merge_drawings not in (None, 'line', 'event', 'frame'):
+            raise ValueError('Invalid merge_drawings: %s' % merge_drawings)
+        self.merge_drawings = merge_drawings
+
+        self.font_setup = font_registry.get(measure_backend, font_name, font_size, ruby_font_size, bold, fixed_advances, bool(italic))
+
+        self.normal_line_height = round(font_size)
+        self.font_size = self.font_setup.font_size
+        self.ruby_font_size = self.font_setup.ruby_font_size
+        self.font_metrics = self.font_setup.font_metrics
+        self.font_height = self.font_setup.font_height
+        self.ruby_font_metrics = self.font_setup.ruby_font_metrics
+        self.ruby_font_height = self.font_setup.ruby_font_height
+        self.fixed_advances = self.font_setup.fixed_advances
+        self.ruby_fixed_advances = self.font_setup.ruby_fixed_advances
+
         self.frame_width = frame_width
+        self.frame_height = frame_height
         self.sub_origin = math.floor(frame_height - (font_size/2 + bottom_margin))
 
+        self.style_font_size = font_size
+        self.margin_v = bottom_margin
+        self.margin_l = margin_l
+        self.margin_r = margin_r
+
+        alignment = int(alignment)
+        if alignment >= 7:
+            self.valign = 'top'
+        elif alignment >= 4:
+            self.valign = 'middle'
+        else:
+            self.valign = 'bottom'
+        self.halign = {1: 'left', 2: 'center', 0: 'right'}[alignment % 3]
+
+        self.text_style, self.ruby_style, self.underline_style, self.highlight_style = style_names
+
+    # Returns the width of text without ASS tags, using the main or the ruby font
+    def text_width(self, text, is_ruby=False):
+        fixed_advances = self.ruby_fixed_advances if is_ruby else self.fixed_advances
+        if fixed_advances is not None:
+            width = fixed_advances.width(text)
+            if width is not None:
+                self.fixed_advance_hits += 1
+                return width
+
+        key = (is_ruby, text)
+
+        width = self.width_cache.get(key)
+        if width is not None:
+            self.width_cache.move_to_end(key)
+            self.width_cache_hits += 1
+            return width
+
+        self.width_cache_misses += 1
+
+        metrics = self.ruby_font_metrics if is_ruby else self.font_metrics
+        width = metrics.horizontalAdvance(text)
+
+        if self.width_cache_size > 0:
+            self.width_cache[key] = width
+            if len(self.width_cache) > self.width_cache_size:
+                self.width_cache.popitem(last=False)
+
+        return width
+
+    def clear_width_cache(self):
+        self.width_cache.clear()
+        self.width_cache_hits = 0
+        self.width_cache_misses = 0
+        self.fixed_advance_hits = 0
+
     def get_line_height(self, line):
         for tag in line:
-            if tag.isof(tags.TagText) and tag.ruby_text:
+            if tag.kind == tags.TEXT and tag.ruby_text:
                 return math.floor(self.normal_line_height * 1.5)
         return self.normal_line_height
 
+    # Height of all lines of an event, the distance between its position and its collision position
+    def event_height(self, parsed_lines):
+        return sum(self.get_line_height(line) for line in parsed_lines)
+
+    # Position of an event of the given height without collisions
+    def origin(self, height):
+        if self.valign == 'top':
+            return math.floor(self.margin_v + height - self.style_font_size/2)
+        if self.valign == 'middle':
+            return math.floor(self.frame_height/2 + height/2 - self.style_font_size/2)
+        return self.sub_origin
+
     # Returns list of (layer, style, text) and postion of the next subtitle if a collision occurs
     def parse_sub(self, sub_text, start_position=None):
-        sub_text = sub_text.replace('\\N', '\n')
+        return self.layout_tags(self.parse_tags(sub_text), start_position)
 
-        parsed_lines = self.tag_parser(sub_text)
+    # Returns list of tags for each line of the event text
+    def parse_tags(self, sub_text):
+        return self.tag_parser(sub_text.replace('\\N', '\n'))
 
-        # Calculate line y positions
-        # The origin of y positions is the center of the main line
-        line_y_positions = [self.sub_origin if start_position is None else start_position]
+    # Returns the text part for raw text and its visible text centered at x, None if there is nothing to show
+    def _text_part(self, text, visible_text, x, y):
+        if not text.strip():
+            return None
+        # Insert zero width spaces around exposed spaces to prevent them collapsing
+        if len(visible_text) > 1:
+            if visible_text.startswith(' '):
+                text = '\u200B' + text
+            if visible_text.endswith(' '):
+                text = text + '\u200B'
+        return (3, self.text_style, '{\\pos(%d,%d)}%s' % (x, y, text))
+
+    # Returns the y position of each line and the collision position of an event
+    # The origin of y positions is the center of the main line
+    def line_positions(self, parsed_lines, start_position=None):
+        if start_position is None:
+            start_position = self.origin(self.event_height(parsed_lines))
+        line_y_positions = [start_position]
         for line in reversed(parsed_lines):
             line_y_positions.insert(0, line_y_positions[0] - self.get_line_height(line))
 
         collision_position = line_y_positions.pop(0)
+        return line_y_positions, collision_position
 
-        # Process lines
-        ret = []
+    # Returns the left side of a line of the given width
+    def line_left(self, line_width):
+        if self.halign == 'left':
+            return self.margin_l
+        if self.halign == 'right':
+            return self.frame_width - self.margin_r - line_width
+        return round(self.margin_l + (self.frame_width - self.margin_l - self.margin_r)/2 - line_width/2)
 
-        for line, y in zip(parsed_lines, line_y_positions):
+    # Same as line_left for a NumPy array of line widths
+    def _line_lefts_array(self, np, line_widths):
+        if self.halign == 'left':
+            lefts = np.full(len(line_widths), self.margin_l, dtype=np.int64)
+        elif self.halign == 'right':
+            lefts = self.frame_width - self.margin_r - line_widths
+        else:
+            # Same operations as line_left, np.round rounds half to even like round
+            lefts = np.round((self.margin_l + (self.frame_width - self.margin_l - self.margin_r)/2) - line_widths/2).astype(np.int64)
+        return lefts.tolist()
+
+    # Same as parse_sub for already parsed lines
+    def layout_tags(self, parsed_lines, start_position=None):
+        line_y_positions, collision_position = self.line_positions(parsed_lines, start_position)
 
-            # Calculate part and line width
+        # Calculate part and line width
+        line_layouts = []
+        for line in parsed_lines:
             widths = []
+            text_widths = []
 
             for tag in line:
-                if tag.isof(tags.TagText):
-                    txt_no_tags = strip_ass_tags(tag.text)
-                    ruby_txt_no_tags = strip_ass_tags(tag.ruby_text)
-
-                    txt_width = self.font_metrics.horizontalAdvance(txt_no_tags)
-                    ruby_txt_width = self.ruby_font_metrics.horizontalAdvance(ruby_txt_no_tags)
+                if tag.kind == tags.TEXT:
+                    txt_width = self.text_width(tag.visible_text)
+                    ruby_txt_width = self.text_width(tag.visible_ruby_text, True)
 
                     widths.append(max(txt_width, ruby_txt_width))
+                    text_widths.append(txt_width)
                 else:
                     widths.append(0)
+                    text_widths.append(0)
+
+            line_layouts.append((widths, text_widths, self.line_left(sum(widths))))
+
+        return self._layout_parts(parsed_lines, line_y_positions, line_layouts), collision_position
 
-            line_width = sum(widths)
+    # Same as parse_sub for many events, returns list of (parts, collision position)
+    def parse_many(self, sub_texts, start_positions=None):
+        return self.layout_many([self.parse_tags(sub_text) for sub_text in sub_texts], start_positions)
+
+    # Same as layout_tags for many events, returns list of (parts, collision position)
+    # Each distinct text is measured once, then line widths and left sides of all lines are computed
+    # together, using NumPy arrays if NumPy is installed. Results are identical to layout_tags.
+    # Texts measured earlier in the same call count as width cache hits.
+    def layout_many(self, parsed_events, start_positions=None):
+        if start_positions is None:
+            start_positions = [None] * len(parsed_events)
+
+        lines = [line for parsed_lines in parsed_events for line in parsed_lines]
+
+        # Part widths of each line, each distinct text is measured once
+        text_widths = {}
+        ruby_widths = {}
+        line_part_widths = []
+        line_text_widths = []
+        repeated = 0
+        text_kind = tags.TEXT
+        for line in lines:
+            widths = []
+            line_texts = []
+            for tag in line:
+                if tag.kind == text_kind:
+                    text = tag.visible_text
+                    txt_width = text_widths.get(text)
+                    if txt_width is None:
+                        txt_width = text_widths[text] = self.text_width(text)
+                    else:
+                        repeated += 1
+                    ruby_text = tag.visible_ruby_text
+                    ruby_txt_width = ruby_widths.get(ruby_text)
+                    if ruby_txt_width is None:
+                        ruby_txt_width = ruby_widths[ruby_text] = self.text_width(ruby_text, True)
+                    else:
+                        repeated += 1
+                    widths.append(txt_width if txt_width >= ruby_txt_width else ruby_txt_width)
+                    line_texts.append(txt_width)
+                else:
+                    widths.append(0)
+                    line_texts.append(0)
+            line_part_widths.append(widths)
+            line_text_widths.append(line_texts)
+
+        self.width_cache_hits += repeated
+
+        np = _import_numpy()
+        if np is not None and lines:
+            # Line widths as differences of the running sum over the parts of all lines
+            flat_widths = np.fromiter((w for widths in line_part_widths for w in widths), dtype=np.int64)
+            line_lengths = np.fromiter((len(widths) for widths in line_part_widths), dtype=np.int64, count=len(lines))
+            line_ends = np.cumsum(line_lengths)
+            running = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(flat_widths)))
+            line_widths = running[line_ends] - running[line_ends - line_lengths]
+            lefts = self._line_lefts_array(np, line_widths)
+        else:
+            lefts = [self.line_left(sum(widths)) for widths in line_part_widths]
+
+        line_layouts = list(zip(line_part_widths, line_text_widths, lefts))
+
+        ret = []
+        i = 0
+        for parsed_lines, start_position in zip(parsed_events, start_positions):
+            line_y_positions, collision_position = self.line_positions(parsed_lines, start_position)
+            parts = self._layout_parts(parsed_lines, line_y_positions, line_layouts[i:i + len(parsed_lines)])
+            ret.append((parts, collision_position))
+            i += len(parsed_lines)
+
+        return ret
+
+    # Returns the parts of an event from the y position and (part widths, text widths, left side) of each line
+    def _layout_parts(self, parsed_lines, line_y_positions, line_layouts):
+        ret = []
+
+        # Drawings to merge: (layer, style, prefix, suffix) -> shapes
+        drawings = OrderedDict()
+
+        def add_drawing(layer, style, prefix, shape, suffix):
+            if self.merge_drawings is None:
+                ret.append( (layer, style, prefix + shape + suffix) )
+            else:
+                drawings.setdefault((layer, style, prefix, suffix), []).append(shape)
+
+        # Shapes of one drawing share the winding direction, so overlaps are filled once
+        def flush_drawings():
+            for (layer, style, prefix, suffix), shapes in drawings.items():
+                ret.append( (layer, style, prefix + ' '.join(shapes) + suffix) )
+                self.merged_events += len(shapes) - 1
+            drawings.clear()
+
+        for line, y, (widths, text_widths, curr_x) in zip(parsed_lines, line_y_positions, line_layouts):
 
             # Center vertical position of ruby text
             ruby_y = math.floor(y - self.font_height/2 - self.ruby_font_size/2)
 
-            # Left side of current part
-            curr_x = round(self.frame_width/2 - line_width/2)
-
             # States for opened underlines
             underline_start_tag = None
             underline_start_x = None
@@ -114,49 +665,66 @@ class RubySubParser():
             highlight_start_x = None
             highlight_height = None
 
+            # Text parts merged in compact mode: start x, width, tags
+            run_x = None
+            run_width = 0
+            run_tags = []
+
+            def flush_run():
+                if not run_tags:
+                    return
+                part = self._text_part(''.join(t.text for t in run_tags), ''.join(t.visible_text for t in run_tags), round(run_x + run_width/2), y)
+                if part is not None:
+                    ret.append(part)
+                    self.merged_events += sum(1 for t in run_tags if t.text.strip()) - 1
+                run_tags.clear()
 
-            for (tag, width) in zip(line, widths):
+
+            for (tag, width, text_width) in zip(line, widths, text_widths):
                 # Center of current part
                 x = round(curr_x + width/2)
+                kind = tag.kind
 
                 # Text
-                if tag.isof(tags.TagText):
-                    if tag.text.strip():
-                        # Insert zero width spaces around exposed spaces to prevent them collapsing
-                        text = tag.text
-                        text_stripped = strip_ass_tags(text)
-                        if len(text_stripped) > 1:
-                            if text_stripped.startswith(' '):
-                                text = '\u200B' + text
-                            if text_stripped.endswith(' '):
-                                text = text + '\u200B'
-                        ret.append( (3, 'Default', '{\\pos(%d,%d)}%s' % (x, y, text)) )
+                if kind == tags.TEXT:
+                    # Text can join the run if it fills its part, ruby wider than it has to be centered
+                    if self.compact and text_width == width:
+                        if not run_tags:
+                            run_x = curr_x
+                            run_width = 0
+                        run_tags.append(tag)
+                        run_width += width
+                    else:
+                        flush_run()
+                        part = self._text_part(tag.text, tag.visible_text, x, y)
+                        if part is not None:
+                            ret.append(part)
 
                     if tag.ruby_text.strip():
-                        ret.append( (2, 'Ruby', '{\\pos(%d,%d)}%s' % (x, ruby_y, tag.ruby_text)) )
+                        ret.append( (2, self.ruby_style, '{\\pos(%d,%d)}%s' % (x, ruby_y, tag.ruby_text)) )
                         highlight_height = self.normal_line_height * 1.5
 
                 # Underlines
-                elif tag.isof(tags.TagUnderlineStart):
+                elif kind == tags.UNDERLINE_START:
                     underline_start_tag = tag
                     underline_start_x = x
 
-                elif tag.isof(tags.TagUnderlineEnd):
+                elif kind == tags.UNDERLINE_END:
                     if underline_start_tag:
                         x1 = underline_start_x
                         x2 = x
                         y1 = math.ceil(y + self.font_height/2)
                         y2 = math.ceil(y1 + self.font_height*0.05)
                         c = '%02X%02X%02X' % (underline_start_tag.b, underline_start_tag.g, underline_start_tag.r)
-                        ret.append( (1, 'Underline', '{\\pos(0,0)}{\c&H%s&}{\p1}m %d %d l %d %d %d %d %d %d{\p0}{\c}' % (c, x1, y1, x2, y1, x2, y2, x1, y2)) )
+                        add_drawing(1, self.underline_style, '{\\pos(0,0)}{\c&H%s&}{\p1}' % c, 'm %d %d l %d %d %d %d %d %d' % (x1, y1, x2, y1, x2, y2, x1, y2), '{\p0}{\c}')
 
                 # Highlights
-                elif tag.isof(tags.TagHighlightStart):
+                elif kind == tags.HIGHLIGHT_START:
                     highlight_start_tag = tag
                     highlight_start_x = x
                     highlight_height = self.font_height
 
-                elif tag.isof(tags.TagHighlightEnd):
+                elif kind == tags.HIGHLIGHT_END:
                     if highlight_start_tag:
                         x1 = highlight_start_x
                         x2 = x
@@ -165,54 +733,160 @@ class RubySubParser():
                         c = '%02X%02X%02X' % (highlight_start_tag.b, highlight_start_tag.g, highlight_start_tag.r)
                         ca_raw = max(0, min(1, highlight_start_tag.a))
                         ca = round((1-ca_raw) * 255)
-                        ret.append( (0, 'Highlight', '{\\pos(0,0)}{\c&H%s&\\1a&H%02X&}{\p1}m %d %d l %d %d %d %d %d %d{\p0}{\c\\1a}' % (c, ca, x1, y1, x2, y1, x2, y2, x1, y2)) )
+                        add_drawing(0, self.highlight_style, '{\\pos(0,0)}{\c&H%s&\\1a&H%02X&}{\p1}' % (c, ca), 'm %d %d l %d %d %d %d %d %d' % (x1, y1, x2, y1, x2, y2, x1, y2), '{\p0}{\c\\1a}')
 
                 curr_x += width
 
-        return ret, collision_position
+            flush_run()
+
+            if self.merge_drawings == 'line':
+                flush_drawings()
 
+        flush_drawings()
 
-def convert_sub_file(in_path, out_path, tag_parser=tag_parse_ruby.parse):
+        return ret
 
-    # Determine encoding
-    f = open(in_path, 'rb')
-    subs_data = f.read()
-    f.close()
 
-    boms_for_enc = [
-        ('utf-32',      (codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)),
-        ('utf-16',      (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)),
-        ('utf-8-sig',   (codecs.BOM_UTF8,)),
-    ]
+# Number of bytes charset detection looks at if the data is not valid UTF-8
+charset_sample_size = 64 * 1024
+
+
+# Encodings recognized by their byte order mark, UTF-32 first as its BOM starts like UTF-16's
+boms_for_enc = [
+    ('utf-32',      (codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)),
+    ('utf-16',      (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)),
+    ('utf-8-sig',   (codecs.BOM_UTF8,)),
+]
+
+
+# Returns the encoding of subtitle file data like decode_sub_data, from its beginning only if
+# complete is False. Unknown encodings fall back to UTF-8.
+def detect_sub_encoding(sample, complete=True):
+    for enc, boms in boms_for_enc:
+        if any(sample.startswith(bom) for bom in boms):
+            return enc
+
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    import cchardet as chardet
+    subs_encoding = chardet.detect(sample[:charset_sample_size])['encoding'] or 'utf-8'
+    try:
+        codecs.lookup(subs_encoding)
+    except LookupError:
+        subs_encoding = 'utf-8'
+    return subs_encoding
+
+
+# Returns the text and encoding of subtitle file data
+def decode_sub_data(subs_data):
+    subs_text = None
 
     for enc, boms in boms_for_enc:
         if any(subs_data.startswith(bom) for bom in boms):
             subs_encoding = enc
             break
     else:
-        chardet_ret = chardet.detect(subs_data)
-        subs_encoding = chardet_ret['encoding']
+        try:
+            subs_text = subs_data.decode('utf-8')
+            subs_encoding = 'utf-8'
+        except UnicodeDecodeError:
+            import cchardet as chardet
+            chardet_ret = chardet.detect(subs_data[:charset_sample_size])
+            subs_encoding = chardet_ret['encoding'] or 'utf-8'
 
-    # Load subs
-    with open(in_path, encoding=subs_encoding, errors='replace') as f:
-        subs = pysubs2.SSAFile.from_file(f)
+    if subs_text is None:
+        try:
+            subs_text = subs_data.decode(subs_encoding, errors='replace')
+        except LookupError:
+            subs_encoding = 'utf-8'
+            subs_text = subs_data.decode(subs_encoding, errors='replace')
 
-    # Determine frame size
-    frame_width = int(subs.info.get('PlayResX', '1920'))
-    frame_height = int(subs.info.get('PlayResY', '1080'))
+    # Universal newlines like reading files in text mode
+    if '\r' in subs_text:
+        subs_text = subs_text.replace('\r\n', '\n').replace('\r', '\n')
 
-    bottom_margin = round(frame_height * 0.04)
+    return subs_text, subs_encoding
 
-    # Create styles
-    style = subs.styles.get('Default')
-    if style is None:
-        # TODO: Set better default style if Default is not found
-        style = pysubs2.SSAStyle()
-    else:
-        bottom_margin = round(style.marginv)
 
+# Values of event fields missing from the Format line of [Events]
+event_field_defaults = {
+    'layer':    '0',
+    'marked':   'Marked=0',
+    'start':    '0:00:00.00',
+    'end':      '0:00:00.00',
+    'style':    'Default',
+}
+
+
+# Reorders the fields of event lines written for the Format line of [Events] into the order pysubs2
+# reads them in, pysubs2 ignores Format lines. Text has to be the last field, as the format requires.
+class EventFieldOrder():
+
+    def __init__(self, format_line, format_):
+        from pysubs2.formats.substation import EVENT_FIELDS
+        self.names = [name.strip().lower() for name in format_line.split(':', 1)[1].split(',')]
+        self.fields = EVENT_FIELDS[format_]
+        self.indices = [self.names.index(f) if f in self.names else None for f in self.fields]
+
+    # True if event lines already have the fields in the order pysubs2 reads them in
+    def is_standard(self):
+        return self.names == self.fields
+
+    def reorder(self, line):
+        event_type, rest = line.split(':', 1)
+        values = rest.strip().split(',', len(self.names) - 1)
+        values += [''] * (len(self.names) - len(values))
+        fields = [values[i] if i is not None else event_field_defaults.get(f, '') for f, i in zip(self.fields, self.indices)]
+        return event_type + ': ' + ','.join(fields)
+
+
+# Format line of [Events], allowing empty and comment lines after the heading
+events_format_line = re.compile(r'^[ \t]*\[events\][ \t]*\n(?:[ \t]*(?:;[^\n]*)?\n)*[ \t]*format:[^\n]*', re.IGNORECASE | re.MULTILINE)
+
+
+# Returns subs_text with the fields of events in the order pysubs2 reads them in, see EventFieldOrder
+def normalize_event_fields(subs_text):
+    match = events_format_line.search(subs_text)
+    if match is None:
+        return subs_text
+
+    from pysubs2.formats.substation import SubstationFormat
+    format_ = SubstationFormat.guess_format(subs_text)
+    if format_ is None:
+        return subs_text
+
+    format_line = match.group(0).rsplit('\n', 1)[-1]
+    field_order = EventFieldOrder(format_line, format_)
+    if field_order.is_standard():
+        return subs_text
+
+    lines = subs_text[match.end():].split('\n')
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if line.startswith('Dialogue:') or line.startswith('Comment:'):
+            lines[i] = field_order.reorder(line)
+    return subs_text[:match.end()] + '\n'.join(lines)
+
+
+def load_subs(subs_text):
+    import pysubs2
+    return pysubs2.SSAFile.from_string(normalize_event_fields(subs_text))
+
+
+# Output format for a path like SSAFile.save
+def output_format_for_path(path):
+    from pysubs2.formats import get_format_identifier
+    return get_format_identifier(os.path.splitext(path)[1].lower())
+
+
+# Returns the text, ruby, underline and highlight output styles for a source style
+def ruby_styles(style):
+    style = style.copy()
     style.fontsize = math.floor(style.fontsize)
-    style.italic = False
     style.underline = False
     style.strikeout = False
     style.scalex = 100.0
@@ -235,43 +909,527 @@ def convert_sub_file(in_path, out_path, tag_parser=tag_parse_ruby.parse):
     highlight_style.shadow = 0
     highlight_style.alignment = 7   # Top-left alignment
 
+    return style, ruby_style, underline_style, highlight_style
+
+
+# Returns the output style names for a source style, unique among the taken names
+# The Default style keeps the names Default, Ruby, Underline and Highlight
+def companion_style_names(style_name, taken):
+    if style_name == 'Default':
+        names = default_style_names
+    else:
+        names = (style_name, style_name + ' Ruby', style_name + ' Underline', style_name + ' Highlight')
+
+    ret = []
+    for name in names:
+        while name in taken:
+            name += '_'
+        taken.add(name)
+        ret.append(name)
+    return tuple(ret)
+
+
+# Replaces the styles of subs with the ones used for ruby output, for the Default style and each style
+# used by an event, or each of used_styles if given. Events with a style missing from the file use the Default style.
+# Returns an OrderedDict of source style name -> (parser_args, parser_kwargs) for RubySubParser with
+# parser_args being (frame_width, frame_height, bottom_margin, font_name, font_size, ruby_font_size, bold)
+def setup_event_styles(subs, used_styles=None):
+    import pysubs2
+
+    # Determine frame size
+    frame_width = int(subs.info.get('PlayResX', '1920'))
+    frame_height = int(subs.info.get('PlayResY', '1080'))
+
+    # Source styles with their vertical margin, Default first
+    source_styles = OrderedDict()
+    style = subs.styles.get('Default')
+    if style is None:
+        # TODO: Set better default style if Default is not found
+        source_styles['Default'] = (pysubs2.SSAStyle(), round(frame_height * 0.04))
+    else:
+        source_styles['Default'] = (style, round(style.marginv))
+
+    if used_styles is None:
+        used_styles = [e.style for e in subs.events]
+
+    for style_name in used_styles:
+        style = subs.styles.get(style_name)
+        if style is not None and style_name not in source_styles:
+            source_styles[style_name] = (style, round(style.marginv))
+
+    # Create styles
+    ret = OrderedDict()
+    taken = set()
     subs.styles.clear()
-    subs.styles['Default'] = style
-    subs.styles['Ruby'] = ruby_style
-    subs.styles['Underline'] = underline_style
-    subs.styles['Highlight'] = highlight_style
-
-    font_name = style.fontname
-    font_size = style.fontsize
-    ruby_font_size = ruby_style.fontsize
-    bold = style.bold
-    
-    parser = RubySubParser(frame_width, frame_height, bottom_margin, font_name, font_size, ruby_font_size, bold, tag_parser)
 
-    # Create parsed subtitle events
-    original_events = subs.events.copy()
-    original_events.sort()
-    subs.events.clear()
+    for style_name, (source_style, bottom_margin) in source_styles.items():
+        style_names = companion_style_names(style_name, taken)
+        styles = ruby_styles(source_style)
+        for name, style in zip(style_names, styles):
+            subs.styles[name] = style
 
-    collision_stack = []    # (end, position)
+        style, ruby_style = styles[:2]
+        parser_args = (frame_width, frame_height, bottom_margin, style.fontname, style.fontsize, ruby_style.fontsize, style.bold)
+        if style_name == 'Default':
+            # Default keeps its bottom-center placement, only MarginV is considered
+            parser_kwargs = {'style_names': style_names}
+        else:
+            parser_kwargs = {
+                'alignment':    int(source_style.alignment),
+                'margin_l':     round(source_style.marginl),
+                'margin_r':     round(source_style.marginr),
+                'style_names':  style_names,
+            }
+        if style.italic:
+            parser_kwargs['italic'] = True
+        ret[style_name] = (parser_args, parser_kwargs)
+
+    return ret
+
+
+# Same as setup_event_styles, returns the RubySubParser arguments of the Default style only
+def setup_styles(subs):
+    return setup_event_styles(subs)['Default'][0]
+
+
+# Returns dict of source style name -> RubySubParser for the result of setup_event_styles
+# layout_options are RubySubParser keyword arguments applied to all styles, like {'compact': True}
+def style_parsers(event_styles, tag_parser=tag_parse_ruby.parse, measure_backend=None, parser_cache=None, layout_options=None):
+    ret = {}
+    for style_name, (parser_args, parser_kwargs) in event_styles.items():
+        if layout_options:
+            parser_kwargs = dict(parser_kwargs, **layout_options)
+        if parser_cache is None:
+            ret[style_name] = RubySubParser(*parser_args, tag_parser, measure_backend=measure_backend, **parser_kwargs)
+        else:
+            ret[style_name] = parser_cache.get(parser_args, tag_parser, measure_backend, parser_kwargs)
+    return ret
+
+
+# Returns the parser for each event, the Default style parser for unknown styles
+def event_parsers_for(parsers, events):
+    default_parser = parsers['Default']
+    return [parsers.get(e.style, default_parser) for e in events]
+
+
+# Assigns vertical positions to events that overlap in time.
+# Events are placed as low as possible, at the origin or directly above an active event they would
+# otherwise overlap. Active events are kept in a heap by end time and their bands sorted by position,
+# so the space of an event is reused by the next event starting after it ended.
+# Placing and expiring an event scans and shifts the sorted list of active bands, so n events with
+# up to k of them shown at once take O(n*k). k stays small for subtitles, a balanced tree of free
+# gaps would be needed for O(n log n).
+class CollisionScheduler():
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.active = []    # Heap of (end, id, band)
+        self.bands = []     # Sorted list of (-bottom, id, top), lowest band first
+        self._next_id = 0
+
+    def expire(self, time):
+        while self.active and self.active[0][0] <= time:
+            _, _, band = heapq.heappop(self.active)
+            del self.bands[bisect.bisect_left(self.bands, band)]
+
+    # Returns the position for an event from start to end with its lines taking height
+    # origin overrides the position used without collisions
+    def place(self, start, end, height, origin=None):
+        self.expire(start)
+
+        position = self.origin if origin is None else origin
+        for neg_bottom, _, top in self.bands:
+            if top >= position:
+                continue        # Completely below
+            if -neg_bottom <= position - height:
+                break           # This and all following bands are above
+            position = top
+
+        band = (-position, self._next_id, position - height)
+        self._next_id += 1
+        heapq.heappush(self.active, (end, band[1], band))
+        bisect.insort(self.bands, band)
+
+        return position
 
-    for e in original_events:
-        position = None
-        for collision_end, collision_position in reversed(collision_stack):
-            if collision_end <= e.start:
-                del collision_stack[-1]
-            else:
-                position = collision_position
-                break
-        
-        parts, collision_position = parser.parse_sub(e.text, position)
-        collision_stack.append((e.end, collision_position))
 
+# Returns the position of each event, events have to be sorted by start time
+# event_parsers optionally holds the parser of each event's style, all events use parser otherwise.
+# Bottom and middle aligned events move up on collisions, top aligned ones move down. Top aligned
+# events are scheduled with negated positions of their top edges, so moving down is moving up there.
+def schedule_events(parser, events, parsed_events, event_parsers=None):
+    if event_parsers is None:
+        event_parsers = [parser] * len(events)
+
+    schedulers = {
+        'bottom':   CollisionScheduler(parser.sub_origin),
+        'middle':   CollisionScheduler(parser.sub_origin),
+        'top':      CollisionScheduler(0),
+    }
+
+    ret = []
+    for e, parsed_lines, event_parser in zip(events, parsed_events, event_parsers):
+        height = event_parser.event_height(parsed_lines)
+        origin = event_parser.origin(height)
+        if event_parser.valign == 'top':
+            top = -schedulers['top'].place(e.start, e.end, height, -event_parser.margin_v)
+            ret.append(origin + top - event_parser.margin_v)
+        else:
+            ret.append(schedulers[event_parser.valign].place(e.start, e.end, height, origin))
+    return ret
+
+
+# Returns the list of (layer, style, text) parts of each event for events sorted by start time
+# event_parsers optionally holds the parser of each event's style, all events use parser otherwise
+def layout_event_parts(parser, events, parsed_events, event_parsers=None):
+    if event_parsers is None:
+        event_parsers = [parser] * len(events)
+
+    positions = schedule_events(parser, events, parsed_events, event_parsers)
+
+    # Lay out the events of each style together
+    event_parts = [None] * len(events)
+    style_indices = OrderedDict()
+    for i, event_parser in enumerate(event_parsers):
+        style_indices.setdefault(event_parser, []).append(i)
+    for event_parser, indices in style_indices.items():
+        results = event_parser.layout_many([parsed_events[i] for i in indices], [positions[i] for i in indices])
+        for i, (parts, _) in zip(indices, results):
+            event_parts[i] = parts
+
+    return event_parts
+
+
+# Returns the output events, one copy of each event for each of its parts
+def output_events(events, event_parts):
+    ret = []
+
+    for e, parts in zip(events, event_parts):
         for (layer, style, text) in parts:
             e = e.copy()
             e.layer = layer
             e.style = style
             e.text = text
-            subs.events.append(e)
+            ret.append(e)
+
+    return ret
+
+
+drawing_start = '{\\p1}'
+drawing_end = '{\\p0}'
+
+
+# Merges underline and highlight drawings of output events shown at the same time, from start to end,
+# with the same style and color into the first of them.
+# Events with the same times always share a collision group, so groups can be merged on their own.
+# Returns the merged output events and the number of removed events
+def merge_frame_drawings(out_events):
+    ret = []
+    drawings = {}   # (start, end, type, layer, style, effect, prefix, suffix) -> (index in ret, shapes)
+
+    for e in out_events:
+        text = e.text
+        start = text.find(drawing_start)
+        end = text.rfind(drawing_end)
+        if e.layer > 1 or not text.startswith('{\\pos(0,0)}') or start < 0 or end < start:
+            ret.append(e)
+            continue
+
+        start += len(drawing_start)
+        key = (e.start, e.end, e.type, e.layer, e.style, e.effect, text[:start], text[end:])
+        drawing = drawings.get(key)
+        if drawing is None:
+            drawings[key] = (len(ret), [text[start:end]])
+            ret.append(e)
+        else:
+            drawing[1].append(text[start:end])
+
+    for (_, _, _, _, _, _, prefix, suffix), (i, shapes) in drawings.items():
+        if len(shapes) > 1:
+            e = ret[i].copy()
+            e.text = prefix + ' '.join(shapes) + suffix
+            ret[i] = e
+
+    return ret, len(out_events) - len(ret)
+
+
+# Returns whether layout_options merge drawings of events shown at the same time
+def merges_frames(layout_options):
+    return bool(layout_options) and layout_options.get('merge_drawings') == 'frame'
+
+
+# Splits events sorted by start time into groups of consecutive events that do not overlap any event
+# of another group in time. Collision positions only depend on earlier events of the same group.
+# Returns list of (first index, end index)
+def collision_groups(events):
+    ret = []
+    group_start = 0
+    group_end_time = None
+
+    for i, e in enumerate(events):
+        if group_end_time is not None and e.start >= group_end_time:
+            ret.append((group_start, i))
+            group_start = i
+            group_end_time = None
+        group_end_time = e.end if group_end_time is None else max(group_end_time, e.end)
+
+    if group_start < len(events):
+        ret.append((group_start, len(events)))
+
+    return ret
+
+
+# Returns the output events for events sorted by start time
+# parsed_events optionally holds the parse_tags result for each event
+# event_parsers optionally holds the parser of each event's style, all events use parser otherwise
+def layout_events(parser, events, parsed_events=None, event_parsers=None):
+    if parsed_events is None:
+        parsed_events = [parser.parse_tags(e.text) for e in events]
+
+    out_events = output_events(events, layout_event_parts(parser, events, parsed_events, event_parsers))
+    if parser.merge_drawings == 'frame':
+        out_events, merged = merge_frame_drawings(out_events)
+        parser.merged_events += merged
+    return out_events
+
+
+# Wall times of conversion stages and counters of a conversion
+class ConversionStats():
+
+    def __init__(self):
+        self.times = OrderedDict()      # stage -> seconds
+        self.counters = OrderedDict()   # name -> count
+        self.info = OrderedDict()       # name -> value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def total_time(self):
+        return sum(self.times.values())
+
+    def to_dict(self):
+        return {
+            'times':        dict(self.times),
+            'total_time':   self.total_time(),
+            'counters':     dict(self.counters),
+            'info':         dict(self.info),
+        }
+
+
+# Keeps RubySubParser instances for files with the same styles, tag parser and measure backend.
+# Reusing them skips font probing and keeps their width caches warm.
+# font_registry is passed to the parsers, it defaults to the process-wide default_font_registry.
+class ParserCache():
+
+    def __init__(self, max_size=16, font_registry=None):
+        self.max_size = max_size
+        self.font_registry = font_registry
+        self.parsers = OrderedDict()
+
+    def get(self, parser_args, tag_parser, measure_backend, parser_kwargs=None):
+        if parser_kwargs is None:
+            parser_kwargs = {}
+        key = (parser_args, tuple(sorted(parser_kwargs.items())), tag_parser, measure_backend)
+        parser = self.parsers.get(key)
+        if parser is None:
+            parser = RubySubParser(*parser_args, tag_parser, measure_backend=measure_backend, font_registry=self.font_registry, **parser_kwargs)
+            self.parsers[key] = parser
+            if len(self.parsers) > self.max_size:
+                self.parsers.popitem(last=False)
+        else:
+            self.parsers.move_to_end(key)
+        return parser
+
+
+# Parser counters collected into conversion stats, stats counter -> RubySubParser attribute
+parser_stats_counters = (
+    ('measure_calls',       'width_cache_misses'),
+    ('width_cache_hits',    'width_cache_hits'),
+    ('fixed_advance_hits',  'fixed_advance_hits'),
+    ('events_merged',       'merged_events'),
+)
+
+
+def parser_counters(parsers):
+    return {name: sum(getattr(p, attr) for p in parsers) for name, attr in parser_stats_counters}
+
+
+# Parses and lays out events sorted by start time with the parsers of their styles
+# Returns the parts of each event and a dict of counters of this call
+def layout_subs_events(parsers, events, stats):
+    parser = parsers['Default']
+
+    # Cached parsers count from earlier files already
+    counters_before = parser_counters(parsers.values())
+
+    with stats.stage('tag_parse'):
+        parsed_events = [parser.parse_tags(e.text) for e in events]
+
+    with stats.stage('layout'):
+        event_parts = layout_event_parts(parser, events, parsed_events, event_parsers_for(parsers, events))
+
+    counters = {name: n - counters_before[name] for name, n in parser_counters(parsers.values()).items()}
+    counters['lines'] = sum(len(parsed_lines) for parsed_lines in parsed_events)
+    counters['tags'] = sum(len(line) for parsed_lines in parsed_events for line in parsed_lines)
+
+    return event_parts, counters
+
+
+# Replaces styles and events of loaded subs with the converted ones, laying out each event with the
+# RubySubParser of its style. Returns the parser of the Default style, None if the events were laid
+# out by layout_pool.
+# layout_pool optionally is a parallel.LayoutPool laying out collision groups in worker processes
+def convert_subs(subs, tag_parser=tag_parse_ruby.parse, measure_backend=None, stats=None, parser_cache=None, layout_options=None, layout_pool=None):
+    if stats is None:
+        stats = ConversionStats()
+
+    with stats.stage('setup'):
+        event_styles = setup_event_styles(subs)
+
+    # Create parsed subtitle events
+    original_events = subs.events.copy()
+    original_events.sort()
+
+    if layout_pool is not None and layout_pool.supports(tag_parser):
+        parser = None
+        with stats.stage('layout'):
+            event_parts, counters = layout_pool.layout_event_parts(event_styles, tag_parser, original_events, layout_options)
+    else:
+        with stats.stage('setup'):
+            parsers = style_parsers(event_styles, tag_parser, measure_backend, parser_cache, layout_options)
+            parser = parsers['Default']
+        event_parts, counters = layout_subs_events(parsers, original_events, stats)
+
+    subs.events = output_events(original_events, event_parts)
+    if merges_frames(layout_options):
+        subs.events, merged = merge_frame_drawings(subs.events)
+        counters['events_merged'] = counters.get('events_merged', 0) + merged
+
+    stats.count('events_in', len(original_events))
+    stats.count('events_out', len(subs.events))
+    stats.count('styles', len(event_styles))
+    for name, n in counters.items():
+        stats.count(name, n)
+
+    return parser
+
+
+# Allowed values of each layout option
+layout_option_values = {
+    'compact':          (False, True),
+    'merge_drawings':   (None, 'line', 'event', 'frame'),
+}
+
+
+# Raises ValueError unless layout_options is None or a dict of known options with allowed values,
+# for options from untrusted sources like daemon requests
+def check_layout_options(layout_options):
+    if layout_options is None:
+        return
+    if not isinstance(layout_options, dict):
+        raise ValueError('layout_options has to be an object')
+    for name, value in layout_options.items():
+        allowed = layout_option_values.get(name)
+        if allowed is None:
+            raise ValueError('Unknown layout option: %s' % name)
+        if not any(type(value) is type(v) and value == v for v in allowed):
+            raise ValueError('Invalid value for layout option %s: %r' % (name, value))
+
+
+# Returns a string identifying layout options, part of result cache keys
+def layout_options_key(layout_options):
+    if not layout_options:
+        return ''
+    return repr(sorted(layout_options.items()))
+
+
+# Returns a ConversionStats, stats can be passed to collect into an existing one
+# With a result_cache, unchanged inputs are copied from the cache instead of being converted again.
+# This requires a tag parser with a cache_key like the compiled parsers, see tag_tables.CompiledParser.
+# layout_options are passed to the parsers of all styles, see style_parsers.
+# layout_pool lays out large files in worker processes, see parallel.LayoutPool.
+def convert_sub_file(in_path, out_path, tag_parser=tag_parse_ruby.parse, measure_backend=None, stats=None, result_cache=None, parser_cache=None, layout_options=None, layout_pool=None):
+    if stats is None:
+        stats = ConversionStats()
+
+    if measure_backend is None:
+        measure_backend = default_measure_backend()
+
+    # Read once and decode in memory
+    with stats.stage('read'):
+        with open(in_path, 'rb') as f:
+            subs_data = f.read()
+
+    result_key = None
+    tag_parser_key = getattr(tag_parser, 'cache_key', None)
+    if result_cache is not None and tag_parser_key is not None:
+        with stats.stage('result_cache'):
+            result_key = result_cache.key(subs_data, tag_parser_key, measure_backend.cache_key(), layout_options_key(layout_options), output_format_for_path(out_path))
+            is_hit = result_cache.fetch(result_key, out_path)
+        stats.info['result_cache'] = 'hit' if is_hit else 'miss'
+        if is_hit:
+            stats.count('input_bytes', len(subs_data))
+            stats.count('output_bytes', os.path.getsize(out_path))
+            return stats
+
+    with stats.stage('decode'):
+        subs_text, subs_encoding = decode_sub_data(subs_data)
+
+    # Load subs
+    with stats.stage('load'):
+        subs = load_subs(subs_text)
+
+    convert_subs(subs, tag_parser, measure_backend, stats, parser_cache, layout_options, layout_pool)
+
+    with stats.stage('save'):
+        subs.save(out_path, header_notice='Generated by rubysubs')
+
+    with stats.stage('flush'):
+        measure_backend.flush()
+
+    if result_key is not None:
+        with stats.stage('result_cache'):
+            result_cache.store(result_key, out_path)
+
+    stats.info['encoding'] = subs_encoding
+    stats.count('input_bytes', len(subs_data))
+    stats.count('output_bytes', os.path.getsize(out_path))
+
+    return stats
+
+
+# Converts subtitle file data in memory, returns the converted file as str
+def convert_sub_data(subs_data, tag_parser=tag_parse_ruby.parse, measure_backend=None, stats=None, parser_cache=None, output_format='ass', layout_options=None, layout_pool=None):
+    if stats is None:
+        stats = ConversionStats()
+
+    if measure_backend is None:
+        measure_backend = default_measure_backend()
+
+    with stats.stage('decode'):
+        subs_text, subs_encoding = decode_sub_data(subs_data)
+
+    with stats.stage('load'):
+        subs = load_subs(subs_text)
+
+    convert_subs(subs, tag_parser, measure_backend, stats, parser_cache, layout_options, layout_pool)
+
+    with stats.stage('save'):
+        out_text = subs.to_string(output_format, header_notice='Generated by rubysubs')
+
+    with stats.stage('flush'):
+        measure_backend.flush()
+
+    stats.info['encoding'] = subs_encoding
+    stats.count('input_bytes', len(subs_data))
+    stats.count('output_bytes', len(out_text.encode('utf-8')))
 
-    subs.save(out_path, header_notice='Generated by rubysubs')
+    return out_text
@@ -0,0 +1,499 @@
+import os
+import mmap
+import struct
+import hashlib
+
+
+font_file_extensions = ('.ttf', '.otf', '.ttc', '.otc')
+
+
+def default_font_dirs():
+    home = os.path.expanduser('~')
+    dirs = [
+        '/usr/share/fonts',
+        '/usr/local/share/fonts',
+        os.path.join(home, '.fonts'),
+        os.path.join(home, '.local', 'share', 'fonts'),
+        '/Library/Fonts',
+        '/System/Library/Fonts',
+        os.path.join(home, 'Library', 'Fonts'),
+    ]
+    windir = os.environ.get('WINDIR')
+    if windir:
+        dirs.append(os.path.join(windir, 'Fonts'))
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _u16(data, offset):
+    return struct.unpack_from('>H', data, offset)[0]
+
+def _i16(data, offset):
+    return struct.unpack_from('>h', data, offset)[0]
+
+def _u32(data, offset):
+    return struct.unpack_from('>I', data, offset)[0]
+
+
+def _table_directory(data, font_index=0):
+    offset = 0
+    if data[:4] in (b'ttcf',):
+        num_fonts = _u32(data, 8)
+        if not 0 <= font_index < num_fonts:
+            raise ValueError('Font index %d out of range' % font_index)
+        offset = _u32(data, 12 + 4 * font_index)
+
+    num_tables = _u16(data, offset + 4)
+    tables = {}
+    for i in range(num_tables):
+        rec = offset + 12 + 16 * i
+        tag = data[rec:rec+4].decode('latin-1')
+        table_offset = _u32(data, rec + 8)
+        table_length = _u32(data, rec + 12)
+        tables[tag] = (table_offset, table_length)
+    return tables
+
+
+def font_count(data):
+    if data[:4] == b'ttcf':
+        return _u32(data, 8)
+    return 1
+
+
+# Minimal reader for the tables needed to measure horizontal text advances
+# Glyph metrics and kerning are only parsed on first use so indexing font directories stays cheap
+class SfntFont():
+
+    def __init__(self, path, font_index=0):
+        self.path = path
+        self.font_index = font_index
+
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.tables = _table_directory(self.data, font_index)
+
+        head = self.table('head')
+        self.units_per_em = _u16(head, 18)
+        self.mac_style = _u16(head, 44)
+
+        hhea = self.table('hhea')
+        self.hhea_ascender = _i16(hhea, 4)
+        self.hhea_descender = _i16(hhea, 6)
+        self.hhea_line_gap = _i16(hhea, 8)
+        self.num_h_metrics = _u16(hhea, 34)
+
+        self.weight = 400
+        self.use_typo_metrics = False
+        self.win_ascent = self.hhea_ascender
+        self.win_descent = -self.hhea_descender
+        os2 = self.table('OS/2')
+        if os2 is not None and len(os2) >= 78:
+            self.weight = _u16(os2, 4)
+            fs_selection = _u16(os2, 62)
+            self.use_typo_metrics = bool(fs_selection & (1 << 7))
+            self.typo_ascender = _i16(os2, 68)
+            self.typo_descender = _i16(os2, 70)
+            self.win_ascent = _u16(os2, 74)
+            self.win_descent = _u16(os2, 76)
+
+        self._advances = None
+        self._cmap = None
+        self._pair_lookups = None
+
+        self.family_names, self.subfamily_names = self._read_names()
+
+    def table(self, tag):
+        entry = self.tables.get(tag)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.data[offset:offset+length]
+
+    @property
+    def is_bold(self):
+        return bool(self.mac_style & 1) or self.weight >= 600
+
+    @property
+    def is_italic(self):
+        return bool(self.mac_style & 2)
+
+    # Ascender and descender (positive) in font units as used for the line height
+    def vertical_metrics(self):
+        if self.use_typo_metrics:
+            return self.typo_ascender, -self.typo_descender
+        if self.hhea_ascender or self.hhea_descender:
+            return self.hhea_ascender, -self.hhea_descender
+        return self.win_ascent, self.win_descent
+
+    def glyph_index(self, codepoint):
+        if self._cmap is None:
+            self._cmap = self._read_cmap()
+        return self._cmap.get(codepoint, 0)
+
+    def glyph_advance(self, glyph):
+        if self._advances is None:
+            self._advances = self._read_hmtx()
+        if glyph < len(self._advances):
+            return self._advances[glyph]
+        return self._advances[-1]
+
+    # Pair kerning in font units. Like HarfBuzz, GPOS 'kern' lookups replace the legacy kern table.
+    def kerning_value(self, left_glyph, right_glyph):
+        if self._pair_lookups is None:
+            self._pair_lookups = self._read_gpos_kerning()
+            if not self._pair_lookups:
+                self._pair_lookups = self._read_kern()
+
+        value = 0
+        for subtables in self._pair_lookups:
+            # First subtable covering the pair applies per lookup
+            for subtable in subtables:
+                if subtable[0] == 1:
+                    pairs = subtable[1].get(left_glyph)
+                    if pairs is not None and right_glyph in pairs:
+                        value += pairs[right_glyph]
+                        break
+                else:
+                    _, coverage, class_def_1, class_def_2, matrix = subtable
+                    if left_glyph in coverage:
+                        row = matrix[class_def_1.get(left_glyph, 0)]
+                        value += row[class_def_2.get(right_glyph, 0)] if row else 0
+                        break
+        return value
+
+    def _read_hmtx(self):
+        hmtx = self.table('hmtx')
+        n = self.num_h_metrics
+        return list(struct.unpack_from('>' + 'Hh' * n, hmtx, 0)[0::2])
+
+    def _read_cmap(self):
+        cmap = self.table('cmap')
+        num_subtables = _u16(cmap, 2)
+
+        # Prefer full unicode subtables
+        candidates = []
+        for i in range(num_subtables):
+            platform_id, encoding_id, offset = struct.unpack_from('>HHI', cmap, 4 + 8 * i)
+            fmt = _u16(cmap, offset)
+            if (platform_id, encoding_id) in ((3, 10), (0, 4), (0, 6)) and fmt == 12:
+                candidates.append((0, offset))
+            elif (platform_id, encoding_id) in ((3, 1), (0, 3), (0, 1), (0, 0)) and fmt == 4:
+                candidates.append((1, offset))
+            elif platform_id == 3 and encoding_id == 0 and fmt == 4:
+                candidates.append((2, offset))
+
+        if not candidates:
+            return {}
+
+        offset = min(candidates)[1]
+        fmt = _u16(cmap, offset)
+
+        if fmt == 12:
+            return self._read_cmap_12(cmap, offset)
+        return self._read_cmap_4(cmap, offset)
+
+    def _read_cmap_4(self, cmap, offset):
+        seg_count = _u16(cmap, offset + 6) // 2
+        end_codes = struct.unpack_from('>%dH' % seg_count, cmap, offset + 14)
+        start_codes = struct.unpack_from('>%dH' % seg_count, cmap, offset + 16 + 2 * seg_count)
+        id_deltas = struct.unpack_from('>%dh' % seg_count, cmap, offset + 16 + 4 * seg_count)
+        id_range_offsets_pos = offset + 16 + 6 * seg_count
+        id_range_offsets = struct.unpack_from('>%dH' % seg_count, cmap, id_range_offsets_pos)
+
+        ret = {}
+        for i in range(seg_count):
+            start = start_codes[i]
+            end = end_codes[i]
+            delta = id_deltas[i]
+            range_offset = id_range_offsets[i]
+            if start == 0xFFFF:
+                continue
+            for c in range(start, end + 1):
+                if range_offset == 0:
+                    glyph = (c + delta) & 0xFFFF
+                else:
+                    pos = id_range_offsets_pos + 2 * i + range_offset + 2 * (c - start)
+                    glyph = _u16(cmap, pos)
+                    if glyph:
+                        glyph = (glyph + delta) & 0xFFFF
+                if glyph:
+                    ret[c] = glyph
+        return ret
+
+    def _read_cmap_12(self, cmap, offset):
+        num_groups = _u32(cmap, offset + 12)
+        ret = {}
+        for i in range(num_groups):
+            start, end, glyph = struct.unpack_from('>III', cmap, offset + 16 + 12 * i)
+            for c in range(start, end + 1):
+                ret[c] = glyph + (c - start)
+        return ret
+
+    # Legacy kern table, format 0 horizontal subtables
+    def _read_kern(self):
+        pairs = {}
+        kern = self.table('kern')
+        if kern is None or len(kern) < 4:
+            return []
+
+        if _u16(kern, 0) != 0:
+            return []       # Apple kern table versions are not supported
+
+        num_subtables = _u16(kern, 2)
+        pos = 4
+        for _ in range(num_subtables):
+            length = _u16(kern, pos + 2)
+            coverage = _u16(kern, pos + 4)
+            fmt = coverage >> 8
+            horizontal = coverage & 1
+            if fmt == 0 and horizontal and not coverage & 0x4:
+                num_pairs = _u16(kern, pos + 6)
+                for i in range(num_pairs):
+                    left, right, value = struct.unpack_from('>HHh', kern, pos + 14 + 6 * i)
+                    pairs.setdefault(left, {})[right] = value
+            pos += length
+
+        if not pairs:
+            return []
+        return [[(1, pairs)]]
+
+    # GPOS pair adjustment lookups referenced by the 'kern' feature
+    def _read_gpos_kerning(self):
+        gpos = self.table('GPOS')
+        if gpos is None:
+            return []
+
+        feature_list = _u16(gpos, 6)
+        lookup_list = _u16(gpos, 8)
+
+        lookup_indices = set()
+        for i in range(_u16(gpos, feature_list)):
+            tag = gpos[feature_list+2+6*i:feature_list+6+6*i]
+            if tag != b'kern':
+                continue
+            feature = feature_list + _u16(gpos, feature_list + 6 + 6 * i)
+            for j in range(_u16(gpos, feature + 2)):
+                lookup_indices.add(_u16(gpos, feature + 4 + 2 * j))
+
+        lookups = []
+
+        for lookup_index in sorted(lookup_indices):
+            lookup = lookup_list + _u16(gpos, lookup_list + 2 + 2 * lookup_index)
+            lookup_type = _u16(gpos, lookup)
+            subtables = []
+            for k in range(_u16(gpos, lookup + 4)):
+                subtable = lookup + _u16(gpos, lookup + 6 + 2 * k)
+                subtable_type = lookup_type
+                if subtable_type == 9:
+                    subtable_type = _u16(gpos, subtable + 2)
+                    subtable = subtable + _u32(gpos, subtable + 4)
+                if subtable_type == 2:
+                    pair_pos = self._read_pair_pos(gpos, subtable)
+                    if pair_pos is not None:
+                        subtables.append(pair_pos)
+            if subtables:
+                lookups.append(subtables)
+
+        return lookups
+
+    def _read_coverage(self, data, offset):
+        fmt = _u16(data, offset)
+        count = _u16(data, offset + 2)
+        if fmt == 1:
+            return list(struct.unpack_from('>%dH' % count, data, offset + 4))
+        glyphs = []
+        for i in range(count):
+            start, end, _ = struct.unpack_from('>HHH', data, offset + 4 + 6 * i)
+            glyphs.extend(range(start, end + 1))
+        return glyphs
+
+    def _read_class_def(self, data, offset):
+        fmt = _u16(data, offset)
+        ret = {}
+        if fmt == 1:
+            start = _u16(data, offset + 2)
+            count = _u16(data, offset + 4)
+            for i, cls in enumerate(struct.unpack_from('>%dH' % count, data, offset + 6)):
+                if cls:
+                    ret[start + i] = cls
+        elif fmt == 2:
+            count = _u16(data, offset + 2)
+            for i in range(count):
+                start, end, cls = struct.unpack_from('>HHH', data, offset + 4 + 6 * i)
+                if cls:
+                    for g in range(start, end + 1):
+                        ret[g] = cls
+        return ret
+
+    @staticmethod
+    def _value_record_size(value_format):
+        return 2 * bin(value_format & 0xFF).count('1')
+
+    @staticmethod
+    def _value_record_x_advance(data, offset, value_format):
+        if not value_format & 0x4:
+            return 0
+        skip = bin(value_format & 0x3).count('1')
+        return _i16(data, offset + 2 * skip)
+
+    def _read_pair_pos(self, gpos, subtable):
+        fmt = _u16(gpos, subtable)
+        coverage = self._read_coverage(gpos, subtable + _u16(gpos, subtable + 2))
+        value_format_1 = _u16(gpos, subtable + 4)
+        value_format_2 = _u16(gpos, subtable + 6)
+        size_1 = self._value_record_size(value_format_1)
+        size_2 = self._value_record_size(value_format_2)
+
+        if fmt == 1:
+            pairs = {}
+            pair_set_count = _u16(gpos, subtable + 8)
+            record_size = 2 + size_1 + size_2
+            for i in range(min(pair_set_count, len(coverage))):
+                pair_set = subtable + _u16(gpos, subtable + 10 + 2 * i)
+                left_pairs = {}
+                for j in range(_u16(gpos, pair_set)):
+                    record = pair_set + 2 + record_size * j
+                    right = _u16(gpos, record)
+                    left_pairs[right] = self._value_record_x_advance(gpos, record + 2, value_format_1)
+                pairs[coverage[i]] = left_pairs
+            return (1, pairs)
+
+        if fmt == 2:
+            class_def_1 = self._read_class_def(gpos, subtable + _u16(gpos, subtable + 8))
+            class_def_2 = self._read_class_def(gpos, subtable + _u16(gpos, subtable + 10))
+            class_1_count = _u16(gpos, subtable + 12)
+            class_2_count = _u16(gpos, subtable + 14)
+            record_size = size_1 + size_2
+
+            matrix = []
+            for class_1 in range(class_1_count):
+                row = subtable + 16 + class_1 * class_2_count * record_size
+                values = [self._value_record_x_advance(gpos, row + class_2 * record_size, value_format_1) for class_2 in range(class_2_count)]
+                matrix.append(values if any(values) else None)
+
+            return (2, set(coverage), class_def_1, class_def_2, matrix)
+
+        return None
+
+    def _read_names(self):
+        families = set()
+        subfamilies = set()
+
+        name = self.table('name')
+        if name is None:
+            return families, subfamilies
+
+        count = _u16(name, 2)
+        string_offset = _u16(name, 4)
+        for i in range(count):
+            platform_id, encoding_id, language_id, name_id, length, offset = struct.unpack_from('>HHHHHH', name, 6 + 12 * i)
+            if name_id not in (1, 2, 16, 17):
+                continue
+            raw = name[string_offset+offset:string_offset+offset+length]
+            if platform_id in (0, 3):
+                value = raw.decode('utf-16-be', errors='replace')
+            elif platform_id == 1 and encoding_id == 0:
+                value = raw.decode('mac-roman', errors='replace')
+            else:
+                continue
+            if name_id in (1, 16):
+                families.add(value)
+            else:
+                subfamilies.add(value)
+
+        return families, subfamilies
+
+
+# Maps lower case family names to lists of (path, font index, is_bold, is_italic)
+def build_font_index(font_dirs):
+    index = {}
+
+    for font_dir in font_dirs:
+        for root, dirs, files in os.walk(font_dir):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.lower().endswith(font_file_extensions):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    with open(path, 'rb') as f:
+                        count = font_count(f.read(12))
+                    for font_index in range(count):
+                        font = SfntFont(path, font_index)
+                        for family in font.family_names:
+                            index.setdefault(family.lower(), []).append((path, font_index, font.is_bold, font.is_italic))
+                except (OSError, struct.error, ValueError, IndexError, KeyError, TypeError):
+                    continue
+
+    return index
+
+
+def find_font(index, family, bold, italic=False):
+    candidates = index.get(family.lower())
+    if not candidates:
+        return None
+
+    def score(candidate):
+        path, font_index, is_bold, is_italic = candidate
+        return (is_bold != bool(bold), is_italic != bool(italic))
+
+    path, font_index, _, _ = min(candidates, key=score)
+    return path, font_index
+
+
+# Font metrics with the QFontMetrics methods used for layout
+# Advances are summed in 26.6 fixed point and rounded like Qt does with FreeType
+class SfntFontMetrics():
+
+    def __init__(self, font, pixel_size):
+        self.font = font
+        self.pixel_size = pixel_size
+
+        units_per_em = font.units_per_em
+        ascender, descender = font.vertical_metrics()
+        self._ascent = -(-ascender * pixel_size // units_per_em)
+        self._descent = -(-descender * pixel_size // units_per_em)
+
+        self._scale_64 = pixel_size * 64 / units_per_em
+        self._glyph_advances_64 = {}
+
+    def ascent(self):
+        return self._ascent
+
+    def descent(self):
+        return self._descent
+
+    def height(self):
+        return self._ascent + self._descent
+
+    def _glyph_advance_64(self, glyph):
+        advance = self._glyph_advances_64.get(glyph)
+        if advance is None:
+            advance = (self.font.glyph_advance(glyph) * self.pixel_size * 64) // self.font.units_per_em
+            self._glyph_advances_64[glyph] = advance
+        return advance
+
+    def char_advance_64(self, c):
+        return self._glyph_advance_64(self.font.glyph_index(ord(c)))
+
+    def fingerprint(self):
+        h = hashlib.sha1()
+        h.update(os.path.abspath(self.font.path).encode('utf-8'))
+        h.update(b'%d ' % self.font.font_index)
+        h.update(self.font.table('head'))
+        h.update(b'%d %d' % (self.pixel_size, self.height()))
+        return h.digest()
+
+    def horizontalAdvance(self, text):
+        font = self.font
+        total = 0
+        last_glyph = None
+        for c in text:
+            glyph = font.glyph_index(ord(c))
+            total += self._glyph_advance_64(glyph)
+            if last_glyph is not None:
+                kerning = font.kerning_value(last_glyph, glyph)
+                if kerning:
+                    total += round(kerning * self._scale_64)
+            last_glyph = glyph
+        return (total + 32) >> 6
@@ -0,0 +1,249 @@
+from . import tag_parse_ruby
+from .rubysubs import ConversionStats, EventFieldOrder, charset_sample_size, default_measure_backend, detect_sub_encoding, load_subs, setup_event_styles, style_parsers, layout_subs_events, output_events, merge_frame_drawings, merges_frames, convert_subs
+
+import re
+import codecs
+import itertools
+
+
+# Streaming conversion of SubStation Alpha files between binary file objects, like stdin and stdout.
+#
+# The header up to [Events] is read and written first. Which styles events use is not known at that
+# point, so output styles are written for every style of the header. Events are read in batches,
+# laid out once their collision group (see rubysubs.collision_groups) is complete and written right
+# away. Memory stays bounded by the batch size and the longest collision group.
+#
+# Events have to be sorted by start time, as written by most tools, UnsortedEventsError is raised
+# otherwise. [Fonts] and [Graphics] sections following [Events] are written after the events, other
+# sections following it are skipped. Other subtitle formats are read completely and converted like
+# convert_sub_data.
+
+events_heading = re.compile(r'^\[events\]$', re.IGNORECASE)
+attachment_headings = ('[fonts]', '[graphics]')
+
+read_size = 64 * 1024
+
+
+# Yields the lines of binary file data decoded like decode_sub_data, the encoding is detected from
+# the first charset_sample_size bytes
+def decoded_lines(in_fp, stats):
+    sample = b''
+    while len(sample) < charset_sample_size:
+        data = in_fp.read(charset_sample_size - len(sample))
+        if not data:
+            break
+        sample += data
+
+    subs_encoding = detect_sub_encoding(sample, len(sample) < charset_sample_size)
+    stats.info['encoding'] = subs_encoding
+    decoder = codecs.getincrementaldecoder(subs_encoding)(errors='replace')
+
+    pending = ''
+    data = sample
+
+    while True:
+        stats.count('input_bytes', len(data))
+        final = not data
+        text = pending + decoder.decode(data, final)
+
+        # Universal newlines, a trailing \r might be followed by \n in the next read
+        held = ''
+        if not final and text.endswith('\r'):
+            text, held = text[:-1], '\r'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+        lines = text.split('\n')
+        pending = lines.pop() + held
+        yield from lines
+
+        if final:
+            if pending:
+                yield pending
+            return
+
+        data = in_fp.read(read_size)
+
+
+# Raised by convert_sub_stream for an event starting before the one read before it, its output is
+# incomplete then. Such files have to be converted as a whole.
+class UnsortedEventsError(ValueError):
+    pass
+
+
+# Returns the event lines of events as written by SSAFile.to_string
+def format_events(events, output_format):
+    import pysubs2
+
+    subs = pysubs2.SSAFile()
+    subs.events = events
+    text = subs.to_string(output_format, header_notice='')
+
+    # Skip everything up to and including the Format line of [Events]
+    start = text.index('\n[Events]\n') + len('\n[Events]\n')
+    return text[text.index('\n', start) + 1:]
+
+
+# Returns the [Fonts] and [Graphics] sections of subs as written by SSAFile.to_string
+def format_attachments(subs, output_format):
+    text = subs.to_string(output_format, header_notice='')
+    start = min(text.find(heading) for heading in ('\n[Fonts]\n', '\n[Graphics]\n') if heading in text)
+    return text[start:text.index('\n[Events]\n')] + '\n'
+
+
+# Converts SubStation Alpha data from in_fp and writes the result to out_fp as it is laid out, both are
+# binary file objects. Returns a ConversionStats, stats can be passed to collect into an existing one.
+# batch_size events are parsed at once and at least that many are laid out at once.
+def convert_sub_stream(in_fp, out_fp, tag_parser=tag_parse_ruby.parse, measure_backend=None, stats=None, parser_cache=None, output_format='ass', layout_options=None, batch_size=512):
+    import pysubs2
+    from pysubs2.formats.substation import SubstationFormat, SECTION_HEADING as section_heading
+
+    if stats is None:
+        stats = ConversionStats()
+
+    if measure_backend is None:
+        measure_backend = default_measure_backend()
+
+    def write(text):
+        data = text.encode('utf-8')
+        out_fp.write(data)
+        stats.count('output_bytes', len(data))
+
+    lines = decoded_lines(in_fp, stats)
+
+    # Header
+    header_lines = []
+    events_line = None
+    with stats.stage('load'):
+        for line in lines:
+            if events_heading.match(line.strip()):
+                events_line = line
+                break
+            header_lines.append(line)
+        header_text = '\n'.join(header_lines) + '\n'
+        input_format = SubstationFormat.guess_format(header_text)
+
+    if events_line is None or input_format is None:
+        # Not SubStation Alpha or without events, convert as a whole
+        with stats.stage('load'):
+            if events_line is not None:
+                header_lines.append(events_line)
+                header_lines.extend(lines)
+            subs = load_subs('\n'.join(header_lines))
+        convert_subs(subs, tag_parser, measure_backend, stats, parser_cache, layout_options)
+        with stats.stage('save'):
+            write(subs.to_string(output_format, header_notice='Generated by rubysubs'))
+        with stats.stage('flush'):
+            measure_backend.flush()
+        out_fp.flush()
+        return stats
+
+    with stats.stage('load'):
+        header = pysubs2.SSAFile.from_string(header_text, format_=input_format)
+
+    with stats.stage('setup'):
+        event_styles = setup_event_styles(header, list(header.styles.keys()))
+        parsers = style_parsers(event_styles, tag_parser, measure_backend, parser_cache, layout_options)
+    stats.count('styles', len(event_styles))
+
+    # Events placed before [Events] are read by pysubs2 as well
+    header_events = header.events
+    header.events = []
+
+    with stats.stage('save'):
+        write(header.to_string(output_format, header_notice='Generated by rubysubs'))
+
+    # Lays out and writes complete collision groups
+    def flush(events):
+        events.sort()
+        event_parts, counters = layout_subs_events(parsers, events, stats)
+        for name, n in counters.items():
+            stats.count(name, n)
+
+        out_events = output_events(events, event_parts)
+        if merges_frames(layout_options):
+            out_events, merged = merge_frame_drawings(out_events)
+            stats.count('events_merged', merged)
+        stats.count('events_in', len(events))
+        stats.count('events_out', len(out_events))
+
+        with stats.stage('save'):
+            write(format_events(out_events, output_format))
+
+    def parse_events(event_lines):
+        with stats.stage('load'):
+            return pysubs2.SSAFile.from_string('\n'.join(event_lines), format_=input_format).events
+
+    # Lines of [Fonts] and [Graphics] sections following [Events]
+    attachment_lines = []
+
+    # Yields lists of up to batch_size events. Event lines are read in the order of the Format line of
+    # [Events] and like pysubs2 in any section but [Script Info] and attachment sections.
+    def read_events():
+        event_lines = []
+        field_order = None
+        section = '[events]'
+        for line in lines:
+            line = line.strip()
+            if section_heading.match(line):
+                section = line.lower()
+                if section in attachment_headings:
+                    attachment_lines.append(line)
+                continue
+            if section in attachment_headings:
+                attachment_lines.append(line)
+                continue
+            if section == '[events]' and line.lower().startswith('format:'):
+                field_order = EventFieldOrder(line, input_format)
+                if field_order.is_standard():
+                    field_order = None
+                continue
+            if section == '[script info]' or not (line.startswith('Dialogue:') or line.startswith('Comment:')):
+                continue
+            if field_order is not None:
+                line = field_order.reorder(line)
+            event_lines.append(line)
+            if len(event_lines) >= batch_size:
+                yield parse_events(event_lines)
+                event_lines = []
+        if event_lines:
+            yield parse_events(event_lines)
+
+    # Events from open_start on belong to the collision group still open, ending at open_end
+    pending = []
+    open_start = 0
+    open_end = None
+    last_start = None
+
+    for events in itertools.chain([header_events], read_events()):
+        for e in events:
+            if last_start is not None and e.start < last_start:
+                raise UnsortedEventsError('Events have to be sorted by start time to be streamed, an event at %s follows one at %s'
+                                          % (SubstationFormat.ms_to_timestamp(e.start), SubstationFormat.ms_to_timestamp(last_start)))
+            last_start = e.start
+
+            if open_end is not None and e.start >= open_end:
+                open_start = len(pending)
+                open_end = None
+            pending.append(e)
+            open_end = e.end if open_end is None else max(open_end, e.end)
+
+        if open_start >= batch_size:
+            flush(pending[:open_start])
+            pending = pending[open_start:]
+            open_start = 0
+
+    if pending:
+        flush(pending)
+
+    if attachment_lines:
+        with stats.stage('save'):
+            attachments = pysubs2.SSAFile.from_string('\n'.join(attachment_lines), format_=input_format)
+            if attachments.fonts_opaque or attachments.graphics_opaque:
+                write(format_attachments(attachments, output_format))
+
+    with stats.stage('flush'):
+        measure_backend.flush()
+    out_fp.flush()
+
+    return stats
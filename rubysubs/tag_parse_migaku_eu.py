@@ -1,4 +1,8 @@
 from . import tags
+from . import tag_tokenize
+from . import tag_tables
+
+import functools
 
 gender_colors = {
     'm': '005CE6',
@@ -9,104 +13,96 @@ gender_colors = {
 def is_word_char(c):
     return c.isalnum()
 
+tokenizer = tag_tokenize.BracketTokenizer(r'[^\W_]')     # Same characters as is_word_char
 
-def frequency_color(freq):
-    if freq == 0:
-        return (255, 211,   0, 0.5)
-    if (freq < 1500):
-        return ( 44, 173, 246, 0.5)
-    if (freq < 5000):
-        return ( 65, 208, 182, 0.5)
-    if (freq < 15000):
-        return (253, 255,  22, 0.5)
-    if (freq < 30000):
-        return (226, 116,  32, 0.5)
-    if (freq < 60000):
-        return (249,  28,  28, 0.5)
-    return (203, 203, 203, 0.5)
 
+frequency_color = tag_tables.frequency_color
 
-def parse(text, gender_highlighting=True, unknown_underlining=True, one_t_marking=True, one_t_frequency_marking=True):
-    lines_tags = []
-
-    for line_text in text.split('\n'):
-        line_tags = []
-
-        last = 0
-        
-        while True:
-            bracket_open = line_text.find('[', last)
-            if bracket_open < 0:
-                break
-            bracket_close = line_text.find(']', bracket_open+1)
-            if bracket_close < 0:
-                break
-
-            word_start = bracket_open
-            while True:
-                if word_start <= last:
-                    break
-                if is_word_char(line_text[word_start-1]):
-                    word_start -= 1
+
+class Parser(tag_tables.CompiledParser):
+
+    name = 'eu'
+    option_names = ('gender_highlighting', 'unknown_underlining', 'one_t_marking', 'one_t_frequency_marking')
+
+    def __init__(self, args, in_args=None):
+        super().__init__(args, in_args)
+        self.gender_highlighting, self.unknown_underlining, self.one_t_marking, self.one_t_frequency_marking = self.args
+
+        # Color tags by gender
+        self.gender_color_tags = {}
+        if self.gender_highlighting:
+            self.gender_color_tags = {gender: tag_tables.color_tags(color) for gender, color in gender_colors.items()}
+
+        self.frequency_highlights = tag_tables.FrequencyHighlights()
+        self.unknown_underlines = tag_tables.UnknownUnderlines()
+
+    def __call__(self, text):
+        unknown_underlining = self.unknown_underlining
+        one_t_marking = self.one_t_marking
+        one_t_frequency_marking = self.one_t_frequency_marking
+        gender_color_tags = self.gender_color_tags
+
+        lines_tags = []
+
+        for spans in tokenizer.tokenize(text):
+            line_tags = []
+
+            for prefix, word, bracket_text, _ in spans:
+                if prefix:
+                    line_tags.append(tags.TagText(prefix))
+
+                if bracket_text is None:
+                    continue
+
+                bracket_parts = bracket_text.split(';')
+
+
+                if len(bracket_parts) != 3:
+                    line_tags.append( tags.TagText(word, '?') )
                 else:
-                    break
-            
-            if last < word_start:
-                line_tags.append(tags.TagText(line_text[last:word_start]))
+                    gender = bracket_parts[0]
+                    learning_status = int(bracket_parts[1])
 
-            word = line_text[word_start:bracket_open]
-            bracket_text = line_text[bracket_open+1:bracket_close]
-            bracket_parts = bracket_text.split(';')
+                    is_one_t = False
+                    one_t_frequency = 0
 
+                    one_t_info_parts = bracket_parts[2].split(',')
+                    is_one_t = one_t_info_parts[0] == '1'
+                    if len(one_t_info_parts) >= 2 and one_t_frequency_marking:
+                        one_t_frequency = int(one_t_info_parts[1])
 
-            if len(bracket_parts) != 3:
-                line_tags.append( tags.TagText(word, '?') )
-            else:
-                gender = bracket_parts[0]
-                learning_status = int(bracket_parts[1])
+                    color_tags = gender_color_tags.get(gender)
+                    if color_tags:
+                        word = color_tags[0] + word + color_tags[1]
 
-                is_one_t = False
-                one_t_frequency = 0
+                    if one_t_marking and is_one_t:
+                        line_tags.append( self.frequency_highlights(one_t_frequency) )
 
-                one_t_info_parts = bracket_parts[2].split(',')
-                is_one_t = one_t_info_parts[0] == '1'
-                if len(one_t_info_parts) >= 2 and one_t_frequency_marking:
-                    one_t_frequency = int(one_t_info_parts[1])
+                    if unknown_underlining and learning_status < 2:
+                        line_tags.append( self.unknown_underlines(learning_status) )
 
-                if gender_highlighting:
-                    color = gender_colors.get(gender)
-                    if color:
-                        co = '{\\c&H' + color[4:6] + color[2:4] + color[0:2] + '&}'
-                        cc = '{\\c}'
-                        word = co + word + cc
+                    line_tags.append( tags.TagText(word) )
 
-                if one_t_marking and is_one_t:
-                    color = frequency_color(one_t_frequency)
-                    line_tags.append( tags.TagHighlightStart(*color) )
+                    if unknown_underlining and learning_status < 2:
+                        line_tags.append( tags.TagUnderlineEnd )
 
-                if unknown_underlining and learning_status < 2:
-                    if learning_status == 1:
-                        line_tags.append( tags.TagUnderlineStart(241, 187, 78) )
-                    else:
-                        line_tags.append( tags.TagUnderlineStart(241, 78, 78) )
+                    if one_t_marking and is_one_t:
+                        line_tags.append( tags.TagHighlightEnd )
 
-                line_tags.append( tags.TagText(word) )
 
-                if unknown_underlining and learning_status < 2:
-                    line_tags.append( tags.TagUnderlineEnd )
+            lines_tags.append(line_tags)
 
-                if one_t_marking and is_one_t:
-                    line_tags.append( tags.TagHighlightEnd )
+        return lines_tags
 
 
-            last = bracket_close+1
+# Parsers for direct calls of parse
+@functools.lru_cache(maxsize=32)
+def compiled_parser(*args):
+    return Parser(args)
 
-        if last < len(line_text):
-            line_tags.append( tags.TagText(line_text[last:], '') )
 
-        lines_tags.append(line_tags)
-    
-    return lines_tags
+def parse(text, gender_highlighting=True, unknown_underlining=True, one_t_marking=True, one_t_frequency_marking=True):
+    return compiled_parser(gender_highlighting, unknown_underlining, one_t_marking, one_t_frequency_marking)(text)
 
 
 
@@ -129,5 +125,4 @@ def args_from_strings(in_args):
 
 
 def parser_from_string_args(in_args):
-    args = args_from_strings(in_args)
-    return (lambda text: parse(text, *args))
\ No newline at end of file
+    return Parser(args_from_strings(in_args), in_args)
@@ -1,39 +1,31 @@
 from . import tags
 from . import ja_util
+from . import tag_tokenize
+from . import tag_tables
 
+import functools
 from enum import Enum
 
 
 # Entries: (main_text, ruby_text, following_text, accent_list, dictionary_form, learning_status, is_one_t, one_t_frequency)
 
+tokenizer = tag_tokenize.BracketTokenizer(space_separated=True, with_suffix=True)
+
+
 def parse_migaku(text):
     lines = []
 
-    for l in text.split('\n'):
+    for spans in tokenizer.tokenize(text):
         parts = []
 
-        last = 0
-        
-        while True:
-            i = l.find('[', last)
-            if i < 0:
-                break
-            j = l.find(']', i+1)
-            if j < 0:
-                break
-            
-            k = l.rfind(' ', last, i)
-
-            if last < k:
-                parts.append( (l[last:k], '', '', [], None, 2, False, 0) )
+        for prefix, word, payload, following_text in spans:
+            if prefix:
+                parts.append( (prefix, '', '', [], None, 2, False, 0) )
 
-            k = max(last, k+1)
+            if payload is None:
+                continue
 
-            m = l.find(' ', j+1)
-            if m < 0:
-                m = len(l)
-
-            bracket_parts = l[i+1:j].split(';')
+            bracket_parts = payload.split(';')
             
             # TODO: Workaround.
             if len(bracket_parts) == 3:
@@ -60,12 +52,7 @@ def parse_migaku(text):
                 if len(one_t_info_parts) >= 2:
                     one_t_frequency = int(one_t_info_parts[1])
 
-            parts.append( (l[k:i], ruby_text, l[j+1:m], accent_list, dictionary_form, learning_status, is_one_t, one_t_frequency) )
-
-            last = m+1
-
-        if last < len(l):
-            parts.append( (l[last:len(l)], '', '', [], None, 2, False, 0) )
+            parts.append( (word, ruby_text, following_text, accent_list, dictionary_form, learning_status, is_one_t, one_t_frequency) )
 
         lines.append(parts)
 
@@ -92,134 +79,146 @@ class Mode(Enum):
         return associations.get(key.lower(), cls.KANJI_READING)
 
 
-def frequency_color(freq):
-    if freq == 0:
-        return (255, 211,   0, 0.5)
-    if (freq < 1500):
-        return ( 44, 173, 246, 0.5)
-    if (freq < 5000):
-        return ( 65, 208, 182, 0.5)
-    if (freq < 15000):
-        return (253, 255,  22, 0.5)
-    if (freq < 30000):
-        return (226, 116,  32, 0.5)
-    if (freq < 60000):
-        return (249,  28,  28, 0.5)
-    return (203, 203, 203, 0.5)
+frequency_color = tag_tables.frequency_color
+
+
+# First letter of an accent -> color
+coloring = {
+    'h': '005CE6',  # Heiban
+    'a': 'E60000',  # Atamadaka
+    'n': 'E68A00',  # Nakadaka
+    'o': '00802B',  # Odaka
+    'k': 'AC00E6',  # Kifuku
+}
 
+no_color_tags = ('', '')
 
-def migaku_to_ruby(parsed_lines, mode=Mode.KANJI_READING, pitch_highlighting=True, pitch_shapes=False, unknown_underlining=True, one_t_highlighting=True, one_t_frequency_marking=True):
 
-    coloring = {
-        'h': '005CE6',  # Heiban
-        'a': 'E60000',  # Atamadaka
-        'n': 'E68A00',  # Nakadaka
-        'o': '00802B',  # Odaka
-        'k': 'AC00E6',  # Kifuku
-    }
-
-    def deco_for_accent_list(accent_list):
-        if pitch_highlighting and len(accent_list) and len(accent_list[0]):
-            color = coloring.get(accent_list[0][0])
-            if color:
-                co = '{\\c&H' + color[4:6] + color[2:4] + color[0:2] + '&}'
-                cc = '{\\c}'
-                return co, cc
-        return '', ''
-
-    def pitch_shapes_text(accent_list):
-        ret = ''
-        for a in accent_list[1:]:
-            color = coloring.get(a[0])
-            if color:
-                ret += '{\\c&H' + color[4:6] + color[2:4] + color[0:2] + '&}⬩{\\c}'
+class Parser(tag_tables.CompiledParser):
+
+    name = 'ja'
+    option_names = ('mode', 'pitch_highlighting', 'pitch_shapes', 'unknown_underlining', 'one_t_marking', 'one_t_frequency_marking')
+
+    def __init__(self, args, in_args=None):
+        super().__init__(args, in_args)
+        self.mode, self.pitch_highlighting, self.pitch_shapes, self.unknown_underlining, self.one_t_marking, self.one_t_frequency_marking = self.args
+
+        # Color tags of the first accent and pitch shape text of further accents by accent letter
+        self.accent_color_tags = {}
+        if self.pitch_highlighting:
+            self.accent_color_tags = {a: tag_tables.color_tags(color) for a, color in coloring.items()}
+        self.pitch_shape_texts = {}
+        for a, color in coloring.items():
+            co, cc = tag_tables.color_tags(color)
+            self.pitch_shape_texts[a] = co + '⬩' + cc
+
+        self.frequency_highlights = tag_tables.FrequencyHighlights()
+        self.unknown_underlines = tag_tables.UnknownUnderlines()
+
+    def __call__(self, text):
+        return self.to_ruby(parse_migaku(text))
+
+    def to_ruby(self, parsed_lines):
+        mode = self.mode
+        pitch_shapes = self.pitch_shapes
+        unknown_underlining = self.unknown_underlining
+        one_t_marking = self.one_t_marking
+        one_t_frequency_marking = self.one_t_frequency_marking
+        accent_color_tags = self.accent_color_tags
+        pitch_shape_texts = self.pitch_shape_texts
+
+        # List if tag lists for each line
+        ret = []
+
+        for l in parsed_lines:
+
+            # Line tags
+            retl = []
+
+            for (main_text, ruby_text, following_text, accent_list, dictionary_form, learning_status, is_one_t, one_t_frequency) in l:
+                co, cc = no_color_tags
+                if accent_color_tags and accent_list and accent_list[0]:
+                    co, cc = accent_color_tags.get(accent_list[0][0], no_color_tags)
+
+                # Unknown/1T opening tags
+                if one_t_marking and is_one_t:
+                    if not one_t_frequency_marking:
+                        one_t_frequency = 0
+                    retl.append( self.frequency_highlights(one_t_frequency) )
+
+                if unknown_underlining and learning_status < 2:
+                    retl.append( self.unknown_underlines(learning_status) )
+
+                # Tags for content
+                # TODO: Remove spaces from Kanji/Furigana modes
+                if mode == Mode.READING:
+                    # Use ruby text instead of normal text if available
+                    txt = co + (ruby_text if ruby_text else main_text) + following_text + cc
+                    retl.append( tags.TagText(txt, '') )
+
+                elif mode == Mode.KANJI:
+                    # Discard ruby text
+                    txt = co + main_text + following_text + cc
+                    retl.append( tags.TagText(txt, '') )
+
+                else:   # Mode.KANJI_READING and Mode.KANJI_READING_UNKNOWN
+                    if ruby_text and (mode != Mode.KANJI_READING_UNKNOWN or learning_status == 0):
+                        groups = ja_util.distribute_furigana(main_text, ruby_text)
+                        for expression, reading in groups:
+                            tag_text = co + expression + cc
+                            tag_ruby_text = ''
+                            if reading:
+                                tag_ruby_text = co + reading + cc
+                            retl.append( tags.TagText(tag_text, tag_ruby_text) )
+                    else:
+                        tag_text = co + main_text + cc
+                        retl.append( tags.TagText(tag_text, '') )
+
+                    if following_text:
+                        retl.append( tags.TagText(co + following_text + cc, '') )
+
+                # Pitch shapes
+                if pitch_shapes:
+                    retl.append( tags.TagText(''.join(pitch_shape_texts.get(a[0], '') for a in accent_list[1:]), '') )
+
+                # Unknown/1T closing tags
+                if unknown_underlining and learning_status < 2:
+                    retl.append( tags.TagUnderlineEnd )
+
+                if one_t_marking and is_one_t:
+                    retl.append( tags.TagHighlightEnd )
+
+                # TODO: Emit spaces if in kana mode
+
+            # Post processing to reduce number of elements
+            retl_pp = []
+
+            for tag in retl:
+                # If the last and current tags are text and have no ruby, combine them
+                if len(retl_pp) and tag.kind == tags.TEXT and not tag.ruby_text:
+                    last_tag = retl_pp[-1]
+                    if last_tag.kind == tags.TEXT and not last_tag.ruby_text:
+                        last_tag.text = last_tag.text + tag.text
+                        continue
+                retl_pp.append(tag)
+
+            ret.append(retl_pp)
+
         return ret
 
-    # List if tag lists for each line
-    ret = []
-
-    for l in parsed_lines:
-        
-        # Line tags
-        retl = []
-
-        for (main_text, ruby_text, following_text, accent_list, dictionary_form, learning_status, is_one_t, one_t_frequency) in l:
-            co, cc = deco_for_accent_list(accent_list)
-
-            # Unknown/1T opening tags
-            if one_t_highlighting and is_one_t:
-                if not one_t_frequency_marking:
-                    one_t_frequency = 0
-                color = frequency_color(one_t_frequency)
-                retl.append( tags.TagHighlightStart(*color) )
-
-            if unknown_underlining and learning_status < 2:
-                if learning_status == 1:
-                    retl.append( tags.TagUnderlineStart(241, 187, 78) )
-                else:
-                    retl.append( tags.TagUnderlineStart(241, 78, 78) )
-
-            # Tags for content
-            # TODO: Remove spaces from Kanji/Furigana modes
-            if mode == Mode.READING:
-                # Use ruby text instead of normal text if available
-                txt = co + (ruby_text if ruby_text else main_text) + following_text + cc
-                retl.append( tags.TagText(txt, '') )
-
-            elif mode == Mode.KANJI:
-                # Discard ruby text
-                txt = co + main_text + following_text + cc
-                retl.append( tags.TagText(txt, '') )
-
-            else:   # Mode.KANJI_READING and Mode.KANJI_READING_UNKNOWN
-                if ruby_text and (mode != mode.KANJI_READING_UNKNOWN or learning_status == 0):
-                    groups = ja_util.distribute_furigana(main_text, ruby_text)
-                    for expression, reading in groups:
-                        tag_text = co + expression + cc
-                        tag_ruby_text = ''
-                        if reading:
-                            tag_ruby_text = co + reading + cc
-                        retl.append( tags.TagText(tag_text, tag_ruby_text) )
-                else:
-                    tag_text = co + main_text + cc
-                    retl.append( tags.TagText(tag_text, '') )
-
-                if following_text:
-                    retl.append( tags.TagText(co + following_text + cc, '') )
-
-            # Pitch shapes
-            if pitch_shapes:
-                retl.append( tags.TagText(pitch_shapes_text(accent_list), '') )
-
-            # Unknown/1T closing tags
-            if unknown_underlining and learning_status < 2:
-                retl.append( tags.TagUnderlineEnd )
-
-            if one_t_highlighting and is_one_t:
-                retl.append( tags.TagHighlightEnd )
-
-            # TODO: Emit spaces if in kana mode
-
-        # Post processing to reduce number of elements
-        retl_pp = []
-
-        for tag in retl:
-            # If the last and current tags are text and have no ruby, combine them
-            if len(retl_pp) and tag.isof(tags.TagText) and not tag.ruby_text:
-                last_tag = retl_pp[-1]
-                if last_tag.isof(tags.TagText) and not last_tag.ruby_text:
-                    last_tag.text = last_tag.text + tag.text
-                    continue
-            retl_pp.append(tag)
-
-        ret.append(retl_pp)
-
-    return ret
+
+# Parsers for direct calls of migaku_to_ruby and parse
+@functools.lru_cache(maxsize=32)
+def compiled_parser(*args):
+    return Parser(args)
+
+
+def migaku_to_ruby(parsed_lines, mode=Mode.KANJI_READING, pitch_highlighting=True, pitch_shapes=False, unknown_underlining=True, one_t_highlighting=True, one_t_frequency_marking=True):
+    return compiled_parser(mode, pitch_highlighting, pitch_shapes, unknown_underlining, one_t_highlighting, one_t_frequency_marking).to_ruby(parsed_lines)
 
 
 def parse(text, mode=Mode.KANJI_READING, pitch_highlighting=True, pitch_shapes=False, unknown_underlining=True, one_t_marking=True, one_t_frequency_marking=True):
-    migaku_parsed = parse_migaku(text)
-    return migaku_to_ruby(migaku_parsed, mode, pitch_highlighting, pitch_shapes, unknown_underlining, one_t_marking, one_t_frequency_marking)
+    return compiled_parser(mode, pitch_highlighting, pitch_shapes, unknown_underlining, one_t_marking, one_t_frequency_marking)(text)
 
 
 def args_from_strings(in_args):
@@ -247,5 +246,4 @@ def args_from_strings(in_args):
 
 
 def parser_from_string_args(in_args):
-    args = args_from_strings(in_args)
-    return (lambda text: parse(text, *args))
+    return Parser(args_from_strings(in_args), in_args)
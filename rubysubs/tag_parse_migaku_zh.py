@@ -1,20 +1,29 @@
 from . import tags
+from . import tag_tokenize
+from . import tag_tables
 
+import functools
 from enum import Enum
 from itertools import zip_longest
 
 
-def pinyin_number_to_tone(syllable):
-    replacements = {
-        'a': ['ā', 'á', 'ǎ', 'à'],
-        'e': ['ē', 'é', 'ě', 'è'],
-        'u': ['ū', 'ú', 'ǔ', 'ù'],
-        'i': ['ī', 'í', 'ǐ', 'ì'],
-        'o': ['ō', 'ó', 'ǒ', 'ò'],
-        'ü': ['ǖ', 'ǘ', 'ǚ', 'ǜ'],
-    }
+pinyin_tone_marks = {
+    'a': ['ā', 'á', 'ǎ', 'à'],
+    'e': ['ē', 'é', 'ě', 'è'],
+    'u': ['ū', 'ú', 'ǔ', 'ù'],
+    'i': ['ī', 'í', 'ǐ', 'ì'],
+    'o': ['ō', 'ó', 'ǒ', 'ò'],
+    'ü': ['ǖ', 'ǘ', 'ǚ', 'ǜ'],
+}
+
+pinyin_medials = ('i', 'u', 'ü')
+
+zhuyin_tone_marks = [ '', 'ˊ', 'ˇ', 'ˋ', '˙' ]
+
 
-    medials = ['i', 'u', 'ü']
+def pinyin_number_to_tone(syllable):
+    replacements = pinyin_tone_marks
+    medials = pinyin_medials
 
     if len(syllable) < 1:
         return syllable
@@ -45,7 +54,7 @@ def pinyin_number_to_tone(syllable):
 
 
 def zhuyin_number_to_tone(syllable):
-    tones = [ '', 'ˊ', 'ˇ', 'ˋ', '˙' ]
+    tones = zhuyin_tone_marks
 
     if len(syllable) < 1:
         return syllable
@@ -77,6 +86,8 @@ def is_hanzi(text):
     for c in text:
         return any([s <= ord(c) <= e for (s,e) in hanzi_ranges])
 
+tokenizer = tag_tokenize.BracketTokenizer(tag_tokenize.range_char_class(hanzi_ranges))
+
 
 
 color_table_mandarin = [
@@ -96,6 +107,12 @@ color_table_cantonese = [
     '808080',
 ]
 
+# Color tags of each tone
+tone_color_tags_mandarin = [tag_tables.color_tags(color) for color in color_table_mandarin]
+tone_color_tags_cantonese = [tag_tables.color_tags(color) for color in color_table_cantonese]
+
+no_color_tags = ('', '')
+
 
 class DecoMode(Enum):
     NONE = 0,
@@ -125,144 +142,146 @@ class Mode:
             elif txt == 'zhuyin':
                 self.deco_mode = DecoMode.ZHUYIN
 
+    def __repr__(self):
+        return 'Mode(is_cantonese=%r, deco_mode=%s, only_unknown=%r)' % (self.is_cantonese, self.deco_mode, self.only_unknown)
 
-    def color_tags_for_syllable(self, syllable, tone_highlighting):
-        if not tone_highlighting or len(syllable) < 1:
-            return '', ''
+    # Modes with the same settings are interchangeable, compiled parsers are cached by them
+    def __eq__(self, other):
+        return isinstance(other, Mode) and (self.is_cantonese, self.deco_mode, self.only_unknown) == (other.is_cantonese, other.deco_mode, other.only_unknown)
 
-        try:
-            idx = int(syllable[-1]) - 1
-        except ValueError:
-            return '', ''
+    def __hash__(self):
+        return hash((self.is_cantonese, self.deco_mode, self.only_unknown))
+
+    def tone_color_tags(self):
+        return tone_color_tags_cantonese if self.is_cantonese else tone_color_tags_mandarin
+
+    # Returns the function converting a numbered syllable for the ruby text, None without ruby text
+    def deco_function(self):
+        if self.deco_mode == DecoMode.PINYIN:
+            return pinyin_number_to_tone
+        if self.deco_mode == DecoMode.ZHUYIN:
+            return zhuyin_number_to_tone
+        if self.deco_mode == DecoMode.JYUTPING:
+            return str
+        return None
+
+
+frequency_color = tag_tables.frequency_color
 
-        color_table = color_table_cantonese if self.is_cantonese else color_table_mandarin
-        idx = min(idx, len(color_table)-1)
-        color = color_table[idx]
 
-        co = '{\\c&H' + color[4:6] + color[2:4] + color[0:2] + '&}'
-        cc = '{\\c}'
+class Parser(tag_tables.CompiledParser):
 
-        return co, cc
+    name = 'zh'
+    option_names = ('mode', 'tone_highlighting', 'unknown_underlining', 'one_t_marking', 'one_t_frequency_marking')
 
+    def __init__(self, args, in_args=None):
+        super().__init__(args, in_args)
+        self.mode, self.tone_highlighting, self.unknown_underlining, self.one_t_marking, self.one_t_frequency_marking = self.args
+        if self.mode.is_cantonese:
+            self.name = 'zh_hk'
 
-    def markup_word(self, text, syllables, tone_highlighting, is_unknown):
+        self.tone_color_tags = self.mode.tone_color_tags() if self.tone_highlighting else None
+        self.deco_function = self.mode.deco_function()
+
+        self.frequency_highlights = tag_tables.FrequencyHighlights()
+        self.unknown_underlines = tag_tables.UnknownUnderlines()
+
+    def color_tags_for_syllable(self, syllable):
+        if self.tone_color_tags is None or len(syllable) < 1:
+            return no_color_tags
+
+        try:
+            idx = int(syllable[-1]) - 1
+        except ValueError:
+            return no_color_tags
+
+        return self.tone_color_tags[min(idx, len(self.tone_color_tags)-1)]
+
+    # Returns (text, ruby text) of a word colored by the tone of each syllable
+    def markup_word(self, text, syllables, is_unknown):
         if len(text) != len(syllables):
             return (text, '?')
 
-        ret_text = ''
-        ret_deco = ''
+        text_parts = []
+        deco_parts = []
+
+        deco_function = self.deco_function
+        if self.mode.only_unknown and not is_unknown:
+            deco_function = None
 
         for h, s in zip(text, syllables):
-            co, cc = self.color_tags_for_syllable(s, tone_highlighting)
-            ret_text += co + h + cc
-            if self.deco_mode != DecoMode.NONE and ((not self.only_unknown) or is_unknown):
-                if self.deco_mode == DecoMode.PINYIN:
-                    s = pinyin_number_to_tone(s)
-                elif self.deco_mode == DecoMode.ZHUYIN:
-                    s = zhuyin_number_to_tone(s)
-                ret_deco += co + s + cc
-
-        return (ret_text, ret_deco)
-
-
-def frequency_color(freq):
-    if freq == 0:
-        return (255, 211,   0, 0.5)
-    if (freq < 1500):
-        return ( 44, 173, 246, 0.5)
-    if (freq < 5000):
-        return ( 65, 208, 182, 0.5)
-    if (freq < 15000):
-        return (253, 255,  22, 0.5)
-    if (freq < 30000):
-        return (226, 116,  32, 0.5)
-    if (freq < 60000):
-        return (249,  28,  28, 0.5)
-    return (203, 203, 203, 0.5)
+            co, cc = self.color_tags_for_syllable(s)
+            text_parts.append(co + h + cc)
+            if deco_function is not None:
+                deco_parts.append(co + deco_function(s) + cc)
 
+        return (''.join(text_parts), ''.join(deco_parts))
 
-def parse(text, mode, tone_highlighting, unknown_underlining, one_t_marking, one_t_frequency_marking):
+    def __call__(self, text):
+        unknown_underlining = self.unknown_underlining
+        one_t_marking = self.one_t_marking
+        one_t_frequency_marking = self.one_t_frequency_marking
 
-    lines_tags = []
+        lines_tags = []
 
-    for line_text in text.split('\n'):
-        line_tags = []
+        for spans in tokenizer.tokenize(text):
+            line_tags = []
 
-        last = 0
+            # Words are the hanzi in front of the brackets
+            for prefix, hanzi_text, bracket_text, _ in spans:
+                if prefix:
+                    line_tags.append(tags.TagText(prefix))
 
-        while True:
-            bracket_open = line_text.find('[', last)
-            if bracket_open < 0:
-                break
-            bracket_close = line_text.find(']', bracket_open+1)
-            if bracket_close < 0:
-                break
+                if hanzi_text:
+                    bracket_parts = bracket_text.split(';')
 
-            # Walk back and find hanzi range to decorate
-            hanzi_start = bracket_open
-            while True:
-                if hanzi_start <= last:
-                    break
-                if is_hanzi(line_text[hanzi_start-1]):
-                    hanzi_start -= 1
-                else:
-                    break
-            hanzi_end = bracket_open
+                    syllables = []
+                    if len(bracket_parts) >= 1:
+                        syllables = bracket_parts[0].split()
 
-            if last < hanzi_start:
-                line_tags.append(tags.TagText(line_text[last:hanzi_start]))
+                    learning_status = 2
+                    if len(bracket_parts) >= 2:
+                        learning_status = int(bracket_parts[1])
 
-            if hanzi_start < hanzi_end:
-                hanzi_text = line_text[hanzi_start:hanzi_end]
-                bracket_text = line_text[bracket_open+1:bracket_close]
-                bracket_parts = bracket_text.split(';')
+                    is_one_t = False
+                    one_t_frequency = 0
+                    if len(bracket_parts) >= 3:
+                        one_t_info_parts = bracket_parts[2].split(',')
+                        is_one_t = one_t_info_parts[0] == '1'
+                        if len(one_t_info_parts) >= 2 and one_t_frequency_marking:
+                            one_t_frequency = int(one_t_info_parts[1])
 
-                syllables = []
-                if len(bracket_parts) >= 1:
-                    syllables = bracket_parts[0].split()
+                    # Unknown/1T opening tags
+                    if one_t_marking and is_one_t:
+                        line_tags.append( self.frequency_highlights(one_t_frequency) )
 
-                learning_status = 2
-                if len(bracket_parts) >= 2:
-                    learning_status = int(bracket_parts[1])
-                
-                is_one_t = False
-                one_t_frequency = 0
-                if len(bracket_parts) >= 3:
-                    one_t_info_parts = bracket_parts[2].split(',')
-                    is_one_t = one_t_info_parts[0] == '1'
-                    if len(one_t_info_parts) >= 2 and one_t_frequency_marking:
-                        one_t_frequency = int(one_t_info_parts[1])
+                    if unknown_underlining and learning_status < 2:
+                        line_tags.append( self.unknown_underlines(learning_status) )
 
-                # Unknown/1T opening tags
-                if one_t_marking and is_one_t:
-                    color = frequency_color(one_t_frequency)
-                    line_tags.append( tags.TagHighlightStart(*color) )
+                    # Hanzi/Deco
+                    tag_hanzi, tag_deco = self.markup_word(hanzi_text, syllables, learning_status==0)
+                    line_tags.append(tags.TagText(tag_hanzi, tag_deco))
 
-                if unknown_underlining and learning_status < 2:
-                    if learning_status == 1:
-                        line_tags.append( tags.TagUnderlineStart(241, 187, 78) )
-                    else:
-                        line_tags.append( tags.TagUnderlineStart(241, 78, 78) )
+                    # Unknown/1T closing tags
+                    if unknown_underlining and learning_status < 2:
+                        line_tags.append( tags.TagUnderlineEnd )
 
-                # Hanzi/Deco
-                tag_hanzi, tag_deco = mode.markup_word(hanzi_text, syllables, tone_highlighting, learning_status==0)
-                line_tags.append(tags.TagText(tag_hanzi, tag_deco))                                
+                    if one_t_marking and is_one_t:
+                        line_tags.append( tags.TagHighlightEnd )
 
-                # Unknown/1T closing tags
-                if unknown_underlining and learning_status < 2:
-                    line_tags.append( tags.TagUnderlineEnd )
+            lines_tags.append(line_tags)
 
-                if one_t_marking and is_one_t:
-                    line_tags.append( tags.TagHighlightEnd )
+        return lines_tags
 
-            last = bracket_close+1
 
-        if last < len(line_text):
-            line_tags.append(tags.TagText(line_text[last:]))
+# Parsers for direct calls of parse
+@functools.lru_cache(maxsize=32)
+def compiled_parser(*args):
+    return Parser(args)
 
-        lines_tags.append(line_tags)
 
-    return lines_tags
+def parse(text, mode, tone_highlighting, unknown_underlining, one_t_marking, one_t_frequency_marking):
+    return compiled_parser(mode, tone_highlighting, unknown_underlining, one_t_marking, one_t_frequency_marking)(text)
 
 
 
@@ -287,10 +306,15 @@ def args_from_strings(in_args, is_cantonese):
     return out_args
 
 
+def args_from_strings_mandarin(in_args):
+    return args_from_strings(in_args, False)
+
+def args_from_strings_HK(in_args):
+    return args_from_strings(in_args, True)
+
+
 def parser_from_string_args(in_args):
-    args = args_from_strings(in_args, False)
-    return (lambda text: parse(text, *args))
+    return Parser(args_from_strings(in_args, False), in_args)
 
 def parser_from_string_args_HK(in_args):
-    args = args_from_strings(in_args, True)
-    return (lambda text: parse(text, *args))
+    return Parser(args_from_strings(in_args, True), in_args)
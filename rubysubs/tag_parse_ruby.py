@@ -1,40 +1,40 @@
 from . import tags
+from . import tag_tokenize
+from . import tag_tables
+
+
+tokenizer = tag_tokenize.BracketTokenizer(space_separated=True)
 
 
 def parse(text):
     lines = []
 
-    for l in text.split('\n'):
+    for spans in tokenizer.tokenize(text):
         parts = []
 
-        last = 0
-        
-        while True:
-            i = l.find('[', last)
-            if i < 0:
-                break
-            j = l.find(']', i+1)
-            if j < 0:
-                break
-            
-            k = l.rfind(' ', last, i)
+        for prefix, word, payload, _ in spans:
+            if prefix:
+                parts.append( tags.TagText(prefix, '') )
+
+            if payload is not None:
+                parts.append( tags.TagText(word, payload) )
+
+        lines.append(parts)
 
-            if last < k:
-                parts.append( tags.TagText(l[last:k], '') )
+    return lines
 
-            k = max(last, k+1)
 
-            parts.append( tags.TagText(l[k:i], l[i+1:j]) )
+def args_from_strings(in_args):
+    return []
 
-            last = j+1
 
-        if last < len(l):
-            parts.append( tags.TagText(l[last:len(l)], '') )
+class Parser(tag_tables.CompiledParser):
 
-        lines.append(parts)
+    name = 'ruby'
 
-    return lines
+    def __call__(self, text):
+        return parse(text)
 
 
 def parser_from_string_args(in_args):
-    return parse
+    return Parser(args_from_strings(in_args), in_args)
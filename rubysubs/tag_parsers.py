@@ -0,0 +1,66 @@
+import importlib
+
+
+# Tag parser name -> (module, builder taking a list of string arguments, function resolving string
+# arguments to the values the parser is called with). Modules are imported on first use.
+tag_parser_registry = {
+    'ruby':     ('tag_parse_ruby',      'parser_from_string_args',      'args_from_strings'),
+    'ja':       ('tag_parse_migaku_ja', 'parser_from_string_args',      'args_from_strings'),
+    'zh':       ('tag_parse_migaku_zh', 'parser_from_string_args',      'args_from_strings_mandarin'),
+    'zh_hk':    ('tag_parse_migaku_zh', 'parser_from_string_args_HK',   'args_from_strings_HK'),
+    'eu':       ('tag_parse_migaku_eu', 'parser_from_string_args',      'args_from_strings'),
+    'ko':       ('tag_parse_migaku_ko', 'parser_from_string_args',      'args_from_strings'),
+}
+
+
+def normalize_name(name):
+    return name.lower().replace('-', '_')
+
+
+def is_valid_name(name):
+    return normalize_name(name) in tag_parser_registry
+
+
+# Returns (builder, resolver) of a tag parser, importing its module
+def _registry_functions(name):
+    name = normalize_name(name)
+    if name not in tag_parser_registry:
+        raise ValueError('Invalid tag parser: %s' % name)
+    module_name, builder_name, resolver_name = tag_parser_registry[name]
+    module = importlib.import_module('.' + module_name, __package__)
+    return getattr(module, builder_name), getattr(module, resolver_name)
+
+
+def tag_parser_builder(name):
+    return _registry_functions(name)[0]
+
+
+# Returns a compiled parser, see tag_tables.CompiledParser for its introspection
+# Its spec builds it again in other processes
+def tag_parser_from_string_args(name, in_args=()):
+    return tag_parser_builder(name)(list(in_args))
+
+
+# Returns a string identifying the tag parser and its resolved arguments
+# Arguments that resolve to the same values, like 'no' and 'false', give the same key
+def tag_parser_key(name, in_args=()):
+    resolver = _registry_functions(name)[1]
+    return '%s %r' % (normalize_name(name), resolver(list(in_args)))
+
+
+# Compiled tag parsers by key, arguments that resolve to the same values share one parser
+class TagParserCache():
+
+    def __init__(self):
+        self.tag_parsers = {}
+
+    def get(self, name, in_args=()):
+        key = tag_parser_key(name, in_args)
+        tag_parser = self.tag_parsers.get(key)
+        if tag_parser is None:
+            tag_parser = tag_parser_from_string_args(name, in_args)
+            self.tag_parsers[key] = tag_parser
+        return tag_parser
+
+    def __len__(self):
+        return len(self.tag_parsers)
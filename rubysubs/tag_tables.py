@@ -0,0 +1,110 @@
+from . import tags
+
+import bisect
+
+
+# Tables shared by the Migaku tag parsers.
+#
+# Compiled parsers build their color override strings and start tags once for their configuration
+# instead of once per word. Start tags are shared by all events, layout only reads them.
+
+
+# Returns the ASS override tags (opening, closing) coloring text with an RRGGBB hex color
+def color_tags(color):
+    return '{\\c&H' + color[4:6] + color[2:4] + color[0:2] + '&}', '{\\c}'
+
+
+# 1T highlight colors, frequency 0 is unknown
+unknown_frequency_color = (255, 211,   0, 0.5)
+
+# Exclusive upper frequency bound and color of each bucket, higher frequencies use the last color
+frequency_buckets = [
+    ( 1500, ( 44, 173, 246, 0.5)),
+    ( 5000, ( 65, 208, 182, 0.5)),
+    (15000, (253, 255,  22, 0.5)),
+    (30000, (226, 116,  32, 0.5)),
+    (60000, (249,  28,  28, 0.5)),
+    (None,  (203, 203, 203, 0.5)),
+]
+
+frequency_bounds = [bound for bound, _ in frequency_buckets[:-1]]
+frequency_colors = [color for _, color in frequency_buckets]
+
+
+def frequency_color(freq):
+    if freq == 0:
+        return unknown_frequency_color
+    return frequency_colors[bisect.bisect_right(frequency_bounds, freq)]
+
+
+# Highlight start tag for each 1T frequency
+class FrequencyHighlights():
+
+    def __init__(self):
+        self.unknown_tag = tags.TagHighlightStart(*unknown_frequency_color)
+        self.bucket_tags = [tags.TagHighlightStart(*color) for color in frequency_colors]
+
+    def __call__(self, freq):
+        if freq == 0:
+            return self.unknown_tag
+        return self.bucket_tags[bisect.bisect_right(frequency_bounds, freq)]
+
+
+# Underline start tags of unknown words, learning status 1 is learning, lower ones are unknown
+unknown_underline_color = (241, 78, 78)
+learning_underline_color = (241, 187, 78)
+
+
+class UnknownUnderlines():
+
+    def __init__(self):
+        self.unknown_tag = tags.TagUnderlineStart(*unknown_underline_color)
+        self.learning_tag = tags.TagUnderlineStart(*learning_underline_color)
+
+    def __call__(self, learning_status):
+        return self.learning_tag if learning_status == 1 else self.unknown_tag
+
+
+# Base of compiled tag parsers. Instances are called with the subtitle text like plain parse functions.
+#
+# Introspection:
+#   name:          Tag parser name in tag_parsers.tag_parser_registry
+#   args:          Resolved arguments, as returned by the module's args_from_strings
+#   option_names:  Name of each argument
+#   options():     Dict of option name -> resolved argument
+#   key:           String identifying name and resolved arguments, same as tag_parsers.tag_parser_key
+#   cache_key:     Key of the parser in the result cache, same as key
+#   spec:          (name, string arguments) to build the parser again in other processes with
+#                  tag_parsers.tag_parser_from_string_args, None if it was not built from string arguments
+class CompiledParser():
+
+    name = None
+    option_names = ()
+
+    # in_args are the string arguments the resolved args were built from, if any
+    def __init__(self, args, in_args=None):
+        self.args = list(args)
+        self.in_args = None if in_args is None else list(in_args)
+
+    def __call__(self, text):
+        raise NotImplementedError()
+
+    def options(self):
+        return dict(zip(self.option_names, self.args))
+
+    @property
+    def key(self):
+        return '%s %r' % (self.name, self.args)
+
+    @property
+    def cache_key(self):
+        return self.key
+
+    @property
+    def spec(self):
+        if self.in_args is None:
+            return None
+        return (self.name, self.in_args)
+
+    def __repr__(self):
+        return '%s(%r%s)' % (self.__class__.__name__, self.name, ''.join(', %s=%r' % item for item in zip(self.option_names, self.args)))
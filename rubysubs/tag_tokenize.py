@@ -0,0 +1,51 @@
+import re
+
+
+# Splits lines into spans of (prefix, word, payload, suffix) for words annotated with square brackets.
+#
+#   prefix:  Unannotated text before the word
+#   word:    Text the bracket payload belongs to, directly in front of the opening bracket
+#   payload: Text inside the brackets, None for the trailing text of a line (which is then the prefix)
+#   suffix:  Text following the closing bracket up to the next space, only with with_suffix
+#
+# Words either consist of characters matched by word_class (a regex character class) or, with
+# space_separated, of everything after the last space. In that case the separating space is dropped,
+# as is the space ending a suffix.
+class BracketTokenizer():
+
+    def __init__(self, word_class=None, space_separated=False, with_suffix=False):
+        if space_separated:
+            pattern = r' ?(?P<word>[^ \[]*)\[(?P<payload>[^\]]*)\]'
+        else:
+            pattern = r'(?P<word>%s*)\[(?P<payload>[^\]]*)\]' % word_class
+
+        if with_suffix:
+            pattern += r'(?P<suffix>[^ ]*) ?'
+
+        self.with_suffix = with_suffix
+        self.pattern = re.compile(pattern)
+
+    def tokenize_line(self, line):
+        spans = []
+        last = 0
+
+        for m in self.pattern.finditer(line):
+            suffix = m.group('suffix') if self.with_suffix else ''
+            spans.append((line[last:m.start()], m.group('word'), m.group('payload'), suffix))
+            last = m.end()
+
+        if last < len(line):
+            spans.append((line[last:], '', None, ''))
+
+        return spans
+
+    # Returns a list of spans for each line of text
+    def tokenize(self, text):
+        return [self.tokenize_line(line) for line in text.split('\n')]
+
+
+def negated_char_class(chars):
+    return '[^' + re.escape(chars) + ']'
+
+def range_char_class(ranges):
+    return '[' + ''.join('%s-%s' % (re.escape(chr(s)), re.escape(chr(e))) for s, e in ranges) + ']'
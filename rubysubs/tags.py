@@ -1,10 +1,27 @@
+from .ass_tags import strip_ass_tags
+
+
+# Integer tag kinds, compare tag.kind against these instead of calling isof in hot loops
+TEXT = 0
+UNDERLINE_START = 1
+UNDERLINE_END = 2
+HIGHLIGHT_START = 3
+HIGHLIGHT_END = 4
+
+
 class TagBaseMeta(type):
 
     def __repr__(cls):
         return cls.__name__
 
+# Tags use __slots__ to keep the many small objects created per event compact.
+# End tags carry no data and are passed around as the classes themselves.
 class TagBase(metaclass=TagBaseMeta):
 
+    __slots__ = ()
+
+    kind = None
+
     @classmethod
     def isof(cls, tag_type):
         return issubclass(cls, tag_type)
@@ -12,16 +29,56 @@ class TagBase(metaclass=TagBaseMeta):
 
 class TagText(TagBase):
 
+    __slots__ = ('_text', '_ruby_text', '_visible_text', '_visible_ruby_text')
+
+    kind = TEXT
+
     def __init__(self, text='', ruby_text=''):
         self.text = text
         self.ruby_text = ruby_text
 
+    # Text without override tags is computed once and dropped when the text changes
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self._visible_text = None
+
+    @property
+    def ruby_text(self):
+        return self._ruby_text
+
+    @ruby_text.setter
+    def ruby_text(self, ruby_text):
+        self._ruby_text = ruby_text
+        self._visible_ruby_text = None
+
+    @property
+    def visible_text(self):
+        if self._visible_text is None:
+            self._visible_text = strip_ass_tags(self._text)
+        return self._visible_text
+
+    @property
+    def visible_ruby_text(self):
+        if self._visible_ruby_text is None:
+            self._visible_ruby_text = strip_ass_tags(self._ruby_text)
+        return self._visible_ruby_text
+
     def __repr__(self):
         return '%s(\'%s\', \'%s\')' % (self.__class__.__name__, self.text, self.ruby_text)
 
 
 class TagUnderlineStart(TagBase):
 
+    __slots__ = ('r', 'g', 'b')
+
+    kind = UNDERLINE_START
+
     def __init__(self, r=0, g=0, b=0):
         self.r = r
         self.g = g
@@ -31,11 +88,16 @@ class TagUnderlineStart(TagBase):
         return '%s(r=%d, g=%d, b=%d)' % (self.__class__.__name__, self.r, self.g, self.b)
 
 class TagUnderlineEnd(TagBase):
-    pass
+
+    kind = UNDERLINE_END
 
 
 class TagHighlightStart(TagBase):
 
+    __slots__ = ('r', 'g', 'b', 'a')
+
+    kind = HIGHLIGHT_START
+
     def __init__(self, r=0, g=0, b=0, a=255):
         self.r = r
         self.g = g
@@ -46,4 +108,5 @@ class TagHighlightStart(TagBase):
         return '%s(r=%d, g=%d, b=%d, a=%d)' % (self.__class__.__name__, self.r, self.g, self.b, self.a)
 
 class TagHighlightEnd(TagBase):
-    pass
+
+    kind = HIGHLIGHT_END
@@ -3,9 +3,13 @@ import setuptools
 with open('README.md', 'r', encoding='utf-8') as f_desc:
     long_description = f_desc.read()
 
+version = {}
+with open('rubysubs/version.py', 'r', encoding='utf-8') as f_version:
+    exec(f_version.read(), version)
+
 setuptools.setup(
     name='rubysubs',
-    version='0.1.4',
+    version=version['__version__'],
     author='Bent',
     author_email='bent@mail.de',
     description='Tool/library to add ruby text to subtitles',
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import collections
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers, advance_cache
+from rubysubs.advance_cache import CachedMeasureBackend
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+# Offset of the font file fingerprint in table headers, after magic, version and byte order
+fingerprint_offset = 12
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_data(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Font metrics counting everything they measure in calls of their backend
+class CountingMetrics():
+
+    def __init__(self, metrics, calls):
+        self.metrics = metrics
+        self.calls = calls
+
+    def height(self):
+        self.calls['height'] += 1
+        return self.metrics.height()
+
+    def fingerprint(self):
+        self.calls['fingerprint'] += 1
+        return self.metrics.fingerprint()
+
+    def char_advance_64(self, c):
+        self.calls['char_advance_64'] += 1
+        return self.metrics.char_advance_64(c)
+
+    def horizontalAdvance(self, text):
+        self.calls['horizontalAdvance'] += 1
+        return self.metrics.horizontalAdvance(text)
+
+
+class CountingBackend(rubysubs.QtMeasureBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = collections.Counter()
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        self.calls['font_metrics'] += 1
+        return CountingMetrics(super().font_metrics(font_name, point_size, bold, italic), self.calls)
+
+
+class AdvanceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.subs_data = read_data(overlap_path)
+        self.tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        self.expected = rubysubs.convert_sub_data(self.subs_data, self.tag_parser)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    # Converts overlap.ass with a new cached backend as a new process would, returns calls of the wrapped backend
+    def convert(self):
+        backend = CountingBackend()
+        out_text = rubysubs.convert_sub_data(self.subs_data, self.tag_parser, CachedMeasureBackend(backend, self.cache_dir))
+        self.assertEqual(out_text, self.expected)
+        return backend.calls
+
+    def test_warm_run(self):
+        calls = self.convert()
+        self.assertGreater(calls['char_advance_64'], 0)
+        self.assertGreater(calls['horizontalAdvance'], 0)
+
+        # Everything is found in the tables, no font is even loaded
+        self.assertEqual(self.convert(), collections.Counter())
+        self.assertEqual(self.convert(), collections.Counter())
+
+    def test_rebuild(self):
+        self.convert()
+        backend = CountingBackend()
+        entries = advance_cache.check_cache(self.cache_dir, backend)
+        self.assertGreater(len(entries), 0)
+        self.assertTrue(all(is_valid for _, _, is_valid in entries))
+
+        # Tables written for another font file are stale until rebuilt
+        for path, _, _ in entries:
+            with open(path, 'r+b') as f:
+                f.seek(fingerprint_offset)
+                f.write(bytes(20))
+        self.assertFalse(any(is_valid for _, _, is_valid in advance_cache.check_cache(self.cache_dir, backend)))
+
+        self.assertEqual(advance_cache.rebuild_cache(self.cache_dir, backend), len(entries))
+        self.assertTrue(all(is_valid for _, _, is_valid in advance_cache.check_cache(self.cache_dir, backend)))
+
+        # Rebuilt tables keep all advances and widths, probing the fixed advance ranges again measures nothing
+        self.assertEqual(self.convert(), collections.Counter())
+
+    def test_clear(self):
+        self.convert()
+        advance_cache.clear_cache(self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
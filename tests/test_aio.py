@@ -0,0 +1,72 @@
+import os
+import asyncio
+import tempfile
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers
+from rubysubs.aio import AsyncConverter
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+# Conversions running at the same time in an AsyncConverter have to give the same files as convert_sub_file
+class AsyncConverterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.furigana_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        self.kana_parser = tag_parsers.tag_parser_from_string_args('ja', ['kana'])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def temp_path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def convert_sub_file(self, out_name, tag_parser, layout_options=None):
+        rubysubs.convert_sub_file(overlap_path, self.temp_path(out_name), tag_parser, layout_options=layout_options)
+        return read_text(self.temp_path(out_name))
+
+    async def convert_async(self, converter):
+        with open(overlap_path, 'rb') as f:
+            subs_data = f.read()
+        return await asyncio.gather(
+            converter.convert_file(overlap_path, self.temp_path('async.ass'), self.furigana_parser),
+            converter.convert_data(subs_data, self.kana_parser, layout_options={'compact': True}),
+        )
+
+    def test_concurrent_conversions(self):
+        default_registry = rubysubs.rubysubs.default_font_registry
+        default_lookups = default_registry.hits + default_registry.misses
+
+        converter = AsyncConverter(max_concurrency=2)
+        try:
+            stats, out_text = asyncio.run(self.convert_async(converter))
+        finally:
+            converter.close()
+
+        # Fonts of the converter's thread are kept in its own registry
+        self.assertGreater(converter.font_registry.misses, 0)
+        self.assertEqual(default_registry.hits + default_registry.misses, default_lookups)
+
+        self.assertEqual(read_text(self.temp_path('async.ass')), self.convert_sub_file('furigana.ass', self.furigana_parser))
+        self.assertEqual(out_text, self.convert_sub_file('kana.ass', self.kana_parser, {'compact': True}))
+        self.assertGreater(stats.counters['output_bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubysubs
+from rubysubs import batch, tag_parsers
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_data(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Batch conversion has to write the same files as convert_sub_file, with and without worker processes
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.in_paths = batch.expand_inputs([data_dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def expected_outputs(self, tag_parser_name, tag_parser_args):
+        tag_parser = tag_parsers.tag_parser_from_string_args(tag_parser_name, tag_parser_args)
+        ret = []
+        for in_path in self.in_paths:
+            out_path = os.path.join(self.temp_dir, 'serial', os.path.basename(in_path))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            rubysubs.convert_sub_file(in_path, out_path, tag_parser)
+            ret.append(read_data(out_path))
+        return ret
+
+    def test_expand_inputs(self):
+        self.assertGreater(len(self.in_paths), 0)
+        self.assertTrue(all(path.endswith(batch.subtitle_extensions) for path in self.in_paths))
+        self.assertEqual(batch.expand_inputs([data_dir, os.path.join(data_dir, '*.ass')]), self.in_paths)
+
+    def test_batch(self):
+        for tag_parser_name, tag_parser_args in (('ja', ['furigana']), ('ruby', [])):
+            expected = self.expected_outputs(tag_parser_name, tag_parser_args)
+
+            for workers in (1, 2):
+                with self.subTest(tag_parser=tag_parser_name, workers=workers):
+                    out_template = os.path.join(self.temp_dir, '%s-%d' % (tag_parser_name, workers), '{name}')
+                    results = batch.convert_sub_files([data_dir], out_template, tag_parser_name, tag_parser_args, workers=workers)
+
+                    self.assertEqual([in_path for in_path, _, _ in results], self.in_paths)
+                    self.assertEqual([error for _, _, error in results], [None] * len(self.in_paths))
+                    self.assertEqual([read_data(out_path) for _, out_path, _ in results], expected)
+
+    # A failing file is reported without stopping the others
+    def test_errors(self):
+        bad_path = os.path.join(self.temp_dir, 'bad.ass')
+        with open(bad_path, 'wb') as f:
+            f.write(b'\xff\xfe\x00broken')
+
+        out_template = os.path.join(self.temp_dir, 'out', '{name}')
+        results = batch.convert_sub_files([data_dir, bad_path], out_template, workers=1)
+        self.assertEqual(len(results), len(self.in_paths) + 1)
+        self.assertIsNone(results[0][2])
+        self.assertIsNotNone(results[-1][2])
+
+        # Templates overwriting the inputs are rejected before converting anything
+        with self.assertRaises(ValueError):
+            batch.convert_sub_files([data_dir], '{path}{ext}', workers=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers
+from rubysubs.daemon import ConversionDaemon, DaemonClient, DaemonError
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_data(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Conversions of the daemon have to give the same files as convert_sub_file and convert_sub_data
+class ConversionDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.temp_dir.name, 'rubysubs.sock')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def temp_path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    # Runs client(socket_path) in another thread while the daemon converts on this one, like the
+    # daemon command does with its QGuiApplication. Returns what client returned.
+    def run_daemon(self, client):
+        daemon = ConversionDaemon(self.socket_path)
+        daemon.listen()
+
+        result = {}
+        def run_client():
+            try:
+                result['value'] = client(self.socket_path)
+            except BaseException as e:
+                result['error'] = e
+            finally:
+                daemon.shutdown()
+
+        thread = threading.Thread(target=run_client)
+        thread.start()
+        daemon.serve_forever()
+        thread.join()
+
+        self.assertFalse(os.path.exists(self.socket_path))
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def test_convert(self):
+        subs_data = read_data(overlap_path)
+        layout_options = {'compact': True, 'merge_drawings': 'frame'}
+
+        def client(socket_path):
+            with DaemonClient(socket_path, timeout=60) as c:
+                c.ping()
+                response = c.convert_file(overlap_path, self.temp_path('daemon.ass'), 'ja', ['furigana'], stats=True)
+                out_data = c.convert_data(subs_data, 'ja', ['kana'], layout_options)
+                return response, out_data
+
+        response, out_data = self.run_daemon(client)
+        self.assertEqual(response['encoding'], 'utf-8')
+        self.assertIn('stats', response)
+
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        rubysubs.convert_sub_file(overlap_path, self.temp_path('serial.ass'), tag_parser)
+        self.assertEqual(read_data(self.temp_path('daemon.ass')), read_data(self.temp_path('serial.ass')))
+
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['kana'])
+        self.assertEqual(out_data, rubysubs.convert_sub_data(subs_data, tag_parser, layout_options=layout_options).encode('utf-8'))
+
+    # Failed requests are answered with an error, the connection stays usable
+    def test_errors(self):
+        def client(socket_path):
+            errors = []
+            with DaemonClient(socket_path, timeout=60) as c:
+                for message in ({'command': 'reboot'}, {'command': 'convert', 'tag_parser': 'xx', 'input_data': ''},
+                                {'command': 'convert'}, {'command': 'convert', 'input_path': overlap_path},
+                                {'command': 'convert', 'input_data': '', 'layout_options': {'width_cache_size': 0}}):
+                    with self.assertRaises(DaemonError) as cm:
+                        c.request(message)
+                    errors.append(str(cm.exception))
+                c.ping()
+            return errors
+
+        errors = self.run_daemon(client)
+        self.assertEqual(len(errors), 5)
+        self.assertIn('Unknown command', errors[0])
+        self.assertIn('Invalid tag parser', errors[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import unittest
+
+import rubysubs
+from rubysubs import tags, tag_parsers
+from rubysubs.rubysubs import CollisionScheduler, load_subs, setup_event_styles, style_parsers, event_parsers_for, schedule_events, collision_groups
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Overlapping events of three styles with different alignments, some shown from the same start to the
+# same end, with ja tags
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+layout_options_cases = [
+    None,
+    {'compact': True},
+    {'merge_drawings': 'line'},
+    {'merge_drawings': 'event'},
+    {'compact': True, 'merge_drawings': 'frame'},
+]
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_data(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_events():
+    with open(overlap_path, encoding='utf-8') as f:
+        subs = load_subs(f.read())
+    events = sorted(subs.events)
+    return subs, events
+
+
+# parse_many and layout_many have to lay out exactly like parse_sub and layout_tags for each event
+class LayoutManyTest(unittest.TestCase):
+
+    def test_layout_many(self):
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+
+        for layout_options in layout_options_cases:
+            with self.subTest(layout_options=layout_options):
+                subs, events = load_events()
+                parsers = style_parsers(setup_event_styles(subs), tag_parser, layout_options=layout_options)
+                parser = parsers['Default']
+                event_parsers = event_parsers_for(parsers, events)
+
+                parsed_events = [parser.parse_tags(e.text) for e in events]
+                positions = schedule_events(parser, events, parsed_events, event_parsers)
+                self.assertGreater(len(set(positions)), 3)
+
+                for event_parser in set(event_parsers):
+                    indices = [i for i, p in enumerate(event_parsers) if p is event_parser]
+                    texts = [events[i].text for i in indices]
+                    start_positions = [positions[i] for i in indices]
+
+                    expected = [event_parser.parse_sub(text, position) for text, position in zip(texts, start_positions)]
+                    self.assertEqual(event_parser.parse_many(texts, start_positions), expected)
+
+                    parsed = [parsed_events[i] for i in indices]
+                    expected = [event_parser.layout_tags(parsed_lines, position) for parsed_lines, position in zip(parsed, start_positions)]
+                    self.assertEqual(event_parser.layout_many(parsed, start_positions), expected)
+
+
+# Returns (scheduler, start, end, height, origin, position) of each event as placed by schedule_events.
+# Top aligned events are returned with the negated positions their scheduler works with.
+def scheduled_events(parsers, events):
+    parsed_events = [parsers['Default'].parse_tags(e.text) for e in events]
+    event_parsers = event_parsers_for(parsers, events)
+    positions = schedule_events(parsers['Default'], events, parsed_events, event_parsers)
+
+    ret = []
+    for e, parsed_lines, event_parser, position in zip(events, parsed_events, event_parsers, positions):
+        height = event_parser.event_height(parsed_lines)
+        origin = event_parser.origin(height)
+        if event_parser.valign == 'top':
+            ret.append(('top', e.start, e.end, height, -event_parser.margin_v, origin - event_parser.margin_v - position))
+        else:
+            ret.append((event_parser.valign, e.start, e.end, height, origin, position))
+    return ret
+
+
+# Lowest position from origin up not overlapping any of the bands (top, bottom), tried one by one
+def lowest_free_position(bands, height, origin):
+    candidates = [origin] + sorted((top for top, _ in bands if top < origin), reverse=True)
+    for position in candidates:
+        if all(top >= position or bottom <= position - height for top, bottom in bands):
+            return position
+
+
+class CollisionSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        subs, self.events = load_events()
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        self.parsers = style_parsers(setup_event_styles(subs), tag_parser)
+        self.scheduled = scheduled_events(self.parsers, self.events)
+
+    # Events shown at the same time never cover each other
+    def test_no_overlaps(self):
+        overlapping = 0
+        for i, (scheduler, start, end, height, _, position) in enumerate(self.scheduled):
+            for other_scheduler, other_start, other_end, other_height, _, other_position in self.scheduled[:i]:
+                if other_scheduler != scheduler or other_end <= start or end <= other_start:
+                    continue
+                overlapping += 1
+                self.assertTrue(position <= other_position - other_height or other_position <= position - height)
+        self.assertGreater(overlapping, 20)
+
+    # Each event takes the lowest free space, including space freed below events still shown
+    def test_lowest_free_position(self):
+        reused = 0
+        for i, (scheduler, start, end, height, origin, position) in enumerate(self.scheduled):
+            active = [(p - h, p) for s, _, e, h, _, p in self.scheduled[:i] if s == scheduler and e > start]
+            self.assertEqual(position, lowest_free_position(active, height, origin))
+            if any(p < position for _, p in active):
+                reused += 1
+        self.assertGreater(reused, 0)
+
+    # Events not overlapping in time all go to their origin
+    def test_separate_events(self):
+        for scheduler, start, end, height, origin, position in self.scheduled:
+            if not any(s == scheduler and st < end and start < e for s, st, e, _, _, _ in self.scheduled if st != start or e != end):
+                self.assertEqual(position, origin)
+
+    def test_reuse_after_end(self):
+        scheduler = CollisionScheduler(1000)
+        self.assertEqual(scheduler.place(0, 100, 50), 1000)
+        self.assertEqual(scheduler.place(10, 300, 50), 950)
+        self.assertEqual(scheduler.place(20, 300, 50), 900)
+        # The lowest band is free again while the ones above it are still shown
+        self.assertEqual(scheduler.place(100, 300, 40), 1000)
+        self.assertEqual(scheduler.place(110, 300, 20), 850)
+
+
+# Every width looked up by layout is counted once, as a measure call, width cache hit or fixed advance hit
+class LayoutStatsTest(unittest.TestCase):
+
+    def test_width_counters(self):
+        subs_data = read_data(overlap_path)
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+
+        _, events = load_events()
+        text_tags = sum(1 for e in events for line in tag_parser(e.text.replace('\\N', '\n')) for tag in line if tag.kind == tags.TEXT)
+
+        for fixed_advances in (True, False):
+            with self.subTest(fixed_advances=fixed_advances):
+                stats = rubysubs.ConversionStats()
+                # Without the fast path every width goes through the width cache
+                measure_backend = rubysubs.QtMeasureBackend() if fixed_advances else NoFixedAdvancesBackend()
+                rubysubs.convert_sub_data(subs_data, tag_parser, measure_backend, stats)
+                counters = stats.counters
+
+                self.assertGreater(counters['width_cache_hits'], 0)
+                self.assertGreater(counters['measure_calls'], 0)
+                self.assertEqual(counters['measure_calls'] + counters['width_cache_hits'] + counters['fixed_advance_hits'], 2 * text_tags)
+
+
+# Font metrics without char_advance_64, so FontSetup builds no FixedAdvanceTable
+class NoFixedAdvancesMetrics():
+
+    def __init__(self, metrics):
+        self.height = metrics.height
+        self.horizontalAdvance = metrics.horizontalAdvance
+
+
+class NoFixedAdvancesBackend(rubysubs.QtMeasureBackend):
+
+    def font_metrics(self, font_name, point_size, bold, italic=False):
+        return NoFixedAdvancesMetrics(super().font_metrics(font_name, point_size, bold, italic))
+
+
+# Laying out collision groups in worker processes has to give the same file as one process
+class LayoutPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from rubysubs import parallel
+        cls.pool = parallel.LayoutPool(2, rubysubs.default_measure_backend(), min_chunk_events=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_chunks(self):
+        _, events = load_events()
+        self.assertGreater(len(collision_groups(events)), 10)
+        self.assertGreater(len(self.pool.chunks(events)), 1)
+
+    def test_layout_pool(self):
+        subs_data = read_data(overlap_path)
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        self.assertTrue(self.pool.supports(tag_parser))
+
+        for layout_options in layout_options_cases:
+            with self.subTest(layout_options=layout_options):
+                expected = rubysubs.convert_sub_data(subs_data, tag_parser, layout_options=layout_options)
+                out_text = rubysubs.convert_sub_data(subs_data, tag_parser, layout_options=layout_options, layout_pool=self.pool)
+                self.assertEqual(out_text, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
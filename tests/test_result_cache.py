@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers
+from rubysubs.result_cache import ResultCache
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_data(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.temp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def temp_path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    # Converts overlap.ass with the cache, returns whether it was a hit and the output
+    def convert(self, out_name, tag_parser_args=('furigana',), layout_options=None):
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', list(tag_parser_args))
+        stats = rubysubs.convert_sub_file(overlap_path, self.temp_path(out_name), tag_parser, result_cache=self.cache, layout_options=layout_options)
+        return stats.info['result_cache'] == 'hit', read_data(self.temp_path(out_name))
+
+    def test_hit_and_miss(self):
+        is_hit, output = self.convert('first.ass')
+        self.assertFalse(is_hit)
+        is_hit, cached_output = self.convert('second.ass')
+        self.assertTrue(is_hit)
+        self.assertEqual(cached_output, output)
+        self.assertEqual(len(self.cache.entries()), 1)
+
+    def test_key_sensitivity(self):
+        self.assertFalse(self.convert('out.ass')[0])
+
+        # Tag parser arguments, layout options and the output format are part of the key
+        self.assertFalse(self.convert('kana.ass', ('kana',))[0])
+        self.assertFalse(self.convert('compact.ass', layout_options={'compact': True})[0])
+        is_hit, output = self.convert('out.srt')
+        self.assertFalse(is_hit)
+        self.assertFalse(output.startswith(b'[Script Info]'))
+
+        # Arguments resolving to the same values are the same key
+        self.assertTrue(self.convert('furigana.ass', ('furigana', 'yes'))[0])
+        self.assertTrue(self.convert('again.srt')[0])
+        self.assertEqual(len(self.cache.entries()), 4)
+
+    def test_key_parts(self):
+        data = read_data(overlap_path)
+        key = self.cache.key(data, 'ja [1]', 'QtMeasureBackend')
+        self.assertEqual(key, self.cache.key(data, 'ja [1]', 'QtMeasureBackend', '', 'ass'))
+        self.assertNotEqual(key, self.cache.key(data + b'\n', 'ja [1]', 'QtMeasureBackend'))
+        self.assertNotEqual(key, self.cache.key(data, 'ja [2]', 'QtMeasureBackend'))
+        self.assertNotEqual(key, self.cache.key(data, 'ja [1]', 'SfntMeasureBackend'))
+        self.assertNotEqual(key, self.cache.key(data, 'ja [1]', 'QtMeasureBackend', "[('compact', True)]"))
+        self.assertNotEqual(key, self.cache.key(data, 'ja [1]', 'QtMeasureBackend', '', 'srt'))
+
+    # Stores results of out_path under keys '0000', '0001', ... used one second apart
+    def store_entries(self, count, out_path, first=0):
+        keys = ['%04d' % i for i in range(first, first + count)]
+        for i, key in enumerate(keys):
+            self.cache.store(key, out_path)
+            os.utime(self.cache.entry_path(key), (1000000 + first + i, 1000000 + first + i))
+        return keys
+
+    def test_eviction(self):
+        out_path = self.temp_path('out.ass')
+        with open(out_path, 'wb') as f:
+            f.write(b'x' * 100)
+
+        self.cache.max_entries = 10
+        keys = self.store_entries(10, out_path)
+        self.assertEqual([key for key, _, _ in self.cache.entries()], keys)
+
+        # Using an entry keeps it, the least recently used ones are evicted down to 9 entries
+        self.assertTrue(self.cache.fetch(keys[0], self.temp_path('fetched.ass')))
+        self.store_entries(1, out_path, 10)
+        self.assertEqual([key for key, _, _ in self.cache.entries()], keys[3:] + ['0010', keys[0]])
+        self.assertEqual(self.cache.recorded_entries, 9)
+
+        self.cache.max_entries = None
+        self.cache.max_bytes = 500
+        self.store_entries(1, out_path, 11)
+        self.assertEqual(len(self.cache.entries()), 4)
+        self.assertEqual(self.cache.recorded_bytes, 400)
+
+        self.assertEqual(len(self.cache.prune(max_age=0)), 4)
+        self.assertEqual(self.cache.entries(), [])
+
+    # Stores below the limits do not scan the cache directory again
+    def test_store_scans_once(self):
+        out_path = self.temp_path('out.ass')
+        with open(out_path, 'wb') as f:
+            f.write(b'x' * 100)
+
+        scans = []
+        entries = self.cache.entries
+        def counted_entries():
+            scans.append(1)
+            return entries()
+        self.cache.entries = counted_entries
+
+        self.cache.max_entries = 50
+        self.store_entries(50, out_path)
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(self.cache.recorded_entries, 50)
+
+        # Replacing an entry keeps the count
+        self.store_entries(1, out_path)
+        self.assertEqual(len(scans), 1)
+
+        # Exceeding the limit evicts down to 45 entries, the next 5 stores do not scan
+        self.store_entries(6, out_path, 50)
+        self.assertEqual(len(scans), 2)
+        self.assertEqual(len(entries()), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
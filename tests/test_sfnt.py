@@ -0,0 +1,81 @@
+import unittest
+
+import rubysubs
+from rubysubs import sfnt
+from rubysubs.rubysubs import FixedAdvanceTable
+
+
+# Fonts read by both backends, tests are skipped where they are not installed
+latin_family = 'DejaVu Sans'
+cjk_family = 'IPAexGothic'
+
+latin_texts = ['Hello, World', 'AVAWAY', 'Ta.Te,Yo']
+cjk_texts = ['私は学校に行きました', 'がっこう', 'テレビを見ました', '（はい）']
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+# Widths read from the font files have to match Qt with FreeType
+class SfntMeasureBackendTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = rubysubs.SfntMeasureBackend()
+        cls.qt_backend = rubysubs.QtMeasureBackend()
+        cls.font_index = sfnt.build_font_index(sfnt.default_font_dirs())
+
+    def font_metrics(self, family, point_size=40, bold=False):
+        if sfnt.find_font(self.font_index, family, bold) is None:
+            self.skipTest('%s is not installed' % family)
+        return self.backend.font_metrics(family, point_size, bold), self.qt_backend.font_metrics(family, point_size, bold)
+
+    def assert_widths(self, family, texts, bold=False):
+        for point_size in (30, 40, 60):
+            metrics, qt_metrics = self.font_metrics(family, point_size, bold)
+            self.assertEqual(metrics.height(), qt_metrics.height())
+            for text in texts:
+                with self.subTest(family=family, point_size=point_size, bold=bold, text=text):
+                    self.assertAlmostEqual(metrics.horizontalAdvance(text), qt_metrics.horizontalAdvance(text), delta=2)
+
+    def test_latin_widths(self):
+        self.assert_widths(latin_family, latin_texts)
+        self.assert_widths(latin_family, latin_texts, bold=True)
+
+    def test_cjk_widths(self):
+        self.assert_widths(cjk_family, cjk_texts)
+
+    def test_find_font(self):
+        self.font_metrics(latin_family)
+        regular = sfnt.find_font(self.font_index, latin_family, False)
+        bold = sfnt.find_font(self.font_index, latin_family, True)
+        self.assertNotEqual(regular, bold)
+        self.assertTrue(sfnt.SfntFont(*bold).is_bold)
+        self.assertFalse(sfnt.SfntFont(*regular).is_bold)
+
+        self.assertIsNone(sfnt.find_font(self.font_index, 'No Such Family', False))
+        with self.assertRaises(ValueError):
+            self.backend.font_metrics('No Such Family', 40, False)
+
+    # Full-width text is summed from the advances of its characters
+    def test_fixed_advances(self):
+        metrics, _ = self.font_metrics(cjk_family)
+        fixed_advances = FixedAdvanceTable(metrics)
+        self.assertGreater(len(fixed_advances.ranges), 0)
+        for text in cjk_texts:
+            with self.subTest(text=text):
+                self.assertEqual(fixed_advances.width(text), metrics.horizontalAdvance(text))
+
+    # Metrics of the same font file at the same size share a fingerprint
+    def test_fingerprint(self):
+        metrics, _ = self.font_metrics(latin_family)
+        self.assertEqual(metrics.fingerprint(), self.backend.font_metrics(latin_family, 40, False).fingerprint())
+        self.assertNotEqual(metrics.fingerprint(), self.backend.font_metrics(latin_family, 41, False).fingerprint())
+        self.assertNotEqual(metrics.fingerprint(), self.backend.font_metrics(latin_family, 40, True).fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
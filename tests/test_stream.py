@@ -0,0 +1,120 @@
+import io
+import os
+import tempfile
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers
+from rubysubs.rubysubs import load_subs
+from rubysubs.stream import convert_sub_stream, UnsortedEventsError
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Its last events are not sorted by start time
+overlap_path = os.path.join(data_dir, 'overlap.ass')
+
+reordered_format_line = 'Format: Start, End, Style, Layer, Name, MarginL, MarginR, MarginV, Effect, Text'
+
+attachments_text = '''
+[Fonts]
+fontname: example_0.ttf
+!!!!)!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+(!!!!
+
+[Graphics]
+filename: example.png
+8'#!!!!!!!!!!!!!!!!!!!!!!
+'''
+
+layout_options_cases = [
+    None,
+    {'compact': True, 'merge_drawings': 'frame'},
+]
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+# overlap.ass with its events sorted by start time
+def sorted_text():
+    subs = load_subs(read_text(overlap_path))
+    subs.events.sort()
+    return subs.to_string('ass')
+
+
+# Same file with the Start and End fields of events written before Layer
+def reordered_text(text):
+    lines = []
+    for line in text.split('\n'):
+        if line.startswith('Format: Layer, Start'):
+            line = reordered_format_line
+        elif line.startswith('Dialogue:'):
+            layer, start, end, style, rest = line[len('Dialogue: '):].split(',', 4)
+            line = 'Dialogue: %s,%s,%s,%s,%s' % (start, end, style, layer, rest)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+# Streaming has to give the same file as convert_sub_file for files sorted by start time
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def convert_file(self, text, layout_options=None):
+        in_path = os.path.join(self.temp_dir.name, 'in.ass')
+        out_path = os.path.join(self.temp_dir.name, 'out.ass')
+        with open(in_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        rubysubs.convert_sub_file(in_path, out_path, self.tag_parser, layout_options=layout_options)
+        return read_text(out_path)
+
+    def convert_stream(self, text, layout_options=None):
+        out_fp = io.BytesIO()
+        convert_sub_stream(io.BytesIO(text.encode('utf-8')), out_fp, self.tag_parser, layout_options=layout_options, batch_size=8)
+        return out_fp.getvalue().decode('utf-8')
+
+    def test_sorted(self):
+        text = sorted_text()
+        for layout_options in layout_options_cases:
+            with self.subTest(layout_options=layout_options):
+                self.assertEqual(self.convert_stream(text, layout_options), self.convert_file(text, layout_options))
+
+    def test_unsorted(self):
+        with self.assertRaises(UnsortedEventsError):
+            self.convert_stream(read_text(overlap_path))
+
+    # Event fields are read in the order of the Format line of [Events], by both
+    def test_format_line(self):
+        text = sorted_text()
+        expected = self.convert_file(text)
+        self.assertEqual(self.convert_file(reordered_text(text)), expected)
+        self.assertEqual(self.convert_stream(reordered_text(text)), expected)
+
+    # Attachments following [Events] are kept, streaming writes them after the events
+    def test_attachments(self):
+        text = sorted_text() + attachments_text
+        expected = load_subs(self.convert_file(text))
+        subs = load_subs(self.convert_stream(text))
+
+        self.assertEqual(len(subs.fonts_opaque), 1)
+        self.assertEqual(subs.fonts_opaque, expected.fonts_opaque)
+        self.assertEqual(subs.graphics_opaque, expected.graphics_opaque)
+        self.assertTrue(subs.equals(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
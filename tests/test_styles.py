@@ -0,0 +1,60 @@
+import unittest
+
+import rubysubs
+from rubysubs import tag_parsers
+from rubysubs.rubysubs import load_subs, setup_event_styles, style_parsers
+
+
+# Narr is italic, Plain uses the same font upright
+styles_text = '''[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,2,2,10,10,40,1
+Style: Narr,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,-1,0,0,100,100,0,0,1,2,2,8,10,10,40,1
+Style: Plain,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,2,8,10,10,40,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Dialogue: 0,0:00:00.00,0:00:02.00,Default,,0,0,0,,私[わたし;h;0;0]は 行[い;a;2;1]きました
+Dialogue: 0,0:00:00.00,0:00:02.00,Narr,,0,0,0,,学校[がっこう;o;1;0]に 、 見[み,見る;h;2;1]ました
+Dialogue: 0,0:00:01.00,0:00:03.00,Plain,,0,0,0,,テレビ[;h;1;0] を 勉強[べんきょう,勉強;n,a;0;0]します
+'''
+
+qapp = None
+
+def setUpModule():
+    global qapp
+    qapp = rubysubs.create_qt_application()
+
+
+class ItalicStyleTest(unittest.TestCase):
+
+    def test_output_styles(self):
+        tag_parser = tag_parsers.tag_parser_from_string_args('ja', ['furigana'])
+        out_text = rubysubs.convert_sub_data(styles_text.encode('utf-8'), tag_parser)
+        subs = load_subs(out_text)
+
+        for name in ('Narr', 'Narr Ruby', 'Narr Underline', 'Narr Highlight'):
+            self.assertTrue(subs.styles[name].italic, name)
+        for name in ('Default', 'Ruby', 'Underline', 'Highlight', 'Plain', 'Plain Ruby'):
+            self.assertFalse(subs.styles[name].italic, name)
+
+        self.assertIn('Narr', {e.style for e in subs.events})
+
+    # Italic text is measured with the italic face, not with the setup of the upright style
+    def test_italic_measuring(self):
+        subs = load_subs(styles_text)
+        parsers = style_parsers(setup_event_styles(subs))
+
+        self.assertIsNot(parsers['Narr'].font_setup, parsers['Plain'].font_setup)
+        self.assertTrue(parsers['Narr'].font_metrics.font.italic())
+        self.assertTrue(parsers['Narr'].ruby_font_metrics.font.italic())
+        self.assertFalse(parsers['Plain'].font_metrics.font.italic())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import json
+import unittest
+import importlib
+
+from rubysubs import tag_parsers
+
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+# Tags as lists of their class name and values, end tags are passed around as classes
+def tag_data(tag):
+    if isinstance(tag, type):
+        return [tag.__name__]
+    name = type(tag).__name__
+    if name == 'TagText':
+        return [name, tag.text, tag.ruby_text]
+    if name == 'TagUnderlineStart':
+        return [name, tag.r, tag.g, tag.b]
+    return [name, tag.r, tag.g, tag.b, tag.a]
+
+
+def parsed_data(parsed_lines):
+    return [[tag_data(tag) for tag in line] for line in parsed_lines]
+
+
+# data/tag_parser_outputs.json holds the tags of sample texts for several arguments of each tag
+# parser, recorded with the tag parsers of rubysubs 0.1.4 before the shared tokenizer and the
+# compiled parsers. Both have to give exactly the same tags.
+class TagParserOutputTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(data_dir, 'tag_parser_outputs.json'), encoding='utf-8') as f:
+            cls.outputs = json.load(f)
+
+    def test_compiled_parsers(self):
+        for name, data in self.outputs.items():
+            for case in data['cases']:
+                tag_parser = tag_parsers.tag_parser_from_string_args(name, case['args'])
+                for text, expected in zip(data['texts'], case['lines']):
+                    with self.subTest(tag_parser=name, args=case['args'], text=text):
+                        self.assertEqual(parsed_data(tag_parser(text)), expected)
+
+    # Module level parse functions called with the resolved arguments
+    def test_parse_functions(self):
+        for name, data in self.outputs.items():
+            module = importlib.import_module('rubysubs.' + tag_parsers.tag_parser_registry[name][0])
+            for case in data['cases']:
+                args = tag_parsers.tag_parser_from_string_args(name, case['args']).args
+                for text, expected in zip(data['texts'], case['lines']):
+                    with self.subTest(tag_parser=name, args=case['args'], text=text):
+                        self.assertEqual(parsed_data(module.parse(text, *args)), expected)
+
+    # Parsers are reused for other texts and by arguments resolving to the same values
+    def test_tag_parser_cache(self):
+        cache = tag_parsers.TagParserCache()
+        for name, data in self.outputs.items():
+            for case in data['cases']:
+                tag_parser = cache.get(name, case['args'])
+                for text, expected in zip(data['texts'], case['lines']):
+                    with self.subTest(tag_parser=name, args=case['args'], text=text):
+                        self.assertEqual(parsed_data(tag_parser(text)), expected)
+
+        self.assertIs(cache.get('ja', ['kana', 'no']), cache.get('ja', ['kana', 'false']))
+
+    # Parsers built from string arguments are built again from their spec, with the same cache key
+    def test_spec(self):
+        for name, data in self.outputs.items():
+            for case in data['cases']:
+                with self.subTest(tag_parser=name, args=case['args']):
+                    tag_parser = tag_parsers.tag_parser_from_string_args(name, case['args'])
+                    self.assertEqual(tag_parser.spec, (tag_parsers.normalize_name(name), case['args']))
+                    self.assertEqual(tag_parser.cache_key, tag_parsers.tag_parser_key(name, case['args']))
+
+                    rebuilt = tag_parsers.tag_parser_from_string_args(*tag_parser.spec)
+                    self.assertEqual(rebuilt.cache_key, tag_parser.cache_key)
+
+        # Parsers built from resolved arguments have no spec
+        module = importlib.import_module('rubysubs.tag_parse_migaku_zh')
+        tag_parser = module.compiled_parser(*tag_parsers.tag_parser_from_string_args('zh_hk').args)
+        self.assertIsNone(tag_parser.spec)
+        self.assertEqual(tag_parser.cache_key, tag_parsers.tag_parser_key('zh_hk'))
+
+
+if __name__ == '__main__':
+    unittest.main()